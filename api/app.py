@@ -1,3 +1,6 @@
+import os
+import threading
+
 from flask import Flask, jsonify
 from flask_cors import CORS
 from datetime import timedelta
@@ -24,7 +27,20 @@ try:
 except (ImportError, ModuleNotFoundError):
     from api.routes.user_routes import user_bp
 
+try:
+    from tools.upload_functions import SpooledUploadRequest
+except (ImportError, ModuleNotFoundError):
+    from api.tools.upload_functions import SpooledUploadRequest
+
+try:
+    from ragbot_tools.rag_chatbot_function import warm_up_chatbot
+except (ImportError, ModuleNotFoundError):
+    from api.ragbot_tools.rag_chatbot_function import warm_up_chatbot
+
 app = Flask(__name__)
+
+# keep uploads in memory (spilling large files to temp space) rather than saving them under api/uploads
+app.request_class = SpooledUploadRequest
 api = Api(app)
 
 # Swagger config (auto-generates swagger.json at /apidocs/swagger.json)
@@ -77,6 +93,10 @@ app.register_blueprint(book_bp, url_prefix="")
 app.register_blueprint(file_bp, url_prefix="")
 app.register_blueprint(user_bp, url_prefix="")
 
+# long-running servers can build the chatbot in the background at boot instead of on the first prompt
+if os.environ.get("BOOKWORM_WARM_UP_CHATBOT", "").lower() in ("1", "true", "yes"):
+    threading.Thread(target=warm_up_chatbot, daemon=True).start()
+
 if __name__ == '__main__':
 
     # http://localhost:5000/apidocs/
@@ -0,0 +1,118 @@
+import os
+import time
+import threading
+
+import numpy as np
+
+# cached answers are served for new questions within this cosine distance of a cached question
+ANSWER_CACHE_MAX_DISTANCE = float(os.environ.get("BOOKWORM_ANSWER_CACHE_MAX_DISTANCE", 0.08))
+
+# cached answers expire after this many seconds
+ANSWER_CACHE_TTL = int(os.environ.get("BOOKWORM_ANSWER_CACHE_TTL", 6 * 60 * 60))
+
+# answers kept per library - the oldest are dropped first
+ANSWER_CACHE_MAX_ENTRIES = int(os.environ.get("BOOKWORM_ANSWER_CACHE_MAX_ENTRIES", 500))
+
+# the documents table version is re-checked at most this often, in seconds
+DOCUMENTS_VERSION_CHECK_INTERVAL = int(os.environ.get("BOOKWORM_DOCUMENTS_VERSION_CHECK_INTERVAL", 30))
+
+
+class SemanticAnswerCache:
+
+    """In-memory cache of chatbot answers, looked up by cosine similarity of the question's embedding.
+
+    Entries are scoped per library, expire after a TTL, and are all dropped when
+    get_documents_version() reports that the documents table has changed.
+    """
+
+    def __init__(self, get_documents_version, max_distance: float = ANSWER_CACHE_MAX_DISTANCE,
+                 ttl: int = ANSWER_CACHE_TTL, max_entries: int = ANSWER_CACHE_MAX_ENTRIES):
+
+        self.get_documents_version = get_documents_version
+        self.max_distance = max_distance
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.libraries = {}
+        self.documents_version = None
+        self.version_checked_at = 0.0
+        self.lock = threading.Lock()
+
+    def check_documents_version(self):
+
+        """Drop every cached answer if the documents table has changed since the last check."""
+
+        now = time.monotonic()
+        if now - self.version_checked_at < DOCUMENTS_VERSION_CHECK_INTERVAL:
+            return
+
+        self.version_checked_at = now
+        documents_version = self.get_documents_version()
+
+        with self.lock:
+            if documents_version != self.documents_version:
+                self.libraries.clear()
+                self.documents_version = documents_version
+
+    def get(self, library_id, query_embedding: list):
+
+        """Get the cached answer closest to the query embedding, or None if none is close enough."""
+
+        self.check_documents_version()
+
+        with self.lock:
+            library_cache = self.libraries.get(library_id)
+            if not library_cache:
+                return None
+
+            # drop expired answers
+            expiry = time.monotonic() - self.ttl
+            while library_cache["created_at"] and library_cache["created_at"][0] < expiry:
+                library_cache["created_at"].pop(0)
+                library_cache["answers"].pop(0)
+                library_cache["embeddings"] = library_cache["embeddings"][1:]
+
+            if not library_cache["answers"]:
+                return None
+
+            query_vector = normalize_vector(query_embedding)
+            distances = 1 - library_cache["embeddings"] @ query_vector
+            nearest = int(np.argmin(distances))
+
+            if distances[nearest] > self.max_distance:
+                return None
+
+            return library_cache["answers"][nearest]
+
+    def set(self, library_id, query_embedding: list, answer: str):
+
+        """Cache an answer to a question, given the question's embedding."""
+
+        self.check_documents_version()
+
+        query_vector = normalize_vector(query_embedding)
+
+        with self.lock:
+            library_cache = self.libraries.setdefault(library_id, {
+                "embeddings": np.empty((0, len(query_vector)), dtype=np.float32), "answers": [], "created_at": []
+            })
+
+            library_cache["embeddings"] = np.vstack([library_cache["embeddings"], query_vector])[-self.max_entries:]
+            library_cache["answers"] = (library_cache["answers"] + [answer])[-self.max_entries:]
+            library_cache["created_at"] = (library_cache["created_at"] + [time.monotonic()])[-self.max_entries:]
+
+    def clear(self):
+
+        """Drop every cached answer."""
+
+        with self.lock:
+            self.libraries.clear()
+
+
+def normalize_vector(embedding: list):
+
+    """Scale an embedding to unit length, so a dot product is its cosine similarity."""
+
+    vector = np.asarray(embedding, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+
+    return vector / norm if norm else vector
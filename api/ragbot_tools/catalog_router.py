@@ -0,0 +1,365 @@
+import os
+import re
+import threading
+import unicodedata
+
+# answer catalog lookups ("books by Roald Dahl", "what lexile is Bleak House") straight from the books table
+CATALOG_ROUTER_ENABLED = os.environ.get("BOOKWORM_CATALOG_ROUTER", "true").lower() in ("1", "true", "yes")
+
+# questions the classifier gives a lower probability than this of being catalog lookups are sent to the agent
+CATALOG_ROUTER_MIN_CONFIDENCE = float(os.environ.get("BOOKWORM_CATALOG_ROUTER_MIN_CONFIDENCE", 0.6))
+
+# books listed in a catalog answer - the rest are counted
+CATALOG_MAX_RESULTS = 20
+
+# age spans of UK school stages, for questions like "picture books for EYFS"
+SCHOOL_STAGE_AGES = {
+    "eyfs": (0, 5),
+    "early years": (0, 5),
+    "reception": (4, 5),
+    "ks1": (5, 7),
+    "key stage 1": (5, 7),
+    "ks2": (7, 11),
+    "key stage 2": (7, 11),
+    "ks3": (11, 14),
+    "key stage 3": (11, 14),
+    "ks4": (14, 16),
+    "key stage 4": (14, 16),
+}
+
+# example questions the intent classifier is trained on - "open" questions go to the agent
+CATALOG_TRAINING_EXAMPLES = {
+    "author": [
+        "books by roald dahl", "what books by julia donaldson do we have", "show me books by michael morpurgo",
+        "list books written by jacqueline wilson", "do we have anything by david walliams", "which books are by enid blyton",
+        "find titles by charles dickens", "have we got any books from terry pratchett", "what has philip pullman written",
+        "any books by jk rowling", "books written by malorie blackman", "novels by jane austen",
+        "what do we have by anthony horowitz", "show books by author cressida cowell", "list all books by dr seuss",
+    ],
+    "lexile": [
+        "what lexile is bleak house", "what is the lexile measure of matilda", "lexile level of the gruffalo",
+        "what's the lexile of charlotte's web", "lexile for holes", "what lexile score does wonder have",
+        "tell me the lexile measure for the hobbit", "how hard is the bfg on the lexile scale", "lexile of war horse",
+        "what is the lexile for private peaceful", "give me the lexile measure of coraline", "matilda lexile",
+        "what reading level is the twits in lexile", "lexile measure of the secret garden", "check the lexile of kensuke's kingdom",
+    ],
+    "age_range": [
+        "picture books for eyfs", "books for ks2", "books for ages 7 to 9", "what books suit 8 year olds",
+        "show me books for key stage 1", "stories for reception children", "books suitable for ages 11-14",
+        "which books are for age 6", "list books for year olds 9 to 12", "books for early years",
+        "what can a 10 year old read from our library", "books for children aged 5", "titles for ks3 pupils",
+        "books aimed at ages 4-7", "reading books for ks1",
+    ],
+    "category": [
+        "fantasy books", "show me poetry books", "list our history books", "what science fiction books do we have",
+        "books in the adventure category", "do we have any graphic novels", "which books are in juvenile fiction",
+        "find biography books", "show books categorised as humor", "list all picture book titles",
+        "what mystery books are there", "books in the animals category", "our sports books",
+        "any books in the fairy tales category", "show me nonfiction books",
+    ],
+    "open": [
+        "recommend a book for a child who loves dragons", "what is matilda about", "who is the villain in the bfg",
+        "suggest something like harry potter but shorter", "why do children enjoy roald dahl's books",
+        "summarise the plot of holes", "which book would help a reluctant reader", "tell me a joke about books",
+        "what happens at the end of charlotte's web", "compare the gruffalo and room on the broom",
+        "is wonder a good book to teach empathy", "write a short quiz about the hobbit",
+        "what themes does private peaceful explore", "find me a funny book about a dog that goes on adventures",
+        "how should I introduce poetry to year 3", "books by roald dahl that would suit a child who loves animals",
+        "what book should my class read next", "explain what a lexile measure means", "hello", "thanks",
+        "which characters appear in the secret garden", "help me plan a lesson on war horse",
+    ],
+}
+
+# question openings and endings that carry no condition of their own - e.g. "show me", "do we have any",
+# "in our library". Only these are allowed around an entity pattern, so a question with any other words
+# ("for 8 year olds about friendship") goes to the agent.
+QUESTION_LEAD = (r"(?:please\s+)?"
+                 r"(?:(?:can\s+you\s+)?(?:show|list|find|give|tell)\s+(?:me\s+|us\s+)?"
+                 r"|what(?:s|\s+is|\s+are)?\s+|which\s+(?:are\s+)?|any\s+|do\s+(?:we|you)\s+have\s+(?:any\s+)?"
+                 r"|have\s+we\s+got\s+(?:any\s+)?|are\s+there\s+(?:any\s+)?)?"
+                 r"(?:all\s+)?(?:(?:of\s+)?(?:our|the|my)\s+)?")
+QUESTION_TAIL = (r"(?:\s+(?:do\s+we\s+have|have\s+we\s+got|are\s+there|are\s+available"
+                 r"|in\s+(?:our|my|the)\s+(?:school\s+)?library|please))?")
+
+# a short run of words - a name, title or category, rather than a whole clause
+SHORT_PHRASE = r"[a-z0-9][a-z0-9.-]*(?:\s+[a-z0-9][a-z0-9.-]*){0,5}"
+
+AGE_PHRASE = (r"(?:an?\s+|children\s+|pupils\s+)?(?:aged?s?\s*)?\d+(?:\s*(?:-|to)\s*\d+)?(?:\s*(?:years?[\s-]*olds?|yos?))?"
+              r"|eyfs|early\s+years|reception|ks\s*[1-4]|key\s+stage\s+[1-4]")
+
+# entity patterns for each catalog intent, matched against the whole normalised question
+ENTITY_PATTERNS = {
+    "author": [
+        QUESTION_LEAD + rf"(?:books?|titles?|novels?|stories|anything|something)\s+(?:are\s+)?(?:written\s+)?(?:by|from)\s+(?:the\s+)?(?:author\s+)?(?P<entity>{SHORT_PHRASE}?)" + QUESTION_TAIL,
+        rf"what\s+(?:has|did)\s+(?P<entity>{SHORT_PHRASE}?)\s+(?:written|write)",
+        rf"what\s+do\s+we\s+have\s+by\s+(?P<entity>{SHORT_PHRASE}?)" + QUESTION_TAIL,
+    ],
+    "lexile": [
+        QUESTION_LEAD + rf"(?:the\s+)?lexile(?:\s+(?:measure|level|score))?\s+(?:of|for)\s+(?P<entity>{SHORT_PHRASE}?)" + QUESTION_TAIL,
+        rf"what(?:s|\s+is)?\s+(?:the\s+)?lexile(?:\s+(?:measure|level|score))?\s+(?:is|does)\s+(?P<entity>{SHORT_PHRASE}?)(?:\s+have)?" + QUESTION_TAIL,
+        rf"(?P<entity>{SHORT_PHRASE}?)\s+lexile(?:\s+(?:measure|level|score))?" + QUESTION_TAIL,
+    ],
+    "age_range": [
+        QUESTION_LEAD + rf"(?:(?P<category>{SHORT_PHRASE}?)\s+)?(?:books?|stories|titles?)\s+(?:that\s+)?(?:for|suit|suitable\s+for|aimed\s+at)"
+                        rf"\s+(?P<entity>{AGE_PHRASE})(?:\s+(?:children|pupils|readers))?" + QUESTION_TAIL,
+    ],
+    "category": [
+        QUESTION_LEAD + rf"(?:books?|titles?)\s+(?:in|from)\s+(?:the\s+)?(?P<entity>{SHORT_PHRASE}?)\s+(?:category|section|genre)" + QUESTION_TAIL,
+        QUESTION_LEAD + rf"(?:books?|titles?)\s+categori[sz]ed\s+as\s+(?P<entity>{SHORT_PHRASE}?)" + QUESTION_TAIL,
+        QUESTION_LEAD + rf"(?P<entity>{SHORT_PHRASE}?)\s+(?:books?|titles?|novels)(?:\s+titles)?" + QUESTION_TAIL,
+    ],
+}
+
+# articles trimmed from the ends of an entity
+ENTITY_STOP_WORDS = {"the", "a", "an"}
+
+# entities that refer back to the conversation ("what lexile is it") - the agent has the context for these
+ENTITY_PRONOUNS = {"it", "this", "that", "them", "they", "these", "those", "he", "she", "him", "her"}
+
+# words left over from the question itself rather than naming an author, title or category - "show me books",
+# "our books", "any books by the author". An entity made only of these goes to the agent, and they are
+# dropped from the category before "books"
+ENTITY_FILLER_WORDS = {"me", "us", "we", "you", "i", "our", "my", "your", "their", "show", "list", "find", "all",
+                       "any", "some", "author", "writer", "book", "books", "title", "titles", "category"}
+
+# words before "books" that do not narrow the category, as in "reading books for ks1"
+GENERIC_CATEGORY_WORDS = {"reading", "childrens", "kids"}
+
+# words before "books" that ask for a judgement or recency rather than a category ("good books", "new books")
+CATEGORY_QUALIFIER_WORDS = {"good", "great", "best", "favourite", "favorite", "popular", "recommended", "new", "newest",
+                            "latest", "recent", "old", "short", "long", "easy", "hard", "difficult", "funny", "sad",
+                            "scary", "exciting", "interesting", "similar", "other", "more"}
+
+_classifier = None
+_classifier_lock = threading.Lock()
+
+
+def normalize_text(text: str):
+
+    """Lower-case text, strip accents and punctuation, and collapse whitespace."""
+
+    text = unicodedata.normalize("NFKD", str(text)).encode("ascii", "ignore").decode("ascii").lower()
+    text = re.sub(r"[^a-z0-9+\s-]", " ", text.replace("'", ""))
+
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def get_intent_classifier():
+
+    """Get the catalog intent classifier - TF-IDF features and logistic regression, trained on first use.
+
+    The first call takes a couple of seconds, mostly importing scikit-learn - warm_up_chatbot pays it ahead of time.
+    """
+
+    global _classifier
+
+    if _classifier is None:
+        with _classifier_lock:
+            if _classifier is None:
+                from sklearn.pipeline import make_pipeline, make_union
+                from sklearn.feature_extraction.text import TfidfVectorizer
+                from sklearn.linear_model import LogisticRegression
+
+                questions = [normalize_text(question) for examples in CATALOG_TRAINING_EXAMPLES.values() for question in examples]
+                intents = [intent for intent, examples in CATALOG_TRAINING_EXAMPLES.items() for _ in examples]
+
+                # word n-grams capture the question's shape, character n-grams cope with unseen names and typos
+                classifier = make_pipeline(
+                    make_union(TfidfVectorizer(ngram_range=(1, 2), sublinear_tf=True),
+                               TfidfVectorizer(analyzer="char_wb", ngram_range=(3, 4), sublinear_tf=True)),
+                    LogisticRegression(C=10, max_iter=1000),
+                )
+                classifier.fit(questions, intents)
+
+                _classifier = classifier
+
+    return _classifier
+
+
+def classify_query(user_query: str):
+
+    """Get the most likely intent of a question and its probability."""
+
+    classifier = get_intent_classifier()
+    probabilities = classifier.predict_proba([normalize_text(user_query)])[0]
+    best = probabilities.argmax()
+
+    return classifier.classes_[best], float(probabilities[best])
+
+
+def trim_entity(text: str):
+
+    words = (text or "").split()
+    while words and words[0] in ENTITY_STOP_WORDS:
+        words = words[1:]
+    while words and words[-1] in ENTITY_STOP_WORDS:
+        words = words[:-1]
+
+    return " ".join(words)
+
+
+def extract_entity(intent: str, user_query: str):
+
+    """Get (entity, category) for a catalog question - the author, title, age or category it asks about, and for age
+    questions any category before "books" - or None unless a pattern covers the whole question.
+    """
+
+    query = normalize_text(user_query)
+
+    for pattern in ENTITY_PATTERNS[intent]:
+        match = re.fullmatch(pattern, query)
+        if match is None:
+            continue
+
+        entity = trim_entity(match.group("entity"))
+        if not entity or entity in ENTITY_PRONOUNS or set(entity.split()) <= ENTITY_FILLER_WORDS | ENTITY_STOP_WORDS:
+            return None
+
+        category = trim_entity(match.groupdict().get("category"))
+        category = " ".join(word for word in category.split()
+                            if word not in GENERIC_CATEGORY_WORDS | ENTITY_FILLER_WORDS | ENTITY_STOP_WORDS)
+
+        # a qualifier is a condition the catalog columns cannot answer
+        category_words = set((entity if intent == "category" else category).split())
+        if category_words & CATEGORY_QUALIFIER_WORDS:
+            return None
+
+        return entity, category or None
+
+    return None
+
+
+def route_query(user_query: str):
+
+    """Decide whether a question is a catalog lookup, returning (intent, entity, category), or None for the agent."""
+
+    intent, confidence = classify_query(user_query)
+
+    if intent == "open" or confidence < CATALOG_ROUTER_MIN_CONFIDENCE:
+        return None
+
+    extracted = extract_entity(intent, user_query)
+    if extracted is None:
+        return None
+
+    return (intent,) + extracted
+
+
+def parse_age_span(text: str):
+
+    """Get the (youngest, oldest) ages described by text like "7-9", "Ages 8+", "10 year olds" or "KS2", or None."""
+
+    text = normalize_text(text or "")
+
+    for stage, ages in SCHOOL_STAGE_AGES.items():
+        if re.search(rf"\b{stage.replace(' ', '')}\b|\b{stage}\b", text.replace("ks ", "ks")):
+            return ages
+
+    numbers = [int(number) for number in re.findall(r"\d+", text)]
+    if not numbers:
+        return None
+
+    if len(numbers) == 1:
+        return (numbers[0], 18) if "+" in text else (numbers[0], numbers[0])
+
+    return min(numbers[:2]), max(numbers[:2])
+
+
+def words_match(query_words: list, text: str):
+
+    """Check every query word appears in text, as a whole word."""
+
+    text_words = set(normalize_text(text or "").split())
+
+    return bool(query_words) and all(word in text_words for word in query_words)
+
+
+def singular(word: str):
+
+    return word[:-1] if len(word) > 3 and word.endswith("s") and not word.endswith("ss") else word
+
+
+def category_matches(category: str, categories: str):
+
+    """Check every word of a category appears as a whole word in a book's categories, ignoring plurals."""
+
+    category_words = [singular(word) for word in category.split()]
+    category_text_words = {singular(word) for word in normalize_text(categories or "").split()}
+
+    return bool(category_words) and all(word in category_text_words for word in category_words)
+
+
+def format_book(book: dict):
+
+    """Format a book as a list line - title, authors and year where known."""
+
+    line = f"- {book.get('title') or 'Unknown Title'}"
+
+    if book.get('authors') and book['authors'] != "Unknown Author":
+        line += f" by {book['authors']}"
+    if book.get('year'):
+        line += f" ({book['year']})"
+
+    return line
+
+
+def format_book_list(heading: str, books: list):
+
+    lines = [heading] + [format_book(book) for book in books[:CATALOG_MAX_RESULTS]]
+
+    if len(books) > CATALOG_MAX_RESULTS:
+        lines.append(f"...and {len(books) - CATALOG_MAX_RESULTS} more.")
+
+    return "\n".join(lines)
+
+
+def answer_catalog_query(intent: str, entity: str, books: list, scope: str = "your library", category: str = None):
+
+    """Answer a routed catalog question from book rows, or None if nothing matches (so the agent can try instead).
+
+    category narrows age questions, as in "picture books for EYFS".
+    """
+
+    entity_words = entity.split()
+
+    if intent == "author":
+        matches = [book for book in books if words_match(entity_words, book.get('authors'))]
+        if matches:
+            return format_book_list(f"Books by {entity.title()} in {scope}:", sorted(matches, key=lambda book: str(book.get('title'))))
+
+    elif intent == "lexile":
+        exact = [book for book in books if normalize_text(book.get('title') or "") == entity]
+        matches = exact or [book for book in books if words_match(entity_words, book.get('title'))]
+
+        if matches:
+            lines = []
+            for book in matches[:CATALOG_MAX_RESULTS]:
+                if book.get('lexile_measure'):
+                    lines.append(f"{book.get('title')} has a Lexile measure of {book['lexile_measure']}.")
+                else:
+                    lines.append(f"{book.get('title')} does not have a Lexile measure recorded.")
+            return "\n".join(lines)
+
+    elif intent == "age_range":
+        query_span = parse_age_span(entity)
+        if query_span is None:
+            return None
+
+        matches = []
+        for book in books:
+            book_span = parse_age_span(book.get('age_range'))
+            if book_span is not None and book_span[0] <= query_span[1] and query_span[0] <= book_span[1] \
+                    and (category is None or category_matches(category, book.get('categories'))):
+                matches.append(book)
+
+        if matches:
+            heading = f"{category.capitalize()} books" if category else "Books"
+            return format_book_list(f"{heading} for {entity.upper() if entity in SCHOOL_STAGE_AGES else entity} in {scope}:",
+                                    sorted(matches, key=lambda book: str(book.get('title'))))
+
+    elif intent == "category":
+        matches = [book for book in books if category_matches(entity, book.get('categories'))]
+        if matches:
+            return format_book_list(f"{entity.capitalize()} books in {scope}:", sorted(matches, key=lambda book: str(book.get('title'))))
+
+    return None
@@ -0,0 +1,118 @@
+import os
+import time
+
+from langchain_core.messages import HumanMessage, SystemMessage
+
+# most recent turns (a user message and its replies) always kept word for word
+CHAT_HISTORY_RECENT_TURNS = int(os.environ.get("BOOKWORM_CHAT_HISTORY_RECENT_TURNS", 4))
+
+# token budget for the verbatim turns - older turns are folded into the summary to stay within it
+CHAT_HISTORY_TOKEN_BUDGET = int(os.environ.get("BOOKWORM_CHAT_HISTORY_TOKEN_BUDGET", 1500))
+
+# the tokenizer used by the chat models
+TOKENIZER_ENCODING = "cl100k_base"
+
+# rough characters per token, used if the tokenizer's vocabulary cannot be loaded
+CHARACTERS_PER_TOKEN = 4
+
+# seconds to wait before trying to load the tokenizer's vocabulary again after a failed download
+TOKENIZER_RETRY_INTERVAL = 300
+
+_tokenizer = None
+_tokenizer_failed_at = None
+
+
+def get_tokenizer():
+
+    """Get the local tiktoken tokenizer, or None if its vocabulary is not available (it is downloaded once, then cached)."""
+
+    global _tokenizer, _tokenizer_failed_at
+
+    if _tokenizer is None and (_tokenizer_failed_at is None or time.monotonic() - _tokenizer_failed_at >= TOKENIZER_RETRY_INTERVAL):
+        try:
+            import tiktoken
+        except ImportError:
+            # not installed - estimate for the life of the process
+            _tokenizer = False
+            return None
+
+        try:
+            _tokenizer = tiktoken.get_encoding(TOKENIZER_ENCODING)
+        except (OSError, ValueError):
+            # offline, a failed download (requests errors are OSErrors) or a corrupt one - estimate
+            # for now, retrying after TOKENIZER_RETRY_INTERVAL rather than on every call
+            _tokenizer_failed_at = time.monotonic()
+
+    return _tokenizer or None
+
+
+def count_tokens(text: str):
+
+    """Count the tokens in a piece of text."""
+
+    tokenizer = get_tokenizer()
+
+    if tokenizer is None:
+        return len(text) // CHARACTERS_PER_TOKEN + 1
+
+    return len(tokenizer.encode(text, disallowed_special=()))
+
+
+def count_message_tokens(messages: list):
+
+    """Count the tokens in a list of messages, including a few per message for role markers."""
+
+    return sum(count_tokens(message.content) + 4 for message in messages)
+
+
+def split_into_turns(messages: list):
+
+    """Group messages into turns - each user message with the replies that follow it."""
+
+    turns = []
+
+    for message in messages:
+        # system messages from older sessions are superseded by the agent's own system prompt
+        if isinstance(message, SystemMessage):
+            continue
+
+        if isinstance(message, HumanMessage) or not turns:
+            turns.append([])
+
+        turns[-1].append(message)
+
+    return turns
+
+
+def compact_chat_history(messages: list, summary: str, summarize_turns,
+                         recent_turns: int = CHAT_HISTORY_RECENT_TURNS, token_budget: int = CHAT_HISTORY_TOKEN_BUDGET):
+
+    """Keep the most recent turns verbatim within the token budget, folding older turns into the rolling summary.
+
+    summarize_turns(summary, messages) should return the summary updated with the given messages.
+    Returns (verbatim messages, summary).
+    """
+
+    turns = split_into_turns(messages)
+    kept_turns = turns[-recent_turns:] if recent_turns > 0 else []
+
+    # the latest turn is kept even if it is over budget on its own
+    while len(kept_turns) > 1 and count_message_tokens([message for turn in kept_turns for message in turn]) > token_budget:
+        kept_turns = kept_turns[1:]
+
+    folded_turns = turns[:len(turns) - len(kept_turns)]
+
+    if folded_turns:
+        summary = summarize_turns(summary, [message for turn in folded_turns for message in turn])
+
+    return [message for turn in kept_turns for message in turn], summary
+
+
+def build_chat_history_messages(messages: list, summary: str):
+
+    """Build the agent's chat_history - the rolling summary, if any, followed by the verbatim turns."""
+
+    if not summary:
+        return list(messages)
+
+    return [SystemMessage(content=f"Summary of the earlier conversation:\n{summary}")] + list(messages)
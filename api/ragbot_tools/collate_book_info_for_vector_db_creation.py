@@ -9,12 +9,12 @@ from langchain_community.document_loaders import PyPDFDirectoryLoader
 from langchain_community.document_loaders import TextLoader
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_community.vectorstores import SupabaseVectorStore
-from langchain_openai import OpenAIEmbeddings
 from langchain.schema import Document
 
 # import supabase
 from supabase.client import Client, create_client
 from api.tools.supabase_functions import get_all_records
+from api.ragbot_tools.vector_stores import get_embeddings_model, ingest_documents
 
 # load environment variables
 load_dotenv()
@@ -23,8 +23,8 @@ load_dotenv()
 supabase_url = os.environ.get("SUPABASE_URL")
 supabase_key = os.environ.get("SUPABASE_SERVICE_KEY")
 
-# initiate embeddings model
-embeddings = OpenAIEmbeddings(model="text-embedding-3-small")
+# initiate embeddings model - the same model and vector size the chatbot queries with
+embeddings = get_embeddings_model()
 
 # Initialize Supabase client
 supabase: Client = create_client(supabase_url=supabase_url,
@@ -130,13 +130,6 @@ doc_chunks = chunks(documents, 10)
 
 for doc_chunk in tqdm(doc_chunks):
 
-    # store chunks in vector store
+    # store chunks in vector store, and the local vector index if there is one
     # verbose output to see progress
-    vector_store = SupabaseVectorStore.from_documents(
-        doc_chunk,
-        embeddings,
-        client=supabase,
-        table_name="documents",
-        query_name="match_documents",
-        chunk_size=2000,
-    )
+    ingest_documents(doc_chunk, embeddings, supabase, chunk_size=2000)
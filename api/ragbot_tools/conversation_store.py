@@ -0,0 +1,145 @@
+import os
+import time
+import sqlite3
+import threading
+
+try:
+    from tools.cache_functions import CACHE_DIR
+except (ImportError, ModuleNotFoundError):
+    from api.tools.cache_functions import CACHE_DIR
+
+# which conversation store backend to use - only "sqlite" for now
+CONVERSATION_STORE = os.environ.get("BOOKWORM_CONVERSATION_STORE", "sqlite")
+
+CONVERSATION_DB_PATH = os.environ.get("BOOKWORM_CONVERSATION_DB_PATH", os.path.join(CACHE_DIR, "conversations.sqlite3"))
+
+# conversations untouched for this many seconds are deleted
+CONVERSATION_TTL = int(os.environ.get("BOOKWORM_CONVERSATION_TTL", 24 * 60 * 60))
+
+# expired conversations are purged at most this often, in seconds
+CONVERSATION_PURGE_INTERVAL = 300
+
+_conversation_store = None
+
+
+class SQLiteConversationStore:
+
+    """Server-side chat history in SQLite, keyed by conversation ID.
+
+    Messages are only ever appended. Compaction records a rolling summary and the ID of the last
+    message it covers, rather than rewriting history, so appends from concurrent requests never
+    overwrite each other.
+    """
+
+    def __init__(self, path: str = CONVERSATION_DB_PATH, ttl: int = CONVERSATION_TTL):
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+        self.path = path
+        self.ttl = ttl
+        self.purged_at = 0.0
+        self.purge_lock = threading.Lock()
+
+        with self._connect() as connection:
+            # write-ahead logging lets request threads read while another appends
+            connection.execute("pragma journal_mode=wal")
+            connection.execute("create table if not exists conversations ("
+                               "conversation_id text primary key, summary text not null default '', "
+                               "summarized_through integer not null default 0, updated_at real not null)")
+            connection.execute("create table if not exists conversation_messages ("
+                               "message_id integer primary key autoincrement, conversation_id text not null, "
+                               "type text not null, content text not null, created_at real not null)")
+            connection.execute("create index if not exists conversation_messages_conversation "
+                               "on conversation_messages (conversation_id, message_id)")
+            connection.execute("create index if not exists conversations_updated_at on conversations (updated_at)")
+
+    def _connect(self):
+
+        # a connection per call keeps the store safe to use from request threads
+        return sqlite3.connect(self.path, timeout=10)
+
+    def get_conversation(self, conversation_id: str):
+
+        """Get a conversation's summary and the messages it does not yet cover, as (summary, [(message_id, message dict)])."""
+
+        self.purge_expired()
+
+        with self._connect() as connection:
+            row = connection.execute("select summary, summarized_through, updated_at from conversations where conversation_id = ?",
+                                     (conversation_id,)).fetchone()
+
+            if row is None or row[2] < time.time() - self.ttl:
+                return "", []
+
+            summary, summarized_through, _ = row
+            messages = connection.execute("select message_id, type, content from conversation_messages "
+                                          "where conversation_id = ? and message_id > ? order by message_id",
+                                          (conversation_id, summarized_through)).fetchall()
+
+        return summary, [(message_id, {"type": message_type, "content": content}) for message_id, message_type, content in messages]
+
+    def append_messages(self, conversation_id: str, messages: list):
+
+        """Append message dicts ({"type", "content"}) to a conversation, creating it if needed.
+
+        A conversation that has expired but not yet been purged is cleared first, so it starts fresh
+        rather than bringing its old messages and summary back.
+        """
+
+        now = time.time()
+        expiry = now - self.ttl
+
+        with self._connect() as connection:
+            # the deletes open the write transaction, so the expiry check and the append cannot interleave with another append
+            connection.execute("delete from conversation_messages where conversation_id in "
+                               "(select conversation_id from conversations where conversation_id = ? and updated_at < ?)",
+                               (conversation_id, expiry))
+            connection.execute("delete from conversations where conversation_id = ? and updated_at < ?", (conversation_id, expiry))
+            connection.execute("insert into conversations (conversation_id, updated_at) values (?, ?) "
+                               "on conflict (conversation_id) do update set updated_at = excluded.updated_at",
+                               (conversation_id, now))
+            connection.executemany("insert into conversation_messages (conversation_id, type, content, created_at) values (?, ?, ?, ?)",
+                                   [(conversation_id, message["type"], message["content"], now) for message in messages])
+
+    def set_summary(self, conversation_id: str, summary: str, summarized_through: int):
+
+        """Record the rolling summary of a conversation, covering every message up to summarized_through."""
+
+        with self._connect() as connection:
+            connection.execute("insert into conversations (conversation_id, summary, summarized_through, updated_at) values (?, ?, ?, ?) "
+                               "on conflict (conversation_id) do update set summary = excluded.summary, "
+                               "summarized_through = excluded.summarized_through, updated_at = excluded.updated_at",
+                               (conversation_id, summary, summarized_through, time.time()))
+
+    def purge_expired(self):
+
+        """Delete conversations that have expired, at most once every CONVERSATION_PURGE_INTERVAL seconds."""
+
+        now = time.time()
+
+        with self.purge_lock:
+            if now - self.purged_at < CONVERSATION_PURGE_INTERVAL:
+                return
+            self.purged_at = now
+
+        expiry = now - self.ttl
+
+        with self._connect() as connection:
+            connection.execute("delete from conversation_messages where conversation_id in "
+                               "(select conversation_id from conversations where updated_at < ?)", (expiry,))
+            connection.execute("delete from conversations where updated_at < ?", (expiry,))
+
+
+def get_conversation_store():
+
+    """Get the configured conversation store, creating it on first use."""
+
+    global _conversation_store
+
+    if _conversation_store is None:
+        if CONVERSATION_STORE != "sqlite":
+            raise ValueError(f"Unknown conversation store: {CONVERSATION_STORE}")
+
+        _conversation_store = SQLiteConversationStore()
+
+    return _conversation_store
@@ -0,0 +1,98 @@
+import os
+import re
+import base64
+import hashlib
+import threading
+import unicodedata
+from collections import OrderedDict
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+try:
+    from tools.cache_functions import DiskLRUCache
+except (ImportError, ModuleNotFoundError):
+    from api.tools.cache_functions import DiskLRUCache
+
+# query embeddings kept in memory per process
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.environ.get("BOOKWORM_EMBEDDING_CACHE_MAX_ENTRIES", 2048))
+
+# size of the on-disk tier shared by all workers on a machine - 0 turns it off
+EMBEDDING_CACHE_MAX_BYTES = int(os.environ.get("BOOKWORM_EMBEDDING_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+
+
+def normalize_query_text(text: str):
+
+    """Normalise a query's cache key so trivially different phrasings share an embedding - case, spacing and surrounding punctuation."""
+
+    text = unicodedata.normalize("NFKC", text).lower()
+    text = re.sub(r"\s+", " ", text)
+
+    return text.strip(" \t\n.,;:!?\"'")
+
+
+class CachedQueryEmbeddings(Embeddings):
+
+    """Embeddings wrapper that caches query embeddings by normalised text and model name.
+
+    Normalisation only builds the cache key - the model always embeds the query as it was asked.
+
+    Hits are served from an in-memory LRU, then from an optional on-disk tier, so a
+    repeated question never makes the embedding round trip. Document embeddings
+    (ingestion) are passed straight through.
+    """
+
+    def __init__(self, embeddings: Embeddings, model_name: str,
+                 max_entries: int = EMBEDDING_CACHE_MAX_ENTRIES, max_bytes: int = EMBEDDING_CACHE_MAX_BYTES):
+
+        self.embeddings = embeddings
+        self.model_name = model_name
+        self.max_entries = max_entries
+        self.memory_cache = OrderedDict()
+        self.disk_cache = DiskLRUCache("query_embeddings", max_bytes) if max_bytes > 0 else None
+        self.lock = threading.Lock()
+
+    def get_cache_key(self, normalized_text: str):
+
+        return hashlib.sha256(f"{self.model_name}\n{normalized_text}".encode("utf-8")).hexdigest()
+
+    def _remember(self, cache_key: str, embedding: list):
+
+        with self.lock:
+            self.memory_cache[cache_key] = embedding
+            self.memory_cache.move_to_end(cache_key)
+
+            while len(self.memory_cache) > self.max_entries:
+                self.memory_cache.popitem(last=False)
+
+    def embed_query(self, text: str) -> list:
+
+        normalized_text = normalize_query_text(text)
+        cache_key = self.get_cache_key(normalized_text)
+
+        with self.lock:
+            embedding = self.memory_cache.get(cache_key)
+            if embedding is not None:
+                self.memory_cache.move_to_end(cache_key)
+                return embedding
+
+        if self.disk_cache is not None:
+            cached_value = self.disk_cache.get(cache_key)
+
+            if cached_value is not None:
+                # stored as base64 float32 - a quarter of the size of a JSON list of floats
+                embedding = np.frombuffer(base64.b64decode(cached_value), dtype=np.float32).tolist()
+                self._remember(cache_key, embedding)
+                return embedding
+
+        embedding = self.embeddings.embed_query(text)
+        self._remember(cache_key, embedding)
+
+        if self.disk_cache is not None:
+            self.disk_cache.set(cache_key, base64.b64encode(np.asarray(embedding, dtype=np.float32).tobytes()).decode("ascii"))
+
+        return embedding
+
+    def embed_documents(self, texts: list) -> list:
+
+        return self.embeddings.embed_documents(texts)
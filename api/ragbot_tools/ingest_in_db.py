@@ -7,7 +7,7 @@ from langchain_community.document_loaders import PyPDFDirectoryLoader
 from langchain_community.document_loaders import TextLoader
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_community.vectorstores import SupabaseVectorStore
-from langchain_openai import OpenAIEmbeddings
+from api.ragbot_tools.vector_stores import get_embeddings_model, ingest_documents
 
 # import supabase
 from supabase.client import Client, create_client
@@ -20,8 +20,8 @@ supabase_url = os.environ.get("SUPABASE_URL")
 supabase_key = os.environ.get("SUPABASE_SERVICE_KEY")
 supabase: Client = create_client(supabase_url, supabase_key)
 
-# initiate embeddings model
-embeddings = OpenAIEmbeddings(model="text-embedding-3-small")
+# initiate embeddings model - the same model and vector size the chatbot queries with
+embeddings = get_embeddings_model()
 
 # load pdf docs from folder 'documents'
 # C:\Users\david\repos\rag_chatbot\Agentic-RAG-with-LangChain\documents
@@ -34,12 +34,5 @@ documents = loader.load()
 text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=100)
 docs = text_splitter.split_documents(documents)
 
-# store chunks in vector store
-vector_store = SupabaseVectorStore.from_documents(
-    docs,
-    embeddings,
-    client=supabase,
-    table_name="documents",
-    query_name="match_documents",
-    chunk_size=1000,
-)
+# store chunks in vector store, and the local vector index if there is one
+ingest_documents(docs, embeddings, supabase, chunk_size=1000)
@@ -0,0 +1,458 @@
+import os
+import re
+import json
+import time
+import uuid
+import shutil
+import threading
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.vectorstores import VectorStore
+
+try:
+    from tools.cache_functions import CACHE_DIR
+    from ragbot_tools.retrieval_filters import split_retrieval_filter
+except (ImportError, ModuleNotFoundError):
+    from api.tools.cache_functions import CACHE_DIR
+    from api.ragbot_tools.retrieval_filters import split_retrieval_filter
+
+LOCAL_VECTOR_INDEX_DIR = os.environ.get("BOOKWORM_LOCAL_VECTOR_INDEX_DIR", os.path.join(CACHE_DIR, "vector_index"))
+
+# precision of the stored vectors - float16 halves the index size and memory with no measurable loss in ranking
+LOCAL_VECTOR_INDEX_DTYPE = os.environ.get("BOOKWORM_LOCAL_VECTOR_INDEX_DTYPE", "float16")
+
+# search an HNSW graph (needs hnswlib) rather than scanning every vector - worthwhile from tens of thousands of chunks
+LOCAL_VECTOR_INDEX_HNSW = os.environ.get("BOOKWORM_LOCAL_VECTOR_INDEX_HNSW", "").lower() in ("1", "true", "yes")
+
+# rows scored per matrix product in an exhaustive search, to bound the float32 working copy
+SEARCH_BLOCK_ROWS = 65536
+
+# rows fetched per request when exporting the documents table
+EXPORT_PAGE_SIZE = 500
+
+
+class LocalVectorIndex:
+
+    """Append-only on-disk vector index, searched in process.
+
+    Unit-length vectors are stored as fixed-size rows in vectors.bin and memory-mapped, and each row's
+    document is a line of documents.jsonl. Appends write the document first and the vector second, so
+    readers only ever see complete rows, and pick up new rows the next time they search.
+
+    Both files live in a snapshot directory named by the CURRENT file, so an exported snapshot replaces
+    the whole index at once.
+    """
+
+    def __init__(self, path: str = LOCAL_VECTOR_INDEX_DIR, dimensions: int = 1536,
+                 dtype: str = LOCAL_VECTOR_INDEX_DTYPE, use_hnsw: bool = LOCAL_VECTOR_INDEX_HNSW, snapshot_name: str = None):
+
+        self.path = path
+        # pins the index to one snapshot, e.g. while an export fills it
+        self.snapshot_name = snapshot_name
+        self.dimensions = dimensions
+        self.dtype = np.dtype(dtype)
+        self.use_hnsw = use_hnsw
+        self.snapshot_path = None
+
+        self.vectors = np.empty((0, dimensions), dtype=self.dtype)
+        self.ids = []
+        self.known_ids = set()
+        self.contents = []
+        self.metadatas = []
+        self.metadata_columns = {}
+        self.documents_offset = 0
+        self.hnsw_index = None
+        self.lock = threading.RLock()
+
+    @property
+    def vectors_path(self):
+
+        return os.path.join(self.snapshot_path, "vectors.bin")
+
+    @property
+    def documents_path(self):
+
+        return os.path.join(self.snapshot_path, "documents.jsonl")
+
+    def get_current_snapshot_path(self):
+
+        if self.snapshot_name is not None:
+            return os.path.join(self.path, self.snapshot_name)
+
+        try:
+            with open(os.path.join(self.path, "CURRENT")) as f:
+                return os.path.join(self.path, f.read().strip())
+        except OSError:
+            return None
+
+    def create_snapshot(self):
+
+        """Start a new, empty snapshot directory, not yet published as CURRENT."""
+
+        snapshot_name = f"snapshot-{time.time_ns()}"
+        os.makedirs(os.path.join(self.path, snapshot_name), exist_ok=True)
+
+        return snapshot_name
+
+    def publish_snapshot(self, snapshot_name: str):
+
+        """Make a snapshot the current one, then delete the older snapshots it replaces."""
+
+        current_path = os.path.join(self.path, "CURRENT")
+
+        with open(f"{current_path}.tmp", "w") as f:
+            f.write(snapshot_name)
+        os.replace(f"{current_path}.tmp", current_path)
+
+        # processes still reading an old snapshot keep their memory maps after the files are deleted
+        for name in os.listdir(self.path):
+            if name.startswith("snapshot-") and name < snapshot_name:
+                shutil.rmtree(os.path.join(self.path, name), ignore_errors=True)
+
+    def __len__(self):
+
+        self.refresh()
+
+        return len(self.vectors)
+
+    def refresh(self):
+
+        """Load any rows appended since the last refresh - or everything, if a new snapshot has been published."""
+
+        with self.lock:
+            snapshot_path = self.get_current_snapshot_path()
+
+            if snapshot_path != self.snapshot_path:
+                self.snapshot_path = snapshot_path
+                self.vectors = np.empty((0, self.dimensions), dtype=self.dtype)
+                self.ids, self.contents, self.metadatas = [], [], []
+                self.known_ids = set()
+                self.metadata_columns = {}
+                self.documents_offset = 0
+                self.hnsw_index = None
+
+            if snapshot_path is None:
+                return
+
+            try:
+                documents_size = os.path.getsize(self.documents_path)
+                vectors_size = os.path.getsize(self.vectors_path)
+            except OSError:
+                return
+
+            if documents_size > self.documents_offset:
+                with open(self.documents_path, "rb") as f:
+                    f.seek(self.documents_offset)
+                    data = f.read(documents_size - self.documents_offset)
+
+                # leave a partly written last line for the next refresh
+                complete = data[:data.rfind(b"\n") + 1]
+                self.documents_offset += len(complete)
+
+                for line in complete.splitlines():
+                    document = json.loads(line)
+                    self.ids.append(document["id"])
+                    self.known_ids.add(document["id"])
+                    self.contents.append(document["content"])
+                    self.metadatas.append(document["metadata"] or {})
+
+                self.metadata_columns = {}
+
+            row_count = min(len(self.ids), vectors_size // (self.dimensions * self.dtype.itemsize))
+
+            if row_count != len(self.vectors):
+                self.vectors = np.memmap(self.vectors_path, dtype=self.dtype, mode="r", shape=(row_count, self.dimensions)) \
+                    if row_count else np.empty((0, self.dimensions), dtype=self.dtype)
+
+                if self.use_hnsw:
+                    self._update_hnsw_index()
+
+    def _update_hnsw_index(self):
+
+        try:
+            import hnswlib
+        except ImportError:
+            self.use_hnsw = False
+            return
+
+        row_count = len(self.vectors)
+
+        if self.hnsw_index is None:
+            self.hnsw_index = hnswlib.Index(space="ip", dim=self.dimensions)
+            self.hnsw_index.init_index(max_elements=max(row_count, 1024), ef_construction=100, M=16)
+            self.hnsw_index.set_ef(100)
+
+        indexed_count = self.hnsw_index.get_current_count()
+
+        if row_count > indexed_count:
+            if row_count > self.hnsw_index.get_max_elements():
+                self.hnsw_index.resize_index(max(row_count, 2 * self.hnsw_index.get_max_elements()))
+
+            self.hnsw_index.add_items(np.asarray(self.vectors[indexed_count:], dtype=np.float32),
+                                      np.arange(indexed_count, row_count))
+
+    def append(self, ids: list, vectors: list, contents: list, metadatas: list):
+
+        """Append documents and their embeddings, skipping IDs already in the index. Returns the IDs added."""
+
+        self.refresh()
+
+        with self.lock:
+            rows = [(document_id, vector, content, metadata)
+                    for document_id, vector, content, metadata in zip(ids, vectors, contents, metadatas)
+                    if document_id not in self.known_ids]
+
+            if not rows:
+                return []
+
+            vectors = np.asarray([row[1] for row in rows], dtype=np.float32)
+            if vectors.shape[1] != self.dimensions:
+                raise ValueError(f"Expected {self.dimensions}-dimensional vectors, got {vectors.shape[1]}.")
+
+            norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+            vectors = vectors / np.where(norms == 0, 1, norms)
+
+            if self.snapshot_path is None:
+                self.publish_snapshot(self.create_snapshot())
+                self.refresh()
+
+            with open(self.documents_path, "ab") as f:
+                f.write(b"".join(json.dumps({"id": row[0], "content": row[2], "metadata": row[3]}).encode("utf-8") + b"\n"
+                                 for row in rows))
+
+            with open(self.vectors_path, "ab") as f:
+                f.write(vectors.astype(self.dtype).tobytes())
+
+        self.refresh()
+
+        return [row[0] for row in rows]
+
+    def get_metadata_column(self, key: str):
+
+        """Get one metadata field for every row as an array, built once per key until rows are added."""
+
+        column = self.metadata_columns.get(key)
+
+        if column is None or len(column) != len(self.metadatas):
+            column = np.empty(len(self.metadatas), dtype=object)
+            column[:] = [metadata.get(key) for metadata in self.metadatas]
+            self.metadata_columns[key] = column
+
+        return column
+
+    def get_number_column(self, key: str):
+
+        """Get a metadata field as floats (NaN where missing), reading the digits of values like "650L".
+
+        Years are read from their leading four digits, so dates like "2001-05-01" give 2001.
+        """
+
+        column_key = f"{key}#number"
+        column = self.metadata_columns.get(column_key)
+
+        if column is None or len(column) != len(self.metadatas):
+            if key == "year":
+                digits = [(re.match(r"\d{4}", str(value)) or [""])[0] if value is not None else ""
+                          for value in self.get_metadata_column(key)]
+            else:
+                digits = ["".join(character for character in str(value) if character.isdigit()) if value is not None else ""
+                          for value in self.get_metadata_column(key)]
+            column = np.array([float(value) if value else np.nan for value in digits])
+            self.metadata_columns[column_key] = column
+
+        return column
+
+    def get_filter_mask(self, retrieval_filter: dict, library_isbns=None):
+
+        """Get a boolean mask of the rows a retrieval filter keeps - the same rules as match_documents, or None for no filter."""
+
+        arguments, metadata_filter = split_retrieval_filter(retrieval_filter)
+        row_count = len(self.vectors)
+
+        if not arguments and not metadata_filter:
+            return None
+
+        mask = np.ones(row_count, dtype=bool)
+
+        for key, value in metadata_filter.items():
+            mask &= self.get_metadata_column(key)[:row_count] == value
+
+        if "library_id" in arguments:
+            mask &= np.isin(self.get_metadata_column("isbn")[:row_count].astype(str), list(library_isbns or []))
+
+        with np.errstate(invalid="ignore"):
+            for argument, key, compare in [("min_lexile", "lexile_measure", np.greater_equal),
+                                           ("max_lexile", "lexile_measure", np.less_equal),
+                                           ("min_year", "year", np.greater_equal),
+                                           ("max_year", "year", np.less_equal)]:
+                if argument in arguments:
+                    mask &= compare(self.get_number_column(key)[:row_count], arguments[argument])
+
+        if "category" in arguments:
+            category = arguments["category"].lower()
+            mask &= np.array([category in str(value or "").lower() for value in self.get_metadata_column("categories")[:row_count]],
+                             dtype=bool)
+
+        return mask
+
+    def search(self, query_vector: list, k: int = 4, score_threshold: float = None, retrieval_filter: dict = None,
+               library_isbns=None):
+
+        """Get the k documents most similar to a query vector, as [(Document, cosine similarity)]."""
+
+        self.refresh()
+
+        with self.lock:
+            vectors, ids, contents, metadatas = self.vectors, self.ids, self.contents, self.metadatas
+            mask = self.get_filter_mask(retrieval_filter, library_isbns)
+            hnsw_index = self.hnsw_index
+
+        query_vector = np.asarray(query_vector, dtype=np.float32)
+        norm = np.linalg.norm(query_vector)
+        query_vector = query_vector / norm if norm else query_vector
+
+        candidate_count = len(vectors) if mask is None else int(mask.sum())
+        k = min(k, candidate_count)
+
+        if k == 0:
+            return []
+
+        rows = None
+
+        if hnsw_index is not None:
+            try:
+                labels, distances = hnsw_index.knn_query(query_vector, k=k,
+                                                         filter=None if mask is None else lambda label: bool(mask[label]))
+                rows, scores = labels[0], 1 - distances[0]
+            except RuntimeError:
+                # the graph could not reach k rows through a narrow filter - fall back to an exact scan
+                rows = None
+
+        if rows is None:
+            candidate_rows = np.arange(len(vectors)) if mask is None else np.flatnonzero(mask)
+            candidate_scores = np.empty(len(candidate_rows), dtype=np.float32)
+
+            for start in range(0, len(candidate_rows), SEARCH_BLOCK_ROWS):
+                block_rows = candidate_rows[start:start + SEARCH_BLOCK_ROWS]
+                block = vectors[block_rows[0]:block_rows[-1] + 1] if mask is None else vectors[block_rows]
+                candidate_scores[start:start + len(block_rows)] = np.asarray(block, dtype=np.float32) @ query_vector
+
+            nearest = np.argpartition(-candidate_scores, k - 1)[:k]
+            nearest = nearest[np.argsort(-candidate_scores[nearest])]
+            rows, scores = candidate_rows[nearest], candidate_scores[nearest]
+
+        return [(Document(id=ids[row], page_content=contents[row], metadata=metadatas[row]), float(score))
+                for row, score in zip(rows, scores)
+                if score_threshold is None or score >= score_threshold]
+
+
+class LocalVectorStore(VectorStore):
+
+    """LangChain vector store over a LocalVectorIndex - a drop-in replacement for the Supabase store.
+
+    Takes the same retrieval filters as FilteredSupabaseVectorStore. Library filters need the ISBNs in the
+    library, from get_library_isbns(library_id).
+    """
+
+    def __init__(self, index: LocalVectorIndex, embedding, get_library_isbns=None):
+
+        self.index = index
+        self._embedding = embedding
+        self.get_library_isbns = get_library_isbns
+
+    @property
+    def embeddings(self):
+
+        return self._embedding
+
+    def add_texts(self, texts, metadatas=None, ids=None, **kwargs):
+
+        texts = list(texts)
+        metadatas = metadatas or [{} for _ in texts]
+        ids = ids or [str(uuid.uuid4()) for _ in texts]
+
+        return self.index.append(ids, self._embedding.embed_documents(texts), texts, metadatas)
+
+    @classmethod
+    def from_texts(cls, texts, embedding, metadatas=None, ids=None, index: LocalVectorIndex = None, **kwargs):
+
+        vector_store = cls(index or LocalVectorIndex(), embedding)
+        vector_store.add_texts(texts, metadatas, ids)
+
+        return vector_store
+
+    def similarity_search_by_vector_with_relevance_scores(self, embedding, k: int = 4, filter: dict = None,
+                                                          score_threshold: float = None, **kwargs):
+
+        library_isbns = None
+        if filter and "library_id" in filter and self.get_library_isbns is not None:
+            library_isbns = self.get_library_isbns(filter["library_id"])
+
+        return self.index.search(embedding, k, score_threshold, filter, library_isbns)
+
+    def similarity_search_with_relevance_scores(self, query: str, k: int = 4, filter: dict = None, **kwargs):
+
+        return self.similarity_search_by_vector_with_relevance_scores(self._embedding.embed_query(query), k, filter, **kwargs)
+
+    def similarity_search_by_vector(self, embedding, k: int = 4, filter: dict = None, **kwargs):
+
+        return [document for document, _ in self.similarity_search_by_vector_with_relevance_scores(embedding, k, filter, **kwargs)]
+
+    def similarity_search(self, query: str, k: int = 4, filter: dict = None, **kwargs):
+
+        return self.similarity_search_by_vector(self._embedding.embed_query(query), k, filter, **kwargs)
+
+
+def parse_embedding(embedding):
+
+    """Parse an embedding as returned by PostgREST - a "[0.1,0.2,...]" string for vector and halfvec columns."""
+
+    return json.loads(embedding) if isinstance(embedding, str) else embedding
+
+
+def export_documents_snapshot(authenticated_supabase_client, path: str = LOCAL_VECTOR_INDEX_DIR, dimensions: int = 1536,
+                              dtype: str = LOCAL_VECTOR_INDEX_DTYPE):
+
+    """Export the documents table to a new snapshot of the local vector index at path. Returns the row count."""
+
+    index = LocalVectorIndex(path, dimensions, dtype, use_hnsw=False)
+
+    # fill the new snapshot before publishing it, so searches never see a partial export
+    snapshot_name = index.create_snapshot()
+    staging_index = LocalVectorIndex(path, dimensions, dtype, use_hnsw=False, snapshot_name=snapshot_name)
+
+    start = 0
+    while True:
+        rows = authenticated_supabase_client.table("documents").select("id, content, metadata, embedding") \
+            .order("id").range(start, start + EXPORT_PAGE_SIZE - 1).execute().data
+
+        staging_index.append([str(row["id"]) for row in rows], [parse_embedding(row["embedding"]) for row in rows],
+                             [row["content"] for row in rows], [row["metadata"] for row in rows])
+
+        if len(rows) < EXPORT_PAGE_SIZE:
+            break
+        start += EXPORT_PAGE_SIZE
+
+    index.publish_snapshot(snapshot_name)
+
+    return len(staging_index.ids)
+
+
+if __name__ == "__main__":
+
+    from supabase import create_client
+    from dotenv import load_dotenv
+
+    try:
+        from ragbot_tools.vector_stores import EMBEDDING_DIMENSIONS
+    except (ImportError, ModuleNotFoundError):
+        from api.ragbot_tools.vector_stores import EMBEDDING_DIMENSIONS
+
+    load_dotenv()
+
+    # export a snapshot of the documents table for BOOKWORM_VECTOR_STORE=local
+    supabase_client = create_client(os.environ.get("SUPABASE_URL"), os.environ.get("SUPABASE_SERVICE_KEY"))
+    row_count = export_documents_snapshot(supabase_client, dimensions=EMBEDDING_DIMENSIONS)
+
+    print(f"Exported {row_count} documents to {LOCAL_VECTOR_INDEX_DIR}.")
@@ -1,43 +1,282 @@
 # Import necessary libraries
 import os
+import json
+import uuid
+import time
+import queue
+import threading
 from dotenv import load_dotenv
-from langchain.agents import AgentExecutor
-from langchain_openai import ChatOpenAI
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
-from langchain.agents import create_tool_calling_agent
-from langchain_community.vectorstores import SupabaseVectorStore
-from langchain_openai import OpenAIEmbeddings
-from langchain import hub
 from langchain_core.messages import SystemMessage, AIMessage, HumanMessage
-from supabase.client import Client, create_client
 from langchain_core.tools import tool
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.runnables import RunnableConfig
+from postgrest.exceptions import APIError
 
 from flask import session
 
+try:
+    from ragbot_tools.embedding_cache import CachedQueryEmbeddings
+except (ImportError, ModuleNotFoundError):
+    from api.ragbot_tools.embedding_cache import CachedQueryEmbeddings
+
+try:
+    from ragbot_tools.answer_cache import SemanticAnswerCache
+except (ImportError, ModuleNotFoundError):
+    from api.ragbot_tools.answer_cache import SemanticAnswerCache
+
+try:
+    from ragbot_tools.chat_history import compact_chat_history, build_chat_history_messages
+except (ImportError, ModuleNotFoundError):
+    from api.ragbot_tools.chat_history import compact_chat_history, build_chat_history_messages
+
+try:
+    from ragbot_tools.conversation_store import get_conversation_store
+except (ImportError, ModuleNotFoundError):
+    from api.ragbot_tools.conversation_store import get_conversation_store
+
+try:
+    from ragbot_tools.retrieval_filters import get_retrieval_filter_key
+except (ImportError, ModuleNotFoundError):
+    from api.ragbot_tools.retrieval_filters import get_retrieval_filter_key
+
+try:
+    from ragbot_tools.catalog_router import CATALOG_ROUTER_ENABLED, route_query, answer_catalog_query, get_intent_classifier
+except (ImportError, ModuleNotFoundError):
+    from api.ragbot_tools.catalog_router import CATALOG_ROUTER_ENABLED, route_query, answer_catalog_query, get_intent_classifier
+
 # Load environment variables
 load_dotenv()
 
-# Initialize Supabase database
-supabase_url = os.environ.get("SUPABASE_URL")
-supabase_key = os.environ.get("SUPABASE_SERVICE_KEY")
-supabase: Client = create_client(supabase_url, supabase_key)
+# where the chatbot retrieves documents from - "supabase" (match_documents) or "local", an
+# in-process index exported from the documents table (see local_vector_index.py)
+VECTOR_STORE = os.environ.get("BOOKWORM_VECTOR_STORE", "supabase")
+
+# how long a library's books are reused before re-reading them, in seconds - used for catalog
+# answers and library-scoped retrieval from the local vector store
+CATALOG_BOOKS_TTL = 60
+
+# books columns catalog questions are answered from
+CATALOG_COLUMNS = "isbn, title, authors, year, lexile_measure, age_range, categories"
+
+# rows fetched per request when reading a library's books - PostgREST returns at most 1000 by default
+CATALOG_PAGE_SIZE = 1000
+
+# recorded as the answer to a streamed turn that ended early, so the history never holds an unanswered question
+INTERRUPTED_ANSWER = "(This answer was interrupted before it finished.)"
+
+# The Supabase client, embeddings, vector store and agent are built on first chatbot use (or by
+# warm_up_chatbot) rather than at import, so non-chat routes never pay for them and the app
+# can start without network access.
+_rag_lock = threading.Lock()
+_supabase = None
+_embeddings = None
+_vector_store = None
+_retriever = None
+_catalog_books = {}
+_agent_executor = None
+_summary_llm = None
+
+
+def build_agent_prompt():
+
+    """Build the tool-calling agent prompt - the layout of hwchase17/openai-functions-agent, kept here rather than
+    fetched from the prompt hub, with manual_prompt (the librarian instructions) as its system message."""
+
+    return ChatPromptTemplate.from_messages([
+        ("system", manual_prompt),
+        MessagesPlaceholder("chat_history", optional=True),
+        ("human", "{input}"),
+        MessagesPlaceholder("agent_scratchpad"),
+    ])
+
+
+def get_vector_store():
+
+    """Get the documents vector store, creating the Supabase client and embeddings model on first use."""
+
+    global _supabase, _embeddings, _vector_store
+
+    if _vector_store is None:
+        with _rag_lock:
+            if _vector_store is None:
+                from supabase.client import create_client
+
+                try:
+                    from ragbot_tools.vector_stores import (FilteredSupabaseVectorStore, get_embeddings_model,
+                                                            EMBEDDING_MODEL, EMBEDDING_DIMENSIONS)
+                    from ragbot_tools.local_vector_index import LocalVectorIndex, LocalVectorStore
+                except (ImportError, ModuleNotFoundError):
+                    from api.ragbot_tools.vector_stores import (FilteredSupabaseVectorStore, get_embeddings_model,
+                                                                EMBEDDING_MODEL, EMBEDDING_DIMENSIONS)
+                    from api.ragbot_tools.local_vector_index import LocalVectorIndex, LocalVectorStore
+
+                # Initialize Supabase database
+                _supabase = create_client(os.environ.get("SUPABASE_URL"), os.environ.get("SUPABASE_SERVICE_KEY"))
+
+                # Initialize embeddings model - repeated queries are served from the cache without calling OpenAI
+                _embeddings = CachedQueryEmbeddings(get_embeddings_model(), f"{EMBEDDING_MODEL}:{EMBEDDING_DIMENSIONS}")
+
+                # Initialize vector store
+                if VECTOR_STORE == "local":
+                    _vector_store = LocalVectorStore(LocalVectorIndex(dimensions=EMBEDDING_DIMENSIONS), _embeddings,
+                                                     get_library_isbns)
+                elif VECTOR_STORE == "supabase":
+                    _vector_store = FilteredSupabaseVectorStore(
+                        embedding=_embeddings,
+                        client=_supabase,
+                        table_name="documents",
+                        query_name="match_documents",
+                    )
+                else:
+                    raise ValueError(f"Unknown vector store: {VECTOR_STORE}")
+
+    return _vector_store
+
+
+def get_retriever():
+
+    """Get the documents retriever, shared by every retrieval - filters are passed per call."""
+
+    global _retriever
+
+    if _retriever is None:
+        _retriever = get_vector_store().as_retriever(
+            search_type="similarity_score_threshold",
+            search_kwargs={"k": 5, "score_threshold": 0.2},
+        )
+
+    return _retriever
+
+
+def get_catalog_books(library_id=None):
+
+    """Get the catalog columns of the books in a library, or of every book if library_id is None."""
+
+    cached = _catalog_books.get(library_id)
+    if cached is not None and time.monotonic() - cached[0] < CATALOG_BOOKS_TTL:
+        return cached[1]
+
+    get_vector_store()
+
+    books = []
+    start = 0
+
+    # read page by page, as a single request is cut off at the server's row limit
+    while True:
+        if library_id is None:
+            rows = _supabase.table("books").select(CATALOG_COLUMNS).order("book_id") \
+                .range(start, start + CATALOG_PAGE_SIZE - 1).execute().data
+            books += rows
+        else:
+            rows = _supabase.table("user_library_books").select(f"books ({CATALOG_COLUMNS})").eq("library_id", library_id) \
+                .order("book_id").range(start, start + CATALOG_PAGE_SIZE - 1).execute().data
+            books += [row['books'] for row in rows if row.get('books')]
+
+        if len(rows) < CATALOG_PAGE_SIZE:
+            break
+        start += CATALOG_PAGE_SIZE
+
+    _catalog_books[library_id] = (time.monotonic(), books)
+
+    return books
+
+
+def get_library_isbns(library_id):
+
+    """Get the ISBNs of the books in a library, for library-scoped retrieval from the local vector store."""
+
+    return {book['isbn'] for book in get_catalog_books(library_id) if book.get('isbn')}
+
+
+def get_documents_version():
+
+    """Get a value that changes whenever the documents being retrieved from change.
+
+    Uses the documents_version row maintained by a trigger on documents (see sql_to_create_vector_db.txt),
+    falling back to the document count where the trigger has not been installed. The local vector
+    store uses its snapshot and row count.
+    """
+
+    vector_store = get_vector_store()
+
+    if VECTOR_STORE == "local":
+        # the local index only changes by appends and new snapshots
+        return vector_store.index.get_current_snapshot_path(), len(vector_store.index)
+
+    try:
+        return _supabase.table("documents_version").select("version").eq("id", 1).execute().data[0]['version']
+    except (APIError, IndexError):
+        return _supabase.table("documents").select("id", count="exact").limit(1).execute().count
+
+
+def get_agent_executor():
+
+    """Get the RAG agent executor, building the LLM and agent on first use."""
+
+    global _agent_executor
+
+    if _agent_executor is None:
+        with _rag_lock:
+            if _agent_executor is None:
+                from langchain.agents import AgentExecutor, create_tool_calling_agent
+                from langchain_openai import ChatOpenAI
+
+                # Initialize large language model (temperature = 0)
+                llm = ChatOpenAI(temperature=0, streaming=True)
+
+                # Combine the tools and provide them to the LLM
+                tools = [retrieve]
+                agent = create_tool_calling_agent(llm, tools, build_agent_prompt())
+
+                # Create the agent executor
+                _agent_executor = AgentExecutor(agent=agent, tools=tools, verbose=True)
+
+    return _agent_executor
+
+
+def get_summary_llm():
+
+    """Get the LLM used to fold older chat turns into the rolling summary, creating it on first use."""
+
+    global _summary_llm
+
+    if _summary_llm is None:
+        from langchain_openai import ChatOpenAI
+
+        _summary_llm = ChatOpenAI(temperature=0)
+
+    return _summary_llm
+
+
+def summarize_turns(summary: str, messages: list):
+
+    """Fold chat messages into the rolling summary of the conversation."""
+
+    transcript = "\n".join(f"User: {msg.content}" if isinstance(msg, HumanMessage) else f"Bot: {msg.content}" for msg in messages)
+
+    response = get_summary_llm().invoke([
+        SystemMessage(content=summary_prompt),
+        HumanMessage(content=f"Current summary:\n{summary or '(none)'}\n\nNew conversation turns:\n{transcript}"),
+    ])
+
+    return response.content
 
-# Initialize embeddings model
-embeddings = OpenAIEmbeddings(model="text-embedding-3-small")
 
-# Initialize vector store
-vector_store = SupabaseVectorStore(
-    embedding=embeddings,
-    client=supabase,
-    table_name="documents",
-    query_name="match_documents",
-)
+# answers to first-turn questions, served again for near-identical questions in the same library with the same filters
+answer_cache = SemanticAnswerCache(get_documents_version)
 
-# Initialize large language model (temperature = 0)
-llm = ChatOpenAI(temperature=0)
 
-# Fetch the prompt from the prompt hub
-prompt = hub.pull("hwchase17/openai-functions-agent")
+def warm_up_chatbot():
+
+    """Build the RAG stack ahead of the first chatbot request."""
+
+    get_vector_store()
+    get_agent_executor()
+
+    if CATALOG_ROUTER_ENABLED:
+        get_intent_classifier()
+
 
 # Define the manual instructions (context) for the user
 manual_prompt = """
@@ -47,6 +286,14 @@ Be polite, concise, and informative. Only use information from the documents you
 """
 
 
+# Instructions for folding older turns into the rolling summary
+summary_prompt = """
+You maintain a running summary of a conversation between a teacher and a primary school librarian assistant.
+Update the current summary with the new conversation turns. Keep the teacher's requirements (year groups, reading levels, topics)
+and any books, authors or recommendations mentioned. Reply with the updated summary only, in under 150 words.
+"""
+
+
 def serialize_message(msg):
     return {"type": msg.__class__.__name__, "content": msg.content}
 
@@ -64,23 +311,15 @@ def deserialize_message(d):
 
 # Create the tools
 @tool(response_format="content_and_artifact")
-def retrieve(query: str):
+def retrieve(query: str, config: RunnableConfig):
 
     """Retrieve information related to a query."""
 
-    # retrieval
-    retriever = vector_store.as_retriever(
-        search_type="similarity_score_threshold",
-        search_kwargs={"k": 5, "score_threshold": 0.2},
-    )
+    # filters chosen in the chatbot request (library, age range, lexile band, year, category) are
+    # passed through the run config and applied by match_documents in the database
+    retrieval_filter = config.get("configurable", {}).get("retrieval_filter")
 
-    docs = retriever.invoke(query)
-
-    # will look into passing filters based on user selection
-    # Optionally filter based on metadata (e.g., only documents from recent years)
-    # filtered_docs = [
-    #     doc for doc in filtered_docs if doc.metadata.get("year", 0) > 2020
-    # ]
+    docs = get_retriever().invoke(query, filter=retrieval_filter)
 
     # Serialize the results to return
     serialized = "\n\n".join(
@@ -91,43 +330,126 @@ def retrieve(query: str):
     return serialized, docs
 
 
-# Combine the tools and provide them to the LLM
-tools = [retrieve]
-agent = create_tool_calling_agent(llm, tools, prompt)
+def get_conversation_id():
 
-# Create the agent executor
-agent_executor = AgentExecutor(agent=agent, tools=tools, verbose=True)
+    """Get the session's conversation ID, starting a new conversation if it has none.
 
+    Only the ID is kept in the session cookie - the conversation itself lives in the conversation store.
+    """
 
-def run_chatbot(user_query):
+    if 'conversation_id' not in session:
+        session['conversation_id'] = uuid.uuid4().hex
 
-    # get chat history
-    try:
-        _ = session['chat_history']
-    except KeyError:
-        # Initialize chat history - only do this for a new user session
-        session['chat_history'] = [serialize_message(SystemMessage(content=manual_prompt))]
+        # drop history carried in the cookie by older versions
+        session.pop('chat_history', None)
+        session.pop('chat_summary', None)
+
+    return session['conversation_id']
+
+
+def get_answer_cache_scope(library_id, retrieval_filter: dict = None):
+
+    """Get the key cached answers are shared under - the library plus the retrieval filters, since both change the answer."""
+
+    if library_id is None:
+        return None
+
+    return f"{library_id}:{get_retrieval_filter_key(retrieval_filter)}"
+
+
+def start_chat_turn(user_query, conversation_id, answer_cache_scope=None):
+
+    """Record the user's query in the conversation and build the agent input.
+
+    Older turns are folded into a rolling summary so the agent's input stays within a token budget,
+    and the system prompt lives in the agent prompt rather than the history. Returns (agent input,
+    query embedding, cached answer). The query embedding is only computed for first-turn questions,
+    which do not depend on earlier turns and so can share cached answers.
+    """
+
+    conversation_store = get_conversation_store()
+
+    chat_summary, stored_messages = conversation_store.get_conversation(conversation_id)
+    chat_history_msgs = [deserialize_message(m) for _, m in stored_messages]
+
+    query_embedding = None
+    cached_answer = None
+    is_first_turn = not chat_summary and not chat_history_msgs
+
+    if answer_cache_scope is not None and is_first_turn:
+        query_embedding = get_vector_store().embeddings.embed_query(user_query)
+        cached_answer = answer_cache.get(answer_cache_scope, query_embedding)
+
+    kept_msgs, chat_summary = compact_chat_history(chat_history_msgs, chat_summary, summarize_turns)
+
+    # folded messages stay in the store - the summary just records how far it covers
+    folded_count = len(chat_history_msgs) - len(kept_msgs)
+    if folded_count:
+        conversation_store.set_summary(conversation_id, chat_summary, stored_messages[folded_count - 1][0])
+
+    # the current query is the agent's input, so it is only added to the history the agent sees from the next turn
+    agent_input = {"input": user_query, "chat_history": build_chat_history_messages(kept_msgs, chat_summary)}
+
+    conversation_store.append_messages(conversation_id, [serialize_message(HumanMessage(content=user_query))])
+
+    return agent_input, query_embedding, cached_answer
+
+
+def start_catalog_turn(user_query, conversation_id, retrieval_filter: dict = None):
+
+    """Answer a catalog lookup ("books by Roald Dahl", "what lexile is Bleak House") from the books table without the agent.
+
+    Returns None, recording nothing, for open-ended questions, questions with filters other than the library
+    (which need document retrieval), or lookups that find no books. Otherwise both the question and the
+    answer are added to the conversation.
+    """
+
+    if not CATALOG_ROUTER_ENABLED or any(key != "library_id" for key in (retrieval_filter or {})):
+        return None
+
+    route = route_query(user_query)
+    if route is None:
+        return None
+
+    intent, entity, category = route
+    library_id = (retrieval_filter or {}).get("library_id")
+    catalog_answer = answer_catalog_query(intent, entity, get_catalog_books(library_id),
+                                          scope="your library" if library_id is not None else "the catalogue", category=category)
+
+    if catalog_answer is not None:
+        get_conversation_store().append_messages(conversation_id, [serialize_message(HumanMessage(content=user_query)),
+                                                                   serialize_message(AIMessage(content=catalog_answer))])
+
+    return catalog_answer
 
-    # Append user query to chat history
-    session['chat_history'].append(serialize_message(HumanMessage(content=user_query)))
 
-    # Convert back to LangChain message objects for agent call
-    chat_history_msgs = [deserialize_message(m) for m in session["chat_history"]]
+def run_chatbot(user_query, library_id=None, retrieval_filter: dict = None):
 
-    # Construct the chat history part of the query
-    chat_history_str = "\n".join([f"User: {msg.content}" if isinstance(msg, HumanMessage) else f"Bot: {msg.content}" for msg in chat_history_msgs])
+    conversation_id = get_conversation_id()
 
-    # Build the full query by combining manual prompt, chat history, and user query
-    full_query = f"{chat_history_str}\nUser: {user_query}"
+    # catalog lookups are answered from the books table in milliseconds, skipping retrieval and the LLM
+    catalog_answer = start_catalog_turn(user_query, conversation_id, retrieval_filter)
+    if catalog_answer is not None:
+        return catalog_answer
 
-    # Invoke the agent with the full query including instructions and chat history
-    response = agent_executor.invoke({"input": full_query})
+    answer_cache_scope = get_answer_cache_scope(library_id, retrieval_filter)
+    agent_input, query_embedding, cached_answer = start_chat_turn(user_query, conversation_id, answer_cache_scope)
+
+    if cached_answer is not None:
+        get_conversation_store().append_messages(conversation_id, [serialize_message(AIMessage(content=cached_answer))])
+        return cached_answer
+
+    # Invoke the agent with the query and the compacted chat history
+    response = get_agent_executor().invoke(agent_input, config={"configurable": {"retrieval_filter": retrieval_filter}})
 
     # Get AI response from the agent
     ai_message = response["output"]
 
     # Append AI response to chat history
-    session['chat_history'].append(serialize_message(AIMessage(content=ai_message)))
+    get_conversation_store().append_messages(conversation_id, [serialize_message(AIMessage(content=ai_message))])
+
+    if query_embedding is not None:
+        answer_cache.set(answer_cache_scope, query_embedding, ai_message)
 
     return ai_message
 
@@ -135,3 +457,97 @@ def run_chatbot(user_query):
     # Optionally, you can save this history to a file for logging purposes:
     # with open("chat_history.txt", "a") as f:
     #     f.write(f"User: {user_query}\nBot: {ai_message}\n\n")
+
+
+class ChatEventHandler(BaseCallbackHandler):
+
+    """Callback handler that turns retrieval and LLM token callbacks into (event, data) pairs on a queue."""
+
+    def __init__(self, event_queue: queue.Queue):
+
+        self.event_queue = event_queue
+
+    def on_tool_start(self, serialized, input_str, **kwargs):
+
+        self.event_queue.put(("status", {"status": "retrieving", "query": input_str}))
+
+    def on_tool_end(self, output, **kwargs):
+
+        self.event_queue.put(("status", {"status": "retrieved"}))
+
+    def on_llm_new_token(self, token, **kwargs):
+
+        # tool-call chunks arrive as empty tokens
+        if token:
+            self.event_queue.put(("token", {"token": token}))
+
+
+def stream_chatbot(user_query, library_id=None, retrieval_filter: dict = None):
+
+    """Start a chatbot turn whose answer is streamed, returning a generator of SSE-formatted events.
+
+    Emits status events as documents are retrieved, a token event per LLM token and a
+    final done event with the whole message, which is then added to the conversation.
+    If the client disconnects or the agent fails first, INTERRUPTED_ANSWER is added instead.
+    """
+
+    conversation_id = get_conversation_id()
+
+    catalog_answer = start_catalog_turn(user_query, conversation_id, retrieval_filter)
+    if catalog_answer is not None:
+        return iter([format_chat_event("token", {"token": catalog_answer}), format_chat_event("done", {"message": catalog_answer})])
+
+    answer_cache_scope = get_answer_cache_scope(library_id, retrieval_filter)
+    agent_input, query_embedding, cached_answer = start_chat_turn(user_query, conversation_id, answer_cache_scope)
+
+    def iter_events():
+
+        ai_message = None
+
+        try:
+            if cached_answer is not None:
+                ai_message = cached_answer
+                yield format_chat_event("token", {"token": cached_answer})
+            else:
+                event_queue = queue.Queue()
+
+                def invoke_agent():
+                    try:
+                        response = get_agent_executor().invoke(agent_input, config={"callbacks": [ChatEventHandler(event_queue)],
+                                                                                   "configurable": {"retrieval_filter": retrieval_filter}})
+                        event_queue.put(("output", response["output"]))
+                    except Exception as e:
+                        event_queue.put(("error", str(e)))
+
+                threading.Thread(target=invoke_agent, daemon=True).start()
+
+                while True:
+                    event, data = event_queue.get()
+
+                    if event == "error":
+                        yield format_chat_event("error", {"message": data})
+                        return
+
+                    if event == "output":
+                        ai_message = data
+                        break
+
+                    yield format_chat_event(event, data)
+
+                if query_embedding is not None:
+                    answer_cache.set(answer_cache_scope, query_embedding, ai_message)
+        finally:
+            # also runs when the client disconnects, as the server closes the generator
+            get_conversation_store().append_messages(conversation_id, [serialize_message(AIMessage(
+                content=ai_message if ai_message is not None else INTERRUPTED_ANSWER))])
+
+        yield format_chat_event("done", {"message": ai_message})
+
+    return iter_events()
+
+
+def format_chat_event(event: str, data: dict):
+
+    """Format a chatbot event as a server-sent event."""
+
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
@@ -0,0 +1,87 @@
+import json
+
+# whole-number range filters from chatbot requests, and the match_documents argument each becomes
+RANGE_FILTERS = {
+    "lexile_min": "min_lexile",
+    "lexile_max": "max_lexile",
+    "year_min": "min_year",
+    "year_max": "max_year",
+}
+
+# chatbot request filters matched exactly against document metadata through match_documents' jsonb filter -
+# "7-9" only matches books whose age_range is "7-9", not overlapping ranges like "8-10"
+METADATA_FILTERS = ["age_range"]
+
+# match_documents arguments other than the query embedding and the jsonb metadata filter
+MATCH_DOCUMENTS_ARGUMENTS = ["library_id", "min_lexile", "max_lexile", "min_year", "max_year", "category"]
+
+
+def parse_retrieval_filters(request_filters: dict, library_id=None):
+
+    """Turn the filters from a chatbot request into match_documents arguments.
+
+    Retrieval is scoped to the user's library unless the request sets "library" to false.
+    Raises ValueError for unknown or malformed filters.
+    """
+
+    if request_filters is not None and not isinstance(request_filters, dict):
+        raise ValueError("Filters must be an object.")
+
+    request_filters = dict(request_filters or {})
+    retrieval_filter = {}
+
+    if request_filters.pop("library", True) and library_id is not None:
+        retrieval_filter["library_id"] = library_id
+
+    for request_key, argument in RANGE_FILTERS.items():
+        value = request_filters.pop(request_key, None)
+        if value is None:
+            continue
+        if isinstance(value, bool) or not isinstance(value, int):
+            raise ValueError(f"Filter '{request_key}' must be a whole number.")
+        retrieval_filter[argument] = value
+
+    category = request_filters.pop("category", None)
+    if category is not None:
+        if not isinstance(category, str) or not category.strip():
+            raise ValueError("Filter 'category' must be a non-empty string.")
+        retrieval_filter["category"] = category.strip()
+
+    for key in METADATA_FILTERS:
+        value = request_filters.pop(key, None)
+        if value is not None:
+            if not isinstance(value, str) or not value.strip():
+                raise ValueError(f"Filter '{key}' must be a non-empty string.")
+            retrieval_filter[key] = value.strip()
+
+    if request_filters:
+        raise ValueError(f"Unknown filters: {', '.join(sorted(request_filters))}.")
+
+    return retrieval_filter
+
+
+def split_retrieval_filter(retrieval_filter: dict):
+
+    """Split a retrieval filter into (match_documents arguments, jsonb metadata filter).
+
+    Metadata is only matched exactly, so operator filters such as {"$in": [...]} raise ValueError
+    rather than silently matching nothing.
+    """
+
+    retrieval_filter = retrieval_filter or {}
+
+    arguments = {key: value for key, value in retrieval_filter.items() if key in MATCH_DOCUMENTS_ARGUMENTS}
+    metadata_filter = {key: value for key, value in retrieval_filter.items() if key not in MATCH_DOCUMENTS_ARGUMENTS}
+
+    operator_keys = [key for key, value in metadata_filter.items() if isinstance(value, dict)]
+    if operator_keys:
+        raise ValueError(f"Operator filters are not supported, only exact metadata values: {', '.join(sorted(operator_keys))}.")
+
+    return arguments, metadata_filter
+
+
+def get_retrieval_filter_key(retrieval_filter: dict):
+
+    """Get a stable string for a retrieval filter, e.g. to scope cached answers."""
+
+    return json.dumps(retrieval_filter or {}, sort_keys=True)
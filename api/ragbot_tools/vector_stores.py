@@ -0,0 +1,85 @@
+import os
+import uuid
+
+from langchain_core.documents import Document
+from langchain_community.vectorstores import SupabaseVectorStore
+from langchain_openai import OpenAIEmbeddings
+
+try:
+    from ragbot_tools.retrieval_filters import split_retrieval_filter
+    from ragbot_tools.local_vector_index import LocalVectorIndex
+except (ImportError, ModuleNotFoundError):
+    from api.ragbot_tools.retrieval_filters import split_retrieval_filter
+    from api.ragbot_tools.local_vector_index import LocalVectorIndex
+
+EMBEDDING_MODEL = "text-embedding-3-small"
+
+# length of the stored embeddings - text-embedding-3 models can return shortened vectors, which
+# make the documents table and its index smaller at a small cost in recall. Must match the
+# vector sizes in sql_to_create_vector_db.txt, and the documents must be re-ingested after a change.
+EMBEDDING_DIMENSIONS = int(os.environ.get("BOOKWORM_EMBEDDING_DIMENSIONS", 1536))
+
+
+def get_embeddings_model():
+
+    """Get the embeddings model used for both ingestion and queries, so stored and query vectors always match."""
+
+    return OpenAIEmbeddings(model=EMBEDDING_MODEL, dimensions=EMBEDDING_DIMENSIONS)
+
+
+class FilteredSupabaseVectorStore(SupabaseVectorStore):
+
+    """Supabase vector store that passes filters, the top-k count and the score threshold to match_documents as arguments.
+
+    Library, range and category filters become match_documents arguments and the remaining filter keys are
+    matched exactly against document metadata through its jsonb filter - operator filters such as $in are rejected. Passing k and the threshold lets the database
+    stop after the nearest rows from its vector index, rather than ranking every document for the client to trim.
+    """
+
+    def match_args(self, query, filter):
+
+        arguments, metadata_filter = split_retrieval_filter(filter)
+
+        match_documents_params = super().match_args(query, metadata_filter)
+        match_documents_params.update(arguments)
+
+        return match_documents_params
+
+    def similarity_search_by_vector_with_relevance_scores(self, query, k, filter=None, postgrest_filter=None,
+                                                          score_threshold=None):
+
+        match_documents_params = self.match_args(query, filter)
+        match_documents_params["match_count"] = k
+        if score_threshold is not None:
+            match_documents_params["match_threshold"] = score_threshold
+
+        query_builder = self._client.rpc(self.query_name, match_documents_params)
+
+        if postgrest_filter:
+            query_builder.params = query_builder.params.set("and", f"({postgrest_filter})")
+
+        response = query_builder.execute()
+
+        return [
+            (Document(metadata=row.get("metadata", {}), page_content=row.get("content", "")), row.get("similarity", 0.0))
+            for row in response.data
+            if row.get("content")
+        ]
+
+
+def ingest_documents(documents: list, embeddings, supabase_client, chunk_size: int = 500):
+
+    """Embed documents once and store them in the documents table and, if one has been exported, the local vector index."""
+
+    ids = [str(uuid.uuid4()) for _ in documents]
+    vectors = embeddings.embed_documents([document.page_content for document in documents])
+
+    SupabaseVectorStore._add_vectors(supabase_client, "documents", vectors, documents, ids, chunk_size)
+
+    # keep the local index in step with the table, so it does not need a fresh export after every ingestion
+    local_index = LocalVectorIndex(dimensions=EMBEDDING_DIMENSIONS)
+    if local_index.get_current_snapshot_path() is not None:
+        local_index.append(ids, vectors, [document.page_content for document in documents],
+                           [document.metadata for document in documents])
+
+    return ids
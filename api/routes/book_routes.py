@@ -1,9 +1,9 @@
 from flask import request, jsonify
 
 try:
-    from tools.supabase_functions import add_book_record_using_isbn, get_authenticated_client, add_record, get_all_records, check_session
+    from tools.supabase_functions import add_book_record_using_isbn, preview_book_using_isbn, get_authenticated_client, add_record, get_all_records, check_session
 except (ImportError, ModuleNotFoundError):
-    from api.tools.supabase_functions import add_book_record_using_isbn, get_authenticated_client, add_record, get_all_records, check_session
+    from api.tools.supabase_functions import add_book_record_using_isbn, preview_book_using_isbn, get_authenticated_client, add_record, get_all_records, check_session
 
 from flask import Blueprint
 
@@ -40,6 +40,38 @@ def add_book_using_isbn(isbn):
         return jsonify({"message": "User not authenticated.", "data": None}), 401
 
 
+@book_bp.route('/preview_book_using_isbn/<isbn>', methods=['GET'])
+def preview_book_using_isbn_route(isbn):
+
+    """
+    Preview Book Using ISBN
+    ---
+    tags:
+      - Books
+    get:
+      description: >
+        Return whatever is already known about an ISBN straight away, without adding it to the library.
+        Unknown books have their details looked up in the background, ready for `/add_book_using_isbn`.
+      parameters:
+        - name: isbn
+          in: path
+          required: true
+          schema:
+            type: string
+          description: The ISBN of the book
+      responses:
+        200:
+          description: Book preview, with status known, cached or enriching
+    """
+
+    if check_session():
+        authenticated_supabase_client = get_authenticated_client()
+        book_preview_response = preview_book_using_isbn(authenticated_supabase_client, isbn)
+        return book_preview_response, 200
+    else:
+        return jsonify({"message": "User not authenticated.", "data": None}), 401
+
+
 @book_bp.route('/create_new_library', methods=['POST'])
 def create_new_library():
 
@@ -1,20 +1,35 @@
-from flask import request, jsonify
+from flask import request, jsonify, session, Response, stream_with_context
 from flask import Blueprint
 
 try:
-    from ragbot_tools.rag_chatbot_function import run_chatbot
+    from ragbot_tools.rag_chatbot_function import run_chatbot, stream_chatbot, warm_up_chatbot
 except (ImportError, ModuleNotFoundError):
-    from api.ragbot_tools.rag_chatbot_function import run_chatbot
+    from api.ragbot_tools.rag_chatbot_function import run_chatbot, stream_chatbot, warm_up_chatbot
 
 try:
-    from tools.supabase_functions import check_session
+    from tools.supabase_functions import check_session, get_authenticated_client, get_user_library_id
 except (ImportError, ModuleNotFoundError):
-    from api.tools.supabase_functions import check_session
+    from api.tools.supabase_functions import check_session, get_authenticated_client, get_user_library_id
+
+try:
+    from ragbot_tools.retrieval_filters import parse_retrieval_filters
+except (ImportError, ModuleNotFoundError):
+    from api.ragbot_tools.retrieval_filters import parse_retrieval_filters
 
 
 chat_bp = Blueprint("chat", __name__)
 
 
+def get_session_library_id():
+
+    """Get the user's library ID, remembered in the session so chat turns don't look it up every time."""
+
+    if session.get('library_id') is None:
+        session['library_id'] = get_user_library_id(get_authenticated_client())
+
+    return session['library_id']
+
+
 @chat_bp.route('/chatbot', methods=['POST'])
 def chatbot():
 
@@ -24,7 +39,18 @@ def chatbot():
     tags:
       - Chat
     post:
-      description: Send a prompt to the chatbot and receive a response.
+      description: >
+        Send a prompt to the chatbot and receive a response.
+        With `?stream=sse` the response is a stream of server-sent events instead: `status` events as
+        documents are retrieved, a `token` event per generated token, then a `done` event with the whole message.
+      parameters:
+        - name: stream
+          in: query
+          required: false
+          schema:
+            type: string
+            enum: [sse]
+          description: Stream the response as server-sent events.
       requestBody:
         required: true
         content:
@@ -35,6 +61,34 @@ def chatbot():
                 user_prompt:
                   type: string
                   example: "Tell me a joke about books."
+                filters:
+                  type: object
+                  description: >
+                    Optional retrieval filters, applied in the database before documents are ranked.
+                    Retrieval is limited to the user's library unless library is false.
+                  properties:
+                    library:
+                      type: boolean
+                      default: true
+                    age_range:
+                      type: string
+                      example: "7-9"
+                      description: Matched exactly against a book's age range - "7-9" does not match "8-10".
+                    lexile_min:
+                      type: integer
+                      example: 400
+                    lexile_max:
+                      type: integer
+                      example: 700
+                    year_min:
+                      type: integer
+                      example: 2000
+                    year_max:
+                      type: integer
+                      example: 2024
+                    category:
+                      type: string
+                      example: "Fiction"
       responses:
         200:
           description: Chatbot successfully processed the prompt
@@ -49,6 +103,8 @@ def chatbot():
                   data:
                     type: string
                     example: "Why did the book go to the doctor? Because it had a bad spine!"
+        400:
+          description: Invalid filters
         401:
           description: Unauthorized - user is not authenticated
     """
@@ -57,13 +113,55 @@ def chatbot():
 
         data = request.get_json()
         user_prompt = data.get('user_prompt')
-        chatbot_response = run_chatbot(user_prompt)
+        library_id = get_session_library_id()
+
+        try:
+            retrieval_filter = parse_retrieval_filters(data.get('filters'), library_id)
+        except ValueError as e:
+            return jsonify({"message": str(e), "data": None}), 400
+
+        if request.args.get('stream') == 'sse':
+            chat_events = stream_chatbot(user_prompt, library_id, retrieval_filter)
+
+            return Response(stream_with_context(chat_events), mimetype="text/event-stream",
+                            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+        chatbot_response = run_chatbot(user_prompt, library_id, retrieval_filter)
 
         return jsonify({"message": "Successfully processed prompt.", "data": chatbot_response}), 200
     else:
         return jsonify({"message": "User not authenticated.", "data": None}), 401
 
 
+@chat_bp.route('/chatbot/warm_up', methods=['POST'])
+def chatbot_warm_up():
+
+    """
+    Warm Up Chatbot
+    ---
+    tags:
+      - Chat
+    post:
+      description: >
+        Build the chatbot's agent and vector store ahead of the first prompt, so it does not pay the set-up cost.
+        Intended for a signed-in client that is about to open the chat screen. Servers started with
+        BOOKWORM_WARM_UP_CHATBOT set also warm up in the background at start.
+      responses:
+        200:
+          description: Chatbot ready
+        401:
+          description: Unauthorized - user is not authenticated
+    """
+
+    if check_session():
+
+        warm_up_chatbot()
+
+        return jsonify({"message": "Chatbot ready.", "data": None}), 200
+    else:
+        return jsonify({"message": "User not authenticated.", "data": None}), 401
+
+
 @chat_bp.route('/chatbot/example', methods=['GET'])
 def chatbot_example():
 
@@ -1,27 +1,42 @@
-import os
-import cv2
+import zipfile
+
 import werkzeug
-import pdfplumber
 
-from flask import request, jsonify
+from flask import request, jsonify, Response, stream_with_context
 from flask import Blueprint
 
 import pandas as pd
 from tqdm import tqdm
 
-import pytesseract
+try:
+    from tools.supabase_functions import add_book_record_using_isbn, add_book_records_using_isbns, preview_book_using_isbn, get_authenticated_client, check_session, get_session_user_id
+except (ImportError, ModuleNotFoundError):
+    from api.tools.supabase_functions import add_book_record_using_isbn, add_book_records_using_isbns, preview_book_using_isbn, get_authenticated_client, check_session, get_session_user_id
 
-pytesseract.pytesseract.tesseract_cmd = 'C:/Program Files/Tesseract-OCR/tesseract.exe'
+try:
+    from tools.image_recognition import detect_and_decode_barcode, detect_all_isbn_barcodes, decode_image_batch, decode_frame_isbns
+except (ImportError, ModuleNotFoundError):
+    from api.tools.image_recognition import detect_and_decode_barcode, detect_all_isbn_barcodes, decode_image_batch, decode_frame_isbns
 
 try:
-    from tools.supabase_functions import add_book_record_using_isbn, get_authenticated_client, add_record, check_session
+    from tools.upload_functions import get_upload_buffer, get_upload_source, get_zip_image_sources, is_image_filename, MAX_BATCH_IMAGES
 except (ImportError, ModuleNotFoundError):
-    from api.tools.supabase_functions import add_book_record_using_isbn, get_authenticated_client, add_record, check_session
+    from api.tools.upload_functions import get_upload_buffer, get_upload_source, get_zip_image_sources, is_image_filename, MAX_BATCH_IMAGES
 
 try:
-    from tools.image_recognition import detect_and_decode_barcode
+    from tools.pdf_functions import iter_book_pdf_pages, get_book_pdf_text, iter_page_events
 except (ImportError, ModuleNotFoundError):
-    from api.tools.image_recognition import detect_and_decode_barcode
+    from api.tools.pdf_functions import iter_book_pdf_pages, get_book_pdf_text, iter_page_events
+
+try:
+    from tools.cover_index import compute_cover_hashes, find_matching_covers
+except (ImportError, ModuleNotFoundError):
+    from api.tools.cover_index import compute_cover_hashes, find_matching_covers
+
+try:
+    from tools.scan_sessions import create_scan_session, get_scan_session, end_scan_session
+except (ImportError, ModuleNotFoundError):
+    from api.tools.scan_sessions import create_scan_session, get_scan_session, end_scan_session
 
 file_bp = Blueprint("file", __name__)
 
@@ -112,12 +127,8 @@ def upload_isbn_csv():
 
         if file and werkzeug.utils.secure_filename(file.filename).endswith('.csv'):
 
-            filename = werkzeug.utils.secure_filename(file.filename)
-            upload_filename = os.path.join('api', 'uploads', filename)
-            file.save(upload_filename)
-
-            # Process the CSV file here
-            isbn_df = pd.read_csv(upload_filename)
+            # Process the CSV straight from the upload buffer
+            isbn_df = pd.read_csv(file.stream)
 
             if 'ISBN' not in isbn_df.columns:
                 return jsonify({"message": "CSV file must contain an 'ISBN' column.",
@@ -131,8 +142,6 @@ def upload_isbn_csv():
                 authenticated_supabase_client = get_authenticated_client()
                 add_book_record_using_isbn(authenticated_supabase_client, isbn)
 
-            os.remove(upload_filename)
-
             return jsonify({"message": "File uploaded successfully. Books added.", "data": None}), 200
         else:
             return jsonify({"message": "Invalid file format. Only CSV files are allowed.", "data": None}), 400
@@ -155,6 +164,7 @@ def upload_image_for_isbn():
 
       **Notes:**
       - Currently, only the first detected barcode is used.
+      - Only EAN-13 barcodes with a valid ISBN checksum are accepted.
       - Only image files are accepted.
     requestBody:
       required: true
@@ -221,13 +231,8 @@ def upload_image_for_isbn():
         if file.filename == '':
             return jsonify({"message": "No selected file.", "data": None}), 400
 
-        filename = werkzeug.utils.secure_filename(file.filename)
-        upload_filename = os.path.join('api', 'uploads', filename)
-        file.save(upload_filename)
-
-        image = cv2.imread(upload_filename)
-        barcodes = detect_and_decode_barcode(image)
-        os.remove(upload_filename)
+        # decode straight from the upload bytes - reduced resolution first, full resolution only if needed
+        barcodes = detect_and_decode_barcode(get_upload_buffer(file))
 
         try:
             # Use the first detected barcode (assumed ISBN)
@@ -244,6 +249,689 @@ def upload_image_for_isbn():
         return jsonify({"message": "User not authenticated.", "data": None}), 401
 
 
+@file_bp.route('/preview_image_for_isbn', methods=['POST'])
+def preview_image_for_isbn():
+
+    """
+    Preview Image for ISBN
+    ---
+    tags:
+      - File Uploads
+    summary: Decode an ISBN barcode and return what is already known about the book, without adding it.
+    description: >
+      The first phase of a two-phase scan. Returns the `books` row or cached details for the decoded
+      ISBN immediately, and starts looking up unknown books in the background. Add the copy with
+      `/add_book_using_isbn/{isbn}`, which reuses the looked-up details.  
+
+      **Notes:**
+      - Only the first detected barcode is used.
+      - status is `known` (already in the books table), `cached` (looked up before) or `enriching` (lookup started).
+    requestBody:
+      required: true
+      content:
+        multipart/form-data:
+          schema:
+            type: object
+            properties:
+              file:
+                type: string
+                format: binary
+                description: An image file containing an ISBN barcode.
+    responses:
+      200:
+        description: Book preview for the detected ISBN.
+        content:
+          application/json:
+            schema:
+              type: object
+              properties:
+                message:
+                  type: string
+                  example: "Book found."
+                status:
+                  type: string
+                  enum: [known, cached, enriching]
+                data:
+                  type: object
+      400:
+        description: No barcode detected or no file provided.
+      401:
+        description: Unauthorized - user not authenticated.
+    """
+
+    if check_session():
+        if 'file' not in request.files:
+            return jsonify({"message": "No file part in the request.", "data": None}), 400
+
+        file = request.files['file']
+
+        if file.filename == '':
+            return jsonify({"message": "No selected file.", "data": None}), 400
+
+        barcodes = detect_and_decode_barcode(get_upload_buffer(file))
+
+        if not barcodes:
+            return jsonify({"message": "No barcode detected in the image.", "data": None}), 400
+
+        authenticated_supabase_client = get_authenticated_client()
+
+        return jsonify(preview_book_using_isbn(authenticated_supabase_client, barcodes[0])), 200
+    else:
+        return jsonify({"message": "User not authenticated.", "data": None}), 401
+
+
+@file_bp.route('/upload_shelf_image', methods=['POST'])
+def upload_shelf_image():
+
+    """
+    Upload Shelf Image
+    ---
+    tags:
+      - File Uploads
+    summary: Upload a photo of a shelf and add every book whose ISBN barcode is visible.
+    description: >
+      Accepts an image file, scans it for every ISBN barcode it contains and adds all of the books
+      to the user's library in one set-based write.  
+
+      **Notes:**
+      - Each distinct ISBN in the photo counts as one copy.
+      - Only EAN-13 barcodes with a valid ISBN checksum are accepted.
+      - Bounding boxes are given in pixels of the uploaded image.
+    requestBody:
+      required: true
+      content:
+        multipart/form-data:
+          schema:
+            type: object
+            properties:
+              file:
+                type: string
+                format: binary
+                description: A photo of a shelf of books with their barcodes visible.
+    responses:
+      200:
+        description: Books added to the user's library.
+        content:
+          application/json:
+            schema:
+              type: object
+              properties:
+                message:
+                  type: string
+                  example: "Added 12 new books and incremented copies of 3 books in user's library."
+                failures:
+                  type: array
+                  description: ISBNs that were not added because no book details could be found.
+                  items:
+                    type: string
+                barcodes:
+                  type: array
+                  items:
+                    type: object
+                    properties:
+                      isbn:
+                        type: string
+                        example: "9780547928227"
+                      rect:
+                        type: object
+                        properties:
+                          left:
+                            type: integer
+                          top:
+                            type: integer
+                          width:
+                            type: integer
+                          height:
+                            type: integer
+                data:
+                  type: array
+                  items:
+                    type: object
+      400:
+        description: No barcode detected or no file provided.
+        content:
+          application/json:
+            schema:
+              type: object
+              properties:
+                message:
+                  type: string
+                  example: "No barcode detected in the image."
+                data:
+                  type: string
+                  nullable: true
+      401:
+        description: Unauthorized - user not authenticated.
+        content:
+          application/json:
+            schema:
+              type: object
+              properties:
+                message:
+                  type: string
+                  example: "User not authenticated."
+                data:
+                  type: string
+                  nullable: true
+    """
+
+    if check_session():
+        if 'file' not in request.files:
+            return jsonify({"message": "No file part in the request.", "data": None}), 400
+
+        file = request.files['file']
+
+        if file.filename == '':
+            return jsonify({"message": "No selected file.", "data": None}), 400
+
+        barcodes = detect_all_isbn_barcodes(get_upload_buffer(file))
+
+        if not barcodes:
+            return jsonify({"message": "No barcode detected in the image.", "data": None}), 400
+
+        authenticated_supabase_client = get_authenticated_client()
+        book_records = add_book_records_using_isbns(authenticated_supabase_client, [barcode['isbn'] for barcode in barcodes])
+        book_records['barcodes'] = barcodes
+
+        return jsonify(book_records), 200
+    else:
+        return jsonify({"message": "User not authenticated.", "data": None}), 401
+
+
+@file_bp.route('/upload_images_for_isbns', methods=['POST'])
+def upload_images_for_isbns():
+
+    """
+    Upload Batch of Images for ISBNs
+    ---
+    tags:
+      - File Uploads
+    summary: Upload many barcode photos at once, as a zip or as multiple files, and add every book found.
+    description: >
+      Accepts a zip of images and/or several image files, decodes their ISBN barcodes in parallel
+      across worker processes, and adds the distinct ISBNs to the user's library in one bulk write.
+      A manifest reports what was found in each image.  
+
+      **Notes:**
+      - Each distinct ISBN counts as one copy, however many images it appears in.
+      - Images whose ISBNs all appeared in an earlier image are marked as duplicates.
+      - Non-image files in a zip are ignored.
+      - At most MAX_BATCH_IMAGES (default 500) images are decoded per request.
+    requestBody:
+      required: true
+      content:
+        multipart/form-data:
+          schema:
+            type: object
+            properties:
+              files:
+                type: array
+                items:
+                  type: string
+                  format: binary
+                description: Image files and/or zips of image files containing ISBN barcodes.
+    responses:
+      200:
+        description: Books added to the user's library.
+        content:
+          application/json:
+            schema:
+              type: object
+              properties:
+                message:
+                  type: string
+                  example: "Added 120 new books and incremented copies of 4 books in user's library."
+                failures:
+                  type: array
+                  description: ISBNs that were not added because no book details could be found.
+                  items:
+                    type: string
+                manifest:
+                  type: array
+                  items:
+                    type: object
+                    properties:
+                      filename:
+                        type: string
+                        example: "IMG_0042.jpg"
+                      status:
+                        type: string
+                        enum: [decoded, duplicate, no_barcode, error, unsupported]
+                      isbns:
+                        type: array
+                        items:
+                          type: string
+                          example: "9780547928227"
+                      error:
+                        type: string
+                        nullable: true
+                data:
+                  type: array
+                  items:
+                    type: object
+      400:
+        description: No files provided or no barcode detected in any image.
+        content:
+          application/json:
+            schema:
+              type: object
+              properties:
+                message:
+                  type: string
+                  example: "No barcode detected in any image."
+                manifest:
+                  type: array
+                  items:
+                    type: object
+                data:
+                  type: string
+                  nullable: true
+      401:
+        description: Unauthorized - user not authenticated.
+        content:
+          application/json:
+            schema:
+              type: object
+              properties:
+                message:
+                  type: string
+                  example: "User not authenticated."
+                data:
+                  type: string
+                  nullable: true
+    """
+
+    if check_session():
+        files = [file for file in request.files.getlist('files') + request.files.getlist('file') if file.filename]
+
+        if not files:
+            return jsonify({"message": "No files in the request.", "data": None}), 400
+
+        manifest = []
+        image_sources = []
+
+        for file in files:
+            if file.filename.lower().endswith('.zip'):
+                try:
+                    image_sources += get_zip_image_sources(get_upload_source(file))
+                except zipfile.BadZipFile:
+                    manifest.append({"filename": file.filename, "status": "error", "isbns": [], "error": "Not a valid zip file."})
+
+            elif is_image_filename(file.filename):
+                image_sources.append((file.filename, get_upload_source(file)))
+
+            else:
+                manifest.append({"filename": file.filename, "status": "unsupported", "isbns": [], "error": None})
+
+        image_sources = image_sources[:MAX_BATCH_IMAGES]
+
+        # decoding is CPU-bound, so spread the images across worker processes
+        decode_results = decode_image_batch([source for _, source in image_sources])
+
+        batch_isbns = {}
+
+        for (filename, _), (isbns, error) in zip(image_sources, decode_results):
+            if error is not None:
+                status = "error"
+            elif not isbns:
+                status = "no_barcode"
+            elif all(isbn in batch_isbns for isbn in isbns):
+                status = "duplicate"
+            else:
+                status = "decoded"
+
+            manifest.append({"filename": filename, "status": status, "isbns": isbns, "error": error})
+            batch_isbns.update(dict.fromkeys(isbns))
+
+        if not batch_isbns:
+            return jsonify({"message": "No barcode detected in any image.", "manifest": manifest, "data": None}), 400
+
+        authenticated_supabase_client = get_authenticated_client()
+        book_records = add_book_records_using_isbns(authenticated_supabase_client, list(batch_isbns))
+        book_records['manifest'] = manifest
+
+        return jsonify(book_records), 200
+    else:
+        return jsonify({"message": "User not authenticated.", "data": None}), 401
+
+
+@file_bp.route('/scan_session', methods=['POST'])
+def start_scan_session():
+
+    """
+    Start Scanning Session
+    ---
+    tags:
+      - File Uploads
+    summary: Start a frame-sequence scanning session.
+    description: >
+      Starts a session that camera frames can be streamed to with `/scan_session/{scan_session_id}/frames`.
+      Each ISBN is added to the user's library once per session, after it has been decoded in
+      enough consecutive frames. Only the user who started a session can send frames to it, read it or end it.
+      Sessions are held in the memory of the server process that started them, so deployments with
+      several workers or instances need sticky routing for scanning sessions.
+    parameters:
+      - name: confirm_frames
+        in: query
+        required: false
+        schema:
+          type: integer
+          default: 3
+        description: Number of consecutive frames an ISBN must be decoded in before it is confirmed.
+    responses:
+      201:
+        description: Scanning session started.
+        content:
+          application/json:
+            schema:
+              type: object
+              properties:
+                message:
+                  type: string
+                  example: "Scanning session started."
+                data:
+                  type: object
+                  properties:
+                    scan_session_id:
+                      type: string
+                    confirm_frames:
+                      type: integer
+      401:
+        description: Unauthorized - user not authenticated.
+    """
+
+    if check_session():
+        confirm_frames = request.args.get('confirm_frames', type=int)
+
+        user_id = get_session_user_id()
+
+        scan_session = create_scan_session(user_id, max(confirm_frames, 1)) if confirm_frames else create_scan_session(user_id)
+
+        return jsonify({"message": "Scanning session started.", "data": scan_session.get_summary()}), 201
+    else:
+        return jsonify({"message": "User not authenticated.", "data": None}), 401
+
+
+@file_bp.route('/scan_session/<scan_session_id>/frames', methods=['POST'])
+def add_scan_session_frames(scan_session_id):
+
+    """
+    Add Frames to Scanning Session
+    ---
+    tags:
+      - File Uploads
+    summary: Send one or more camera frames to a scanning session.
+    description: >
+      Frames are processed in the order given. Frames near-identical to the last decoded frame are
+      skipped rather than decoded again. ISBNs confirmed by these frames are added to the user's library
+      and are never reported again in this session, however many more frames they appear in.
+    parameters:
+      - name: scan_session_id
+        in: path
+        required: true
+        schema:
+          type: string
+    requestBody:
+      required: true
+      content:
+        multipart/form-data:
+          schema:
+            type: object
+            properties:
+              frames:
+                type: array
+                items:
+                  type: string
+                  format: binary
+                description: Camera frames, oldest first.
+    responses:
+      200:
+        description: Frames processed.
+        content:
+          application/json:
+            schema:
+              type: object
+              properties:
+                message:
+                  type: string
+                  example: "Confirmed 1 new books."
+                frames:
+                  type: array
+                  items:
+                    type: object
+                    properties:
+                      status:
+                        type: string
+                        enum: [decoded, skipped, unreadable]
+                      isbns:
+                        type: array
+                        items:
+                          type: string
+                confirmed_isbns:
+                  type: array
+                  items:
+                    type: string
+                failures:
+                  type: array
+                  description: ISBNs that were not added because no book details could be found.
+                  items:
+                    type: string
+                session:
+                  type: object
+                data:
+                  type: array
+                  items:
+                    type: object
+      400:
+        description: No frames provided.
+      404:
+        description: Scanning session not found or expired.
+      401:
+        description: Unauthorized - user not authenticated.
+    """
+
+    if check_session():
+        scan_session = get_scan_session(scan_session_id, get_session_user_id())
+
+        if scan_session is None:
+            return jsonify({"message": "Scanning session not found or expired.", "data": None}), 404
+
+        frames = [file for file in request.files.getlist('frames') + request.files.getlist('file') if file.filename]
+
+        if not frames:
+            return jsonify({"message": "No frames in the request.", "data": None}), 400
+
+        frame_results = []
+        confirmed_isbns = []
+
+        # frames must be applied in order, so requests for the same session take turns
+        with scan_session.lock:
+            for frame in frames:
+                frame_result, newly_confirmed = scan_session.add_frame(get_upload_buffer(frame), decode_frame_isbns)
+                frame_results.append(frame_result)
+                confirmed_isbns += newly_confirmed
+
+            session_summary = scan_session.get_summary()
+
+        book_details = []
+        failures = []
+
+        if confirmed_isbns:
+            authenticated_supabase_client = get_authenticated_client()
+            book_records = add_book_records_using_isbns(authenticated_supabase_client, confirmed_isbns)
+            book_details, failures = book_records['data'], book_records['failures']
+
+        return jsonify({"message": f"Confirmed {len(confirmed_isbns)} new books.", "frames": frame_results,
+                        "confirmed_isbns": confirmed_isbns, "failures": failures, "session": session_summary,
+                        "data": book_details}), 200
+    else:
+        return jsonify({"message": "User not authenticated.", "data": None}), 401
+
+
+@file_bp.route('/scan_session/<scan_session_id>', methods=['GET', 'DELETE'])
+def scan_session_status(scan_session_id):
+
+    """
+    Get or End Scanning Session
+    ---
+    tags:
+      - File Uploads
+    summary: Get a scanning session's progress, or end it with DELETE.
+    parameters:
+      - name: scan_session_id
+        in: path
+        required: true
+        schema:
+          type: string
+    responses:
+      200:
+        description: Scanning session summary, including every ISBN confirmed so far.
+      404:
+        description: Scanning session not found or expired.
+      401:
+        description: Unauthorized - user not authenticated.
+    """
+
+    if check_session():
+        user_id = get_session_user_id()
+        scan_session = end_scan_session(scan_session_id, user_id) if request.method == 'DELETE' else get_scan_session(scan_session_id, user_id)
+
+        if scan_session is None:
+            return jsonify({"message": "Scanning session not found or expired.", "data": None}), 404
+
+        message = "Scanning session ended." if request.method == 'DELETE' else "Scanning session active."
+
+        return jsonify({"message": message, "data": scan_session.get_summary()}), 200
+    else:
+        return jsonify({"message": "User not authenticated.", "data": None}), 401
+
+
+@file_bp.route('/identify_book_from_cover', methods=['POST'])
+def identify_book_from_cover():
+
+    """
+    Identify Book from Cover Photo
+    ---
+    tags:
+      - File Uploads
+    summary: Upload a photo of a book cover and find the matching books.
+    description: >
+      Accepts an image file of a book's front cover and matches it against an index of
+      perceptual hashes of known cover thumbnails. Useful for books without a readable barcode.  
+
+      **Notes:**
+      - The photo is cropped to the cover and straightened where its outline can be found.
+      - Matches are ordered closest first; a lower distance is a closer match.
+      - Books are only matched once their cover has been indexed.
+    requestBody:
+      required: true
+      content:
+        multipart/form-data:
+          schema:
+            type: object
+            properties:
+              file:
+                type: string
+                format: binary
+                description: A photo of the front cover of a book.
+    responses:
+      200:
+        description: Matching books found.
+        content:
+          application/json:
+            schema:
+              type: object
+              properties:
+                message:
+                  type: string
+                  example: "Found 1 matching books."
+                matches:
+                  type: array
+                  items:
+                    type: object
+                    properties:
+                      isbn:
+                        type: string
+                        example: "9780547928227"
+                      distance:
+                        type: integer
+                        example: 6
+                data:
+                  type: array
+                  items:
+                    type: object
+      400:
+        description: No file provided or the file is not an image.
+        content:
+          application/json:
+            schema:
+              type: object
+              properties:
+                message:
+                  type: string
+                  example: "Could not read the image."
+                data:
+                  type: string
+                  nullable: true
+      404:
+        description: No indexed cover matches the photo.
+        content:
+          application/json:
+            schema:
+              type: object
+              properties:
+                message:
+                  type: string
+                  example: "No matching cover found."
+                data:
+                  type: string
+                  nullable: true
+      401:
+        description: Unauthorized - user not authenticated.
+        content:
+          application/json:
+            schema:
+              type: object
+              properties:
+                message:
+                  type: string
+                  example: "User not authenticated."
+                data:
+                  type: string
+                  nullable: true
+    """
+
+    if check_session():
+        if 'file' not in request.files:
+            return jsonify({"message": "No file part in the request.", "data": None}), 400
+
+        file = request.files['file']
+
+        if file.filename == '':
+            return jsonify({"message": "No selected file.", "data": None}), 400
+
+        cover_hashes = compute_cover_hashes(get_upload_buffer(file))
+
+        if cover_hashes is None:
+            return jsonify({"message": "Could not read the image.", "data": None}), 400
+
+        matches = find_matching_covers(cover_hashes)
+
+        if not matches:
+            return jsonify({"message": "No matching cover found.", "data": None}), 404
+
+        authenticated_supabase_client = get_authenticated_client()
+        books = authenticated_supabase_client.table("books").select("*").in_("isbn", [match['isbn'] for match in matches]).execute().data
+
+        # keep the closest match first
+        books_by_isbn = {book['isbn']: book for book in books}
+        book_details = [books_by_isbn[match['isbn']] for match in matches if match['isbn'] in books_by_isbn]
+
+        return jsonify({"message": f"Found {len(book_details)} matching books.", "matches": matches, "data": book_details}), 200
+    else:
+        return jsonify({"message": "User not authenticated.", "data": None}), 401
+
+
 # add route to accept a pdf file upload and extract text using pdfplumber
 @file_bp.route('/upload_pdf/<int:book_id>', methods=['POST'])
 def upload_pdf(book_id):
@@ -257,11 +945,15 @@ def upload_pdf(book_id):
     description: >
       This endpoint allows users to upload a PDF file for a specific book.  
       It will attempt to extract text using **pdfplumber**.  
-      If extraction fails (e.g., scanned PDFs), the system will fall back to OCR using Tesseract.  
+      Pages whose extracted text is empty or unreadable (e.g., scanned pages) fall back to OCR using Tesseract.  
+      Pages are processed in parallel and reassembled in order.  
 
       **Notes:**
       - Only PDF files are accepted.
       - A valid `book_id` must be supplied in the URL.
+      - Files are stored by content hash, so re-uploading an identical PDF reuses the stored file and its extracted text.
+      - Pass `stream=ndjson` or `stream=sse` to receive each page as soon as it is extracted,
+        followed by a final `{"done": true, "page_count": ..., "ocr_page_count": ...}` event.
       - Extracted text may require manual cleanup for formatting issues.
     parameters:
       - in: path
@@ -270,6 +962,13 @@ def upload_pdf(book_id):
         schema:
           type: integer
         description: The ID of the book the PDF should be associated with.
+      - in: query
+        name: stream
+        required: false
+        schema:
+          type: string
+          enum: [ndjson, sse]
+        description: Stream pages as NDJSON lines or server-sent events instead of returning all text at once.
     requestBody:
       required: true
       content:
@@ -295,6 +994,19 @@ def upload_pdf(book_id):
                 data:
                   type: string
                   example: "Once upon a time, in a hole in the ground there lived a hobbit..."
+          application/x-ndjson:
+            schema:
+              type: object
+              properties:
+                page:
+                  type: integer
+                  example: 1
+                text:
+                  type: string
+                  example: "Once upon a time, in a hole in the ground there lived a hobbit..."
+                ocr:
+                  type: boolean
+                  example: false
       400:
         description: Invalid file format or processing error.
         content:
@@ -327,7 +1039,6 @@ def upload_pdf(book_id):
     # normal text extraction is faster and more accurate if the PDF is machine readable
     # OCR is needed for scanned documents and images embedded in PDFs
     # But also - machine readable can have formatting issues (missing spaces, line breaks, etc) - which OCR can sometimes handle better
-    # Maybe use a hybrid approach - try normal extraction first, if the text is below a certain threshold, then use OCR
 
     if check_session():
 
@@ -339,53 +1050,20 @@ def upload_pdf(book_id):
             return jsonify({"message": "No selected file.", "data": None}), 400
 
         if file and werkzeug.utils.secure_filename(file.filename).endswith('.pdf'):
-            filename = werkzeug.utils.secure_filename(file.filename)
-            upload_filename = os.path.join('api', 'uploads', filename)
-            file.save(upload_filename)
-
             authenticated_supabase_client = get_authenticated_client()
 
-            with open(upload_filename, "rb") as f:
-                response = (
-                    authenticated_supabase_client.storage
-                    .from_("uploads")
-                    .upload(
-                        file=f,
-                        path=f"public/{filename}",
-                        file_options={"cache-control": "3600", "upsert": "false"}
-                    )
-                )
-
-            if response:
-                file_url = authenticated_supabase_client.storage.from_("uploads").get_public_url(f"public/{filename}")
-
-                record = {
-                    "book_file": file_url,
-                    "book_id": book_id
-                }
-
-                add_record(authenticated_supabase_client, "book_files", record)
-
-            all_text = ""
-            combined_text = ""
-
-            with pdfplumber.open(upload_filename) as pdf:
-                for page in tqdm(pdf.pages):
-                    page_text = page.extract_text()
-                    combined_text += page_text
-                    all_text += page_text + "\n"
+            # stored by content hash - repeat uploads of the same PDF skip both upload and extraction
+            stream_format = request.args.get('stream')
 
-            if not combined_text:
-                all_text = ""
-                with pdfplumber.open(upload_filename) as pdf:
-                    for page in tqdm(pdf.pages):
-                        pil_image = page.to_image(resolution=300).original
-                        text = pytesseract.image_to_string(pil_image)
-                        all_text += text + "\n"
+            if stream_format in ('ndjson', 'sse'):
+                page_results = iter_book_pdf_pages(authenticated_supabase_client, book_id, get_upload_source(file))
+                mimetype = 'text/event-stream' if stream_format == 'sse' else 'application/x-ndjson'
 
-            all_text.replace("  ", " ")
+                # each page is sent as soon as it is extracted
+                return Response(stream_with_context(iter_page_events(page_results, stream_format)),
+                                mimetype=mimetype, headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
-            os.remove(upload_filename)
+            all_text = get_book_pdf_text(authenticated_supabase_client, book_id, get_upload_source(file))
 
             return jsonify({
                 "message": "File uploaded and text extracted successfully.",
@@ -490,8 +1168,7 @@ def add_text_to_book(book_id):
             file = request.files['file']
             if file and werkzeug.utils.secure_filename(file.filename).endswith('.pdf'):
                 # extract text from uploaded PDF
-                response = upload_pdf(book_id)
-                extracted_text = response[0].json['data']
+                extracted_text = get_book_pdf_text(get_authenticated_client(), book_id, get_upload_source(file))
             else:
                 if not extracted_text:
                     return jsonify({"message": "No text or file provided to add to the book.", "data": None}), 400
@@ -321,6 +321,11 @@ def login():
 
     session['access_token'] = res.session.access_token
     session['refresh_token'] = res.session.refresh_token
+    session['user_id'] = str(res.user.id)
+
+    # the library is looked up again, and a new conversation started, for whoever has just logged in
+    session.pop('library_id', None)
+    session.pop('conversation_id', None)
 
     return jsonify({"message": "Login successful.", "data": None}), 200
 
@@ -410,6 +415,9 @@ def logout():
         client.auth.sign_out()
         session.pop('access_token', None)
         session.pop('refresh_token', None)
+        session.pop('user_id', None)
+        session.pop('library_id', None)
+        session.pop('conversation_id', None)
 
         return jsonify({"message": "Logout successful.", "data": None}), 200
     else:
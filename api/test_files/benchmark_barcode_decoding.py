@@ -0,0 +1,196 @@
+# benchmark detect_and_decode_barcode over the labelled photos in api/images
+# usage: python -m api.test_files.benchmark_barcode_decoding [--scales 1 0.5 0.25] [--repeats 3] [--output report.json]
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+import cv2
+import numpy as np
+
+# resource is Unix-only - on Windows only the tracemalloc peak is reported
+try:
+    import resource
+except ImportError:
+    resource = None
+
+try:
+    from tools.image_recognition import detect_and_decode_barcode
+except (ImportError, ModuleNotFoundError):
+    from api.tools.image_recognition import detect_and_decode_barcode
+
+API_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+IMAGES_DIR = os.path.join(API_DIR, "images")
+LABELS_PATH = os.path.join(API_DIR, "test_files", "barcode_benchmark_labels.json")
+
+# scale factors each image is resized to before decoding - 1 is the original photo
+DEFAULT_SCALES = [1.0, 0.5, 0.25]
+
+
+def load_corpus(images_dir: str = IMAGES_DIR, labels_path: str = LABELS_PATH):
+
+    """Load (filename, image bytes, expected ISBNs) for every labelled image."""
+
+    with open(labels_path) as f:
+        labels = json.load(f)
+
+    corpus = []
+
+    for filename, expected_isbns in sorted(labels.items()):
+        with open(os.path.join(images_dir, filename), "rb") as f:
+            corpus.append((filename, f.read(), expected_isbns))
+
+    return corpus
+
+
+def resize_image_bytes(image_bytes: bytes, filename: str, scale: float):
+
+    """Resize encoded image bytes by a scale factor, re-encoding in the original format."""
+
+    if scale == 1:
+        return image_bytes
+
+    image = cv2.imdecode(np.frombuffer(image_bytes, np.uint8), cv2.IMREAD_COLOR)
+    if image is None:
+        return image_bytes
+
+    resized = cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    extension = os.path.splitext(filename)[1].lower()
+
+    return cv2.imencode(extension if extension in (".png", ".jpg", ".jpeg") else ".png", resized)[1].tobytes()
+
+
+def get_max_rss_bytes():
+
+    """Get the process's peak resident set size so far, in bytes, or None where it cannot be measured."""
+
+    if resource is None:
+        return None
+
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # macOS reports bytes, Linux reports kilobytes
+    return max_rss if platform.system() == "Darwin" else max_rss * 1024
+
+
+def benchmark_configuration(corpus: list, scale: float, repeats: int):
+
+    """Decode every image in the corpus at one scale, returning the configuration's summary and per-image results."""
+
+    image_results = []
+    latencies = []
+
+    # traced allocations cover numpy arrays (including OpenCV outputs), not OpenCV/zbar internals
+    tracemalloc.start()
+    rss_before = get_max_rss_bytes()
+
+    for filename, image_bytes, expected_isbns in corpus:
+        image_bytes = resize_image_bytes(image_bytes, filename, scale)
+        image_latencies = []
+
+        for _ in range(repeats):
+            start_time = time.perf_counter()
+            isbns = detect_and_decode_barcode(image_bytes)
+            image_latencies.append(time.perf_counter() - start_time)
+
+        latencies += image_latencies
+
+        image_results.append({
+            "filename": filename,
+            "expected_isbns": expected_isbns,
+            "decoded_isbns": isbns,
+            "correct": set(expected_isbns).issubset(isbns) and not set(isbns) - set(expected_isbns),
+            "latency_ms": round(float(np.median(image_latencies)) * 1000, 3),
+        })
+
+    _, traced_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    positives = [result for result in image_results if result["expected_isbns"]]
+    negatives = [result for result in image_results if not result["expected_isbns"]]
+
+    summary = {
+        "scale": scale,
+        "images": len(image_results),
+        "decode_rate": round(sum(result["correct"] for result in positives) / len(positives), 4) if positives else None,
+        "false_positive_images": sum(bool(result["decoded_isbns"]) for result in negatives),
+        "p50_latency_ms": round(float(np.percentile(latencies, 50)) * 1000, 3),
+        "p95_latency_ms": round(float(np.percentile(latencies, 95)) * 1000, 3),
+        "peak_traced_memory_bytes": traced_peak,
+        "max_rss_growth_bytes": get_max_rss_bytes() - rss_before if rss_before is not None else None,
+    }
+
+    return summary, image_results
+
+
+def get_git_commit():
+
+    """Get the current git commit, so reports from different decoder versions can be told apart."""
+
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=API_DIR, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmark(scales: list = DEFAULT_SCALES, repeats: int = 3, images_dir: str = IMAGES_DIR, labels_path: str = LABELS_PATH):
+
+    """Benchmark the decoder at each scale, returning a JSON-serialisable report."""
+
+    corpus = load_corpus(images_dir, labels_path)
+
+    # warm up lazily created detectors and thread pools so they don't count against the first configuration
+    detect_and_decode_barcode(corpus[0][1])
+
+    configurations = []
+
+    for scale in scales:
+        summary, image_results = benchmark_configuration(corpus, scale, repeats)
+        configurations.append({**summary, "results": image_results})
+
+    return {
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "git_commit": get_git_commit(),
+        "python_version": platform.python_version(),
+        "opencv_version": cv2.__version__,
+        "cpu_count": os.cpu_count(),
+        "repeats": repeats,
+        "configurations": configurations,
+    }
+
+
+def print_report(report: dict):
+
+    """Print a one-line summary per configuration."""
+
+    print(f"{'scale':>6} {'decode rate':>12} {'false pos':>10} {'p50 ms':>9} {'p95 ms':>9} {'peak MB':>8}")
+
+    for configuration in report["configurations"]:
+        decode_rate = configuration["decode_rate"]
+        print(f"{configuration['scale']:>6} {'-' if decode_rate is None else f'{decode_rate:.0%}':>12} "
+              f"{configuration['false_positive_images']:>10} {configuration['p50_latency_ms']:>9.1f} "
+              f"{configuration['p95_latency_ms']:>9.1f} {configuration['peak_traced_memory_bytes'] / 1e6:>8.1f}")
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Benchmark ISBN barcode decoding over a labelled image corpus.")
+    parser.add_argument("--scales", type=float, nargs="+", default=DEFAULT_SCALES)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--images-dir", default=IMAGES_DIR)
+    parser.add_argument("--labels", default=LABELS_PATH)
+    parser.add_argument("--output", default="barcode_benchmark_report.json")
+    args = parser.parse_args()
+
+    benchmark_report = run_benchmark(args.scales, args.repeats, args.images_dir, args.labels)
+
+    with open(args.output, "w") as f:
+        json.dump(benchmark_report, f, indent=2)
+
+    print_report(benchmark_report)
+    print(f"Report written to {args.output}")
@@ -0,0 +1,104 @@
+import pytest
+
+# the intent classifier is trained with scikit-learn
+pytest.importorskip("sklearn")
+
+from api.ragbot_tools.catalog_router import route_query, extract_entity, parse_age_span, answer_catalog_query
+
+BOOKS = [
+    {"title": "Matilda", "authors": "Roald Dahl", "lexile_measure": "840L", "age_range": "8-12", "categories": "Juvenile Fiction"},
+    {"title": "The Gruffalo", "authors": "Julia Donaldson", "lexile_measure": None, "age_range": "3-5",
+     "categories": "Picture Books"},
+    {"title": "Bleak House", "authors": "Charles Dickens", "lexile_measure": "1330L", "age_range": "14+", "categories": "Fiction"},
+]
+
+
+@pytest.mark.parametrize("question, route", [
+    ("books by roald dahl", ("author", "roald dahl", None)),
+    ("Which books are by Enid Blyton?", ("author", "enid blyton", None)),
+    ("books by the author roald dahl", ("author", "roald dahl", None)),
+    ("what lexile is bleak house", ("lexile", "bleak house", None)),
+    ("picture books for EYFS", ("age_range", "eyfs", "picture")),
+    ("books for ks2", ("age_range", "ks2", None)),
+    ("show me fantasy books", ("category", "fantasy", None)),
+    ("books in the animals category", ("category", "animals", None)),
+])
+def test_catalog_questions_routed(question, route):
+
+    assert route_query(question) == route
+
+
+@pytest.mark.parametrize("question", [
+    "what is matilda about",
+    "recommend a book for a child who loves dragons",
+    "books for 8 year olds about friendship",
+    "new books",
+    "what lexile is it",
+    "tell me a joke about books",
+])
+def test_open_questions_go_to_the_agent(question):
+
+    assert route_query(question) is None
+
+
+@pytest.mark.parametrize("intent, question", [
+    ("category", "show me books"),
+    ("category", "our books"),
+    ("author", "any books by the author"),
+])
+def test_filler_words_are_not_entities(intent, question):
+
+    assert extract_entity(intent, question) is None
+
+
+def test_filler_words_dropped_from_category():
+
+    assert extract_entity("age_range", "show me books for ks1") == ("ks1", None)
+
+
+@pytest.mark.parametrize("text, span", [
+    ("7-9", (7, 9)),
+    ("Ages 8+", (8, 18)),
+    ("10 year olds", (10, 10)),
+    ("KS2", (7, 11)),
+    ("key stage 1", (5, 7)),
+    ("", None),
+    (None, None),
+])
+def test_parse_age_span(text, span):
+
+    assert parse_age_span(text) == span
+
+
+def test_author_answer():
+
+    answer = answer_catalog_query("author", "roald dahl", BOOKS)
+
+    assert answer.startswith("Books by Roald Dahl in your library:")
+    assert "Matilda" in answer
+    assert "Gruffalo" not in answer
+
+
+def test_lexile_answer():
+
+    assert answer_catalog_query("lexile", "matilda", BOOKS) == "Matilda has a Lexile measure of 840L."
+    assert answer_catalog_query("lexile", "the gruffalo", BOOKS) == "The Gruffalo does not have a Lexile measure recorded."
+
+
+def test_age_range_answer_uses_overlap():
+
+    answer = answer_catalog_query("age_range", "10-11", BOOKS)
+
+    assert "Matilda" in answer
+    assert "Gruffalo" not in answer and "Bleak House" not in answer
+
+
+def test_age_range_answer_narrowed_by_category():
+
+    assert "The Gruffalo" in answer_catalog_query("age_range", "eyfs", BOOKS, category="picture")
+    assert answer_catalog_query("age_range", "eyfs", BOOKS, category="poetry") is None
+
+
+def test_no_matches_left_to_the_agent():
+
+    assert answer_catalog_query("author", "terry pratchett", BOOKS) is None
@@ -0,0 +1,88 @@
+from langchain_core.messages import HumanMessage, AIMessage, SystemMessage
+
+from api.ragbot_tools.chat_history import split_into_turns, compact_chat_history, build_chat_history_messages
+
+
+def make_turns(count: int, words: int = 5):
+
+    messages = []
+    for i in range(count):
+        messages += [HumanMessage(content=f"question {i} " + "word " * words), AIMessage(content=f"answer {i} " + "word " * words)]
+
+    return messages
+
+
+def summarize_turns(summary: str, messages: list):
+
+    return (summary + " " if summary else "") + " | ".join(message.content.split()[0] + message.content.split()[1]
+                                                          for message in messages)
+
+
+def test_split_into_turns_drops_system_messages():
+
+    messages = [SystemMessage(content="old prompt"), AIMessage(content="hello"), HumanMessage(content="hi"),
+                AIMessage(content="one"), AIMessage(content="two"), HumanMessage(content="bye")]
+
+    assert [[message.content for message in turn] for turn in split_into_turns(messages)] == [["hello"], ["hi", "one", "two"], ["bye"]]
+
+
+def test_short_history_kept_verbatim():
+
+    messages = make_turns(3)
+
+    kept, summary = compact_chat_history(messages, "", summarize_turns, recent_turns=4, token_budget=10000)
+
+    assert kept == messages
+    assert summary == ""
+
+
+def test_older_turns_folded_into_summary():
+
+    messages = make_turns(6)
+
+    kept, summary = compact_chat_history(messages, "earlier", summarize_turns, recent_turns=4, token_budget=10000)
+
+    assert kept == messages[4:]
+    assert summary == "earlier question0 | answer0 | question1 | answer1"
+
+
+def test_token_budget_folds_more_turns():
+
+    messages = make_turns(4, words=100)
+
+    kept, summary = compact_chat_history(messages, "", summarize_turns, recent_turns=4, token_budget=250)
+
+    # each turn is about 200 tokens, so only the latest fits
+    assert kept == messages[-2:]
+    assert "question2" in summary and "question3" not in summary
+
+
+def test_latest_turn_kept_even_over_budget():
+
+    messages = make_turns(2, words=1000)
+
+    kept, _ = compact_chat_history(messages, "", summarize_turns, recent_turns=4, token_budget=10)
+
+    assert kept == messages[-2:]
+
+
+def test_summary_not_rebuilt_when_nothing_folded():
+
+    def fail(summary, messages):
+        raise AssertionError("nothing should be summarised")
+
+    kept, summary = compact_chat_history(make_turns(2), "kept summary", fail, recent_turns=4, token_budget=10000)
+
+    assert summary == "kept summary"
+
+
+def test_build_chat_history_puts_summary_first():
+
+    messages = make_turns(1)
+
+    assert build_chat_history_messages(messages, "") == messages
+
+    history = build_chat_history_messages(messages, "they asked about dragons")
+
+    assert isinstance(history[0], SystemMessage) and "they asked about dragons" in history[0].content
+    assert history[1:] == messages
@@ -0,0 +1,134 @@
+import pytest
+
+from api.ragbot_tools import conversation_store
+from api.ragbot_tools.conversation_store import SQLiteConversationStore
+
+
+class FakeClock:
+
+    def __init__(self):
+
+        self.now = 1_000_000.0
+
+    def time(self):
+
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+
+    fake_clock = FakeClock()
+    monkeypatch.setattr(conversation_store, "time", fake_clock)
+
+    return fake_clock
+
+
+@pytest.fixture
+def store(tmp_path, clock):
+
+    return SQLiteConversationStore(str(tmp_path / "conversations.sqlite3"), ttl=60)
+
+
+def message(content: str, message_type: str = "HumanMessage"):
+
+    return {"type": message_type, "content": content}
+
+
+def contents(conversation):
+
+    return [stored_message["content"] for _, stored_message in conversation[1]]
+
+
+def test_unknown_conversation_is_empty(store):
+
+    assert store.get_conversation("missing") == ("", [])
+
+
+def test_messages_appended_in_order(store):
+
+    store.append_messages("c", [message("hi")])
+    store.append_messages("c", [message("hello", "AIMessage"), message("again")])
+
+    summary, messages = store.get_conversation("c")
+
+    assert summary == ""
+    assert [stored_message for _, stored_message in messages] == [message("hi"), message("hello", "AIMessage"), message("again")]
+
+
+def test_conversations_kept_apart(store):
+
+    store.append_messages("a", [message("for a")])
+    store.append_messages("b", [message("for b")])
+
+    assert contents(store.get_conversation("a")) == ["for a"]
+
+
+def test_summary_hides_the_messages_it_covers(store):
+
+    store.append_messages("c", [message("one"), message("two"), message("three")])
+    _, messages = store.get_conversation("c")
+
+    store.set_summary("c", "one and two", messages[1][0])
+
+    summary, remaining = store.get_conversation("c")
+
+    assert summary == "one and two"
+    assert [stored_message["content"] for _, stored_message in remaining] == ["three"]
+
+
+def test_appends_never_overwrite_a_summary(store):
+
+    store.append_messages("c", [message("one")])
+    store.set_summary("c", "summary", store.get_conversation("c")[1][0][0])
+    store.append_messages("c", [message("two")])
+
+    assert store.get_conversation("c")[0] == "summary"
+    assert contents(store.get_conversation("c")) == ["two"]
+
+
+def test_expired_conversation_reads_as_empty(store, clock):
+
+    store.append_messages("c", [message("old")])
+    clock.now += 61
+
+    assert store.get_conversation("c") == ("", [])
+
+
+def test_activity_keeps_a_conversation_alive(store, clock):
+
+    store.append_messages("c", [message("one")])
+    clock.now += 50
+    store.append_messages("c", [message("two")])
+    clock.now += 50
+
+    assert contents(store.get_conversation("c")) == ["one", "two"]
+
+
+def test_append_to_expired_conversation_starts_fresh(store, clock):
+
+    store.append_messages("c", [message("old")])
+    store.set_summary("c", "old summary", 0)
+    # keep the periodic purge from clearing it first
+    store.purged_at = clock.now + 3600
+    clock.now += 61
+
+    store.append_messages("c", [message("new")])
+
+    summary, messages = store.get_conversation("c")
+
+    assert summary == ""
+    assert [stored_message["content"] for _, stored_message in messages] == ["new"]
+
+
+def test_purge_deletes_expired_conversations(store, clock):
+
+    store.append_messages("old", [message("old")])
+    clock.now += 61
+    store.append_messages("new", [message("new")])
+
+    store.purge_expired()
+
+    with store._connect() as connection:
+        assert connection.execute("select conversation_id from conversations").fetchall() == [("new",)]
+        assert connection.execute("select content from conversation_messages").fetchall() == [("new",)]
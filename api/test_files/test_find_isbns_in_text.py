@@ -0,0 +1,51 @@
+import pytest
+
+# image_recognition needs the zbar shared library through pyzbar
+pytest.importorskip("pyzbar.pyzbar", exc_type=ImportError)
+
+from api.tools.image_recognition import find_isbns_in_text
+
+
+def test_labelled_isbn13():
+
+    assert find_isbns_in_text("ISBN 978-0-241-55884-3") == ["9780241558843"]
+    assert find_isbns_in_text("ISBN-13: 9780241558843") == ["9780241558843"]
+
+
+def test_standalone_barcode_digits():
+
+    assert find_isbns_in_text("9 780241 558843") == ["9780241558843"]
+
+
+def test_repeated_isbn_returned_once():
+
+    assert find_isbns_in_text("ISBN 978-0-241-55884-3\n9 780241 558843") == ["9780241558843"]
+
+
+def test_isbn10_converted_to_isbn13():
+
+    assert find_isbns_in_text("ISBN 0-14-032872-6") == ["9780140328721"]
+
+
+def test_isbn13_preferred_over_isbn10():
+
+    assert find_isbns_in_text("ISBN 0140328726\nISBN 978-0-241-55884-3") == ["9780241558843"]
+
+
+def test_failed_checksum_returns_nothing():
+
+    # one misread digit - never fall back to a guess
+    assert find_isbns_in_text("ISBN 978-0-241-55884-8") == []
+    assert find_isbns_in_text("ISBN 978-0-241-55884-3\n9 780241 558849") == []
+
+
+def test_windows_never_slid_across_longer_runs():
+
+    assert find_isbns_in_text("12345 978024155884312") == []
+    assert find_isbns_in_text("ISBN 97802415588431") == []
+
+
+def test_unlabelled_digits_with_other_text_ignored():
+
+    assert find_isbns_in_text("PRICE 0140328726 GBP") == []
+    assert find_isbns_in_text("") == []
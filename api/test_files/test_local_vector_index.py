@@ -0,0 +1,88 @@
+import pytest
+
+from api.ragbot_tools.local_vector_index import LocalVectorIndex
+
+DOCUMENTS = [
+    ("a", [1, 0, 0], {"isbn": "111", "lexile_measure": "650L", "year": "2001-05-01", "age_range": "7-9", "categories": "Fantasy"}),
+    ("b", [0, 1, 0], {"isbn": "222", "lexile_measure": "900L", "year": "1999", "age_range": "8-10", "categories": "History"}),
+    ("c", [0, 0, 1], {"isbn": "333", "lexile_measure": None, "year": "unknown", "age_range": "7-9",
+                      "categories": "Juvenile Fiction, Fantasy"}),
+]
+
+
+@pytest.fixture
+def index(tmp_path):
+
+    local_index = LocalVectorIndex(str(tmp_path / "index"), dimensions=3, use_hnsw=False)
+    local_index.append([document_id for document_id, _, _ in DOCUMENTS], [vector for _, vector, _ in DOCUMENTS],
+                       [f"content {document_id}" for document_id, _, _ in DOCUMENTS], [metadata for _, _, metadata in DOCUMENTS])
+
+    return local_index
+
+
+def kept(index, retrieval_filter, library_isbns=None):
+
+    mask = index.get_filter_mask(retrieval_filter, library_isbns)
+
+    return None if mask is None else [document_id for document_id, keep in zip(index.ids, mask) if keep]
+
+
+def test_no_filter_gives_no_mask(index):
+
+    assert kept(index, None) is None
+    assert kept(index, {}) is None
+
+
+def test_metadata_matched_exactly(index):
+
+    assert kept(index, {"age_range": "7-9"}) == ["a", "c"]
+    assert kept(index, {"age_range": "8"}) == []
+
+
+def test_library_keeps_its_isbns(index):
+
+    assert kept(index, {"library_id": 1}, library_isbns={"111", "333"}) == ["a", "c"]
+    assert kept(index, {"library_id": 1}, library_isbns=set()) == []
+
+
+def test_lexile_bounds_read_digits_and_skip_missing(index):
+
+    assert kept(index, {"min_lexile": 700}) == ["b"]
+    assert kept(index, {"max_lexile": 700}) == ["a"]
+
+
+def test_year_bounds_use_the_leading_four_digits(index):
+
+    assert kept(index, {"min_year": 2000}) == ["a"]
+    assert kept(index, {"min_year": 1990, "max_year": 2005}) == ["a", "b"]
+
+
+def test_category_is_a_case_insensitive_substring(index):
+
+    assert kept(index, {"category": "fantasy"}) == ["a", "c"]
+
+
+def test_filters_combine(index):
+
+    assert kept(index, {"category": "fantasy", "max_lexile": 700}, library_isbns=None) == ["a"]
+
+
+def test_operator_filters_rejected(index):
+
+    with pytest.raises(ValueError):
+        index.get_filter_mask({"age_range": {"$in": ["7-9"]}})
+
+
+def test_search_only_returns_filtered_rows(index):
+
+    results = index.search([1, 1, 1], k=3, retrieval_filter={"category": "history"})
+
+    assert [document.id for document, _ in results] == ["b"]
+
+
+def test_search_ranks_by_similarity(index):
+
+    results = index.search([0.1, 0.2, 1], k=2)
+
+    assert [document.id for document, _ in results] == ["c", "b"]
+    assert results[0][1] > results[1][1]
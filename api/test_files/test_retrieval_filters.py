@@ -0,0 +1,58 @@
+import pytest
+
+from api.ragbot_tools.retrieval_filters import parse_retrieval_filters, split_retrieval_filter, get_retrieval_filter_key
+
+
+def test_scoped_to_library_by_default():
+
+    assert parse_retrieval_filters(None, library_id=7) == {"library_id": 7}
+    assert parse_retrieval_filters({}, library_id=None) == {}
+
+
+def test_library_false_searches_every_book():
+
+    assert parse_retrieval_filters({"library": False}, library_id=7) == {}
+
+
+def test_ranges_category_and_metadata():
+
+    retrieval_filter = parse_retrieval_filters({"lexile_min": 400, "lexile_max": 700, "year_min": 2000, "year_max": 2024,
+                                                "category": " Fiction ", "age_range": "7-9"}, library_id=7)
+
+    assert retrieval_filter == {"library_id": 7, "min_lexile": 400, "max_lexile": 700, "min_year": 2000, "max_year": 2024,
+                                "category": "Fiction", "age_range": "7-9"}
+
+
+@pytest.mark.parametrize("request_filters", [
+    ["age_range"],
+    "7-9",
+    {"lexile_min": "400"},
+    {"year_max": True},
+    {"category": "  "},
+    {"age_range": 8},
+    {"colour": "red"},
+])
+def test_malformed_filters_raise_value_error(request_filters):
+
+    with pytest.raises(ValueError):
+        parse_retrieval_filters(request_filters, library_id=7)
+
+
+def test_split_into_arguments_and_metadata():
+
+    arguments, metadata_filter = split_retrieval_filter({"library_id": 7, "min_year": 2000, "age_range": "7-9"})
+
+    assert arguments == {"library_id": 7, "min_year": 2000}
+    assert metadata_filter == {"age_range": "7-9"}
+
+
+def test_operator_filters_rejected():
+
+    with pytest.raises(ValueError):
+        split_retrieval_filter({"age_range": {"$in": ["7-9", "8-10"]}})
+
+
+def test_filter_key_ignores_order():
+
+    assert get_retrieval_filter_key({"a": 1, "b": 2}) == get_retrieval_filter_key({"b": 2, "a": 1})
+    assert get_retrieval_filter_key(None) == get_retrieval_filter_key({})
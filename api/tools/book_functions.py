@@ -1,8 +1,31 @@
+import os
 import json
 import textwrap
+import threading
 import urllib.request
+from concurrent.futures import ThreadPoolExecutor
 from isbnlib import isbn_from_words, meta, cover
 
+try:
+    from tools.cache_functions import DiskLRUCache
+except (ImportError, ModuleNotFoundError):
+    from api.tools.cache_functions import DiskLRUCache
+
+# enriched book records kept on disk between a scan preview and its commit (or a restart)
+BOOK_RECORD_CACHE_MAX_BYTES = int(os.environ.get("BOOKWORM_BOOK_RECORD_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+
+# concurrent background metadata lookups started by scan previews
+ENRICHMENT_WORKERS = 8
+
+_book_record_cache = None
+
+# created on the first preview rather than at import, so scripts importing this module start no threads,
+# and per process, as a forked worker inherits the parent's executor but none of its threads
+_enrichment_executor = None
+_enrichment_executor_pid = None
+_enrichment_lock = threading.Lock()
+_pending_enrichments = {}
+
 
 def get_isbn_for_book(title, author):
 
@@ -217,6 +240,99 @@ def create_book_record_using_isbn(isbn: str):
     return book_record
 
 
+def get_book_record_cache():
+
+    """Get the on-disk cache of enriched book records, creating it on first use."""
+
+    global _book_record_cache
+
+    if _book_record_cache is None:
+        _book_record_cache = DiskLRUCache("book_records", BOOK_RECORD_CACHE_MAX_BYTES)
+
+    return _book_record_cache
+
+
+def enrich_book_record(isbn: str):
+
+    """Create a book record from the metadata services and cache it, unless the lookup found nothing."""
+
+    book_record = create_book_record_using_isbn(isbn)
+
+    # a failed lookup may just be a network blip, so it is retried next time rather than cached
+    if book_record['title'] != "Unknown Title":
+        get_book_record_cache().set(isbn, json.dumps(book_record))
+
+    return book_record
+
+
+def _finish_enrichment(isbn: str, future):
+
+    with _enrichment_lock:
+        if _pending_enrichments.get(isbn) is future:
+            del _pending_enrichments[isbn]
+
+
+def get_cached_book_record(isbn: str):
+
+    """Get an already enriched book record, or None if it has not been looked up yet."""
+
+    cached_record = get_book_record_cache().get(isbn)
+
+    return json.loads(cached_record) if cached_record is not None else None
+
+
+def get_enrichment_executor():
+
+    """Get this process's background metadata lookup thread pool, creating it on first use. Call with _enrichment_lock held."""
+
+    global _enrichment_executor, _enrichment_executor_pid
+
+    if _enrichment_executor_pid != os.getpid():
+        _enrichment_executor = ThreadPoolExecutor(max_workers=ENRICHMENT_WORKERS, thread_name_prefix="book_enrichment")
+        _enrichment_executor_pid = os.getpid()
+
+    return _enrichment_executor
+
+
+def start_book_enrichment(isbn: str):
+
+    """Start looking up a book's metadata in the background, returning the lookup's future.
+
+    Repeat calls for an ISBN already being looked up share the same lookup.
+    """
+
+    with _enrichment_lock:
+        future = _pending_enrichments.get(isbn)
+
+        if future is None:
+            future = get_enrichment_executor().submit(enrich_book_record, isbn)
+            _pending_enrichments[isbn] = future
+            future.add_done_callback(lambda done_future: _finish_enrichment(isbn, done_future))
+
+    return future
+
+
+def get_enriched_book_record(isbn: str):
+
+    """Get a book record for an ISBN, reusing a cached or in-flight background lookup before starting a new one."""
+
+    book_record = get_cached_book_record(isbn)
+    if book_record is not None:
+        return book_record
+
+    with _enrichment_lock:
+        future = _pending_enrichments.get(isbn)
+
+    if future is not None:
+        try:
+            return future.result()
+        except Exception:
+            # the background lookup failed - retry it in the foreground
+            pass
+
+    return enrich_book_record(isbn)
+
+
 if __name__ == "__main__":
 
     # Example usage
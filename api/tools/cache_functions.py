@@ -0,0 +1,136 @@
+import os
+import time
+import sqlite3
+import hashlib
+import tempfile
+
+CACHE_DIR = os.environ.get("BOOKWORM_CACHE_DIR", os.path.join(tempfile.gettempdir(), "bookworm_cache"))
+
+# sqlite limits the number of bound parameters per statement
+MAX_KEYS_PER_QUERY = 500
+
+
+def get_content_hash(source, block_size: int = 1024 * 1024):
+
+    """Get the SHA-256 hex digest of a file path, bytes object or binary file object."""
+
+    content_hash = hashlib.sha256()
+
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        content_hash.update(source)
+    elif hasattr(source, 'read'):
+        position = source.tell()
+        for block in iter(lambda: source.read(block_size), b""):
+            content_hash.update(block)
+        source.seek(position)
+    else:
+        with open(source, "rb") as f:
+            for block in iter(lambda: f.read(block_size), b""):
+                content_hash.update(block)
+
+    return content_hash.hexdigest()
+
+
+class DiskLRUCache:
+
+    """Size-bounded key/value cache stored in SQLite, evicting least recently used entries."""
+
+    def __init__(self, name: str, max_bytes: int, cache_dir: str = CACHE_DIR):
+
+        os.makedirs(cache_dir, exist_ok=True)
+
+        self.path = os.path.join(cache_dir, f"{name}.sqlite3")
+        self.max_bytes = max_bytes
+
+        with self._connect() as connection:
+            connection.execute("create table if not exists cache_entries ("
+                               "key text primary key, value text not null, "
+                               "size integer not null, last_access real not null)")
+            connection.execute("create index if not exists cache_entries_last_access on cache_entries (last_access)")
+
+    def _connect(self):
+
+        # a connection per call keeps the cache safe to use from request threads
+        return sqlite3.connect(self.path, timeout=10)
+
+    def get(self, key: str):
+
+        """Get a cached value, or None if the key is not cached."""
+
+        return self.get_many([key]).get(key)
+
+    def get_many(self, keys: list):
+
+        """Get the cached values for the given keys as a dict, omitting keys that are not cached."""
+
+        cached_values = {}
+        now = time.time()
+
+        with self._connect() as connection:
+            for i in range(0, len(keys), MAX_KEYS_PER_QUERY):
+                key_batch = keys[i:i + MAX_KEYS_PER_QUERY]
+                placeholders = ",".join("?" * len(key_batch))
+
+                rows = connection.execute(f"select key, value from cache_entries where key in ({placeholders})", key_batch).fetchall()
+                cached_values.update(rows)
+
+                connection.execute(f"update cache_entries set last_access = ? where key in ({placeholders})", [now] + key_batch)
+
+        return cached_values
+
+    def get_cached_keys(self, keys: list):
+
+        """Get the set of the given keys that are cached, without reading their values."""
+
+        cached_keys = set()
+        now = time.time()
+
+        with self._connect() as connection:
+            for i in range(0, len(keys), MAX_KEYS_PER_QUERY):
+                key_batch = keys[i:i + MAX_KEYS_PER_QUERY]
+                placeholders = ",".join("?" * len(key_batch))
+
+                rows = connection.execute(f"select key from cache_entries where key in ({placeholders})", key_batch).fetchall()
+                cached_keys.update(key for key, in rows)
+
+                connection.execute(f"update cache_entries set last_access = ? where key in ({placeholders})", [now] + key_batch)
+
+        return cached_keys
+
+    def set(self, key: str, value: str):
+
+        """Cache a value under the given key."""
+
+        self.set_many({key: value})
+
+    def set_many(self, items: dict):
+
+        """Cache several values at once, then evict old entries if over the size limit."""
+
+        if not items:
+            return
+
+        now = time.time()
+
+        with self._connect() as connection:
+            connection.executemany("insert or replace into cache_entries (key, value, size, last_access) values (?, ?, ?, ?)",
+                                   [(key, value, len(value.encode("utf-8")), now) for key, value in items.items()])
+            self._evict(connection)
+
+    def _evict(self, connection):
+
+        total_size = connection.execute("select coalesce(sum(size), 0) from cache_entries").fetchone()[0]
+        if total_size <= self.max_bytes:
+            return
+
+        excess_size = total_size - self.max_bytes
+        freed_size = 0
+        evicted_keys = []
+
+        for key, size in connection.execute("select key, size from cache_entries order by last_access"):
+            evicted_keys.append((key,))
+            freed_size += size
+            if freed_size >= excess_size:
+                break
+
+        connection.executemany("delete from cache_entries where key = ?", evicted_keys)
@@ -0,0 +1,224 @@
+import os
+import threading
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+try:
+    from tools.cache_functions import CACHE_DIR
+except (ImportError, ModuleNotFoundError):
+    from api.tools.cache_functions import CACHE_DIR
+
+COVER_INDEX_PATH = os.environ.get("BOOKWORM_COVER_INDEX_PATH", os.path.join(CACHE_DIR, "cover_index.bin"))
+
+# placeholder used for books without a cover - never worth indexing
+PLACEHOLDER_COVER_URL = "https://iili.io/FpkDnzg.png"
+
+# each record is an ISBN plus a 64-bit perceptual hash and a 64-bit difference hash
+COVER_INDEX_DTYPE = np.dtype([("isbn", "S13"), ("hashes", "<u8", (2,))])
+
+# matches further than this many differing bits (out of 128) are not considered the same cover
+MAX_COVER_HASH_DISTANCE = 36
+
+# concurrent thumbnail downloads when building the index
+COVER_DOWNLOAD_WORKERS = 8
+
+_index_lock = threading.Lock()
+_index_records = np.empty(0, dtype=COVER_INDEX_DTYPE)
+_index_file_size = 0
+
+
+def compute_phash(gray):
+
+    """64-bit DCT perceptual hash - robust to scaling, compression and mild lighting changes."""
+
+    small = cv2.resize(gray, (32, 32), interpolation=cv2.INTER_AREA).astype(np.float32)
+    low_frequencies = cv2.dct(small)[:8, :8].flatten()
+
+    # the DC term only reflects overall brightness, so leave it out of the median
+    bits = low_frequencies > np.median(low_frequencies[1:])
+
+    return int(np.packbits(bits).view(">u8")[0])
+
+
+def compute_dhash(gray):
+
+    """64-bit difference hash - captures the direction of brightness gradients."""
+
+    small = cv2.resize(gray, (9, 8), interpolation=cv2.INTER_AREA)
+    bits = (small[:, 1:] > small[:, :-1]).flatten()
+
+    return int(np.packbits(bits).view(">u8")[0])
+
+
+def crop_cover(gray):
+
+    """Crop a photo to the book cover, straightening it if a cover-sized quadrilateral can be found."""
+
+    edges = cv2.Canny(cv2.GaussianBlur(gray, (5, 5), 0), 50, 150)
+    edges = cv2.dilate(edges, None, iterations=2)
+
+    contours, _ = cv2.findContours(edges, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    image_area = gray.shape[0] * gray.shape[1]
+
+    for contour in sorted(contours, key=lambda c: cv2.contourArea(cv2.convexHull(c)), reverse=True)[:1]:
+        if cv2.contourArea(cv2.convexHull(contour)) < 0.2 * image_area:
+            break
+
+        # text and artwork near the cover's edge break up its outline, so work from the convex hull
+        hull = cv2.convexHull(contour)
+        corners = cv2.approxPolyDP(hull, 0.02 * cv2.arcLength(hull, True), True)
+        if len(corners) != 4:
+            corners = cv2.boxPoints(cv2.minAreaRect(hull))
+
+        # order corners top-left, top-right, bottom-right, bottom-left
+        corners = corners.reshape(4, 2).astype(np.float32)
+        corner_sums = corners.sum(axis=1)
+        corner_diffs = np.diff(corners, axis=1).flatten()
+        ordered = np.array([corners[np.argmin(corner_sums)], corners[np.argmin(corner_diffs)],
+                            corners[np.argmax(corner_sums)], corners[np.argmax(corner_diffs)]])
+
+        width = int(max(np.linalg.norm(ordered[0] - ordered[1]), np.linalg.norm(ordered[3] - ordered[2])))
+        height = int(max(np.linalg.norm(ordered[0] - ordered[3]), np.linalg.norm(ordered[1] - ordered[2])))
+        target = np.array([[0, 0], [width, 0], [width, height], [0, height]], dtype=np.float32)
+
+        return cv2.warpPerspective(gray, cv2.getPerspectiveTransform(ordered, target), (width, height))
+
+    return gray
+
+
+def compute_cover_hashes(image, crop: bool = True):
+
+    """Compute the (perceptual hash, difference hash) pair for a cover image given as encoded bytes or a grayscale array."""
+
+    if not isinstance(image, np.ndarray):
+        image_buffer = np.frombuffer(image, np.uint8)
+        image = cv2.imdecode(image_buffer, cv2.IMREAD_REDUCED_GRAYSCALE_2) if image_buffer.size else None
+        if image is None:
+            return None
+
+    gray = crop_cover(image) if crop else image
+
+    return compute_phash(gray), compute_dhash(gray)
+
+
+def load_cover_index():
+
+    """Get the cover index records, re-reading the index file only if it has grown since it was last read."""
+
+    global _index_records, _index_file_size
+
+    try:
+        file_size = os.path.getsize(COVER_INDEX_PATH)
+    except OSError:
+        return _index_records
+
+    with _index_lock:
+        if file_size != _index_file_size:
+            records = np.fromfile(COVER_INDEX_PATH, dtype=COVER_INDEX_DTYPE, count=file_size // COVER_INDEX_DTYPE.itemsize)
+
+            # later records for an ISBN replace earlier ones
+            _, last_positions = np.unique(records["isbn"][::-1], return_index=True)
+            _index_records = records[len(records) - 1 - np.sort(last_positions)]
+            _index_file_size = file_size
+
+    return _index_records
+
+
+def add_covers_to_index(cover_hashes: dict):
+
+    """Append {isbn: (phash, dhash)} entries to the cover index file."""
+
+    if not cover_hashes:
+        return
+
+    records = np.array([(isbn.encode("ascii"), hashes) for isbn, hashes in cover_hashes.items()], dtype=COVER_INDEX_DTYPE)
+
+    os.makedirs(os.path.dirname(COVER_INDEX_PATH), exist_ok=True)
+
+    # records are fixed size, so appending keeps additions O(1) and readers can drop any partly written tail
+    with _index_lock, open(COVER_INDEX_PATH, "ab") as f:
+        f.write(records.tobytes())
+
+
+def download_cover_hashes(cover_url: str):
+
+    """Download a cover thumbnail and compute its hashes, or None if it cannot be fetched."""
+
+    if not cover_url or cover_url == PLACEHOLDER_COVER_URL:
+        return None
+
+    try:
+        with urllib.request.urlopen(cover_url, timeout=10) as f:
+            cover_bytes = f.read()
+    except (OSError, ValueError):
+        return None
+
+    # thumbnails are already tightly cropped to the cover
+    image = cv2.imdecode(np.frombuffer(cover_bytes, np.uint8), cv2.IMREAD_GRAYSCALE)
+    if image is None:
+        return None
+
+    return compute_cover_hashes(image, crop=False)
+
+
+def add_book_covers_to_index(book_covers: dict):
+
+    """Download and index {isbn: cover_url} thumbnails."""
+
+    with ThreadPoolExecutor(max_workers=COVER_DOWNLOAD_WORKERS) as executor:
+        hashes = dict(zip(book_covers, executor.map(download_cover_hashes, book_covers.values())))
+
+    add_covers_to_index({isbn: cover_hashes for isbn, cover_hashes in hashes.items() if cover_hashes is not None})
+
+
+def add_book_covers_to_index_in_background(book_covers: dict):
+
+    """Index newly enriched books' covers without holding up the request that added them."""
+
+    threading.Thread(target=add_book_covers_to_index, args=(book_covers,), daemon=True).start()
+
+
+def find_matching_covers(cover_hashes, top_k: int = 3, max_distance: int = MAX_COVER_HASH_DISTANCE):
+
+    """Find the indexed books whose covers are nearest to the given hashes, as [{"isbn", "distance"}] closest first."""
+
+    records = load_cover_index()
+    if not len(records):
+        return []
+
+    # Hamming distance to every indexed cover at once - a few milliseconds even for 100k books
+    differing = np.bitwise_xor(records["hashes"], np.array(cover_hashes, dtype="<u8"))
+    distances = np.unpackbits(differing.view(np.uint8), axis=1).sum(axis=1)
+
+    nearest = np.argsort(distances)[:top_k]
+
+    return [{"isbn": records["isbn"][i].decode("ascii"), "distance": int(distances[i])}
+            for i in nearest if distances[i] <= max_distance]
+
+
+def build_cover_index(authenticated_supabase_client):
+
+    """Index the cover thumbnails of every book not yet in the cover index."""
+
+    indexed_isbns = {isbn.decode("ascii") for isbn in load_cover_index()["isbn"]}
+    books = authenticated_supabase_client.table("books").select("isbn, cover_url_thumbnail").execute().data
+
+    add_book_covers_to_index({book['isbn']: book['cover_url_thumbnail'] for book in books
+                              if book['isbn'] and book['isbn'] not in indexed_isbns})
+
+
+if __name__ == "__main__":
+
+    from supabase import create_client
+    from dotenv import load_dotenv
+
+    load_dotenv()
+
+    # build or extend the index from the books table
+    supabase_client = create_client(os.environ.get("SUPABASE_URL"), os.environ.get("SUPABASE_SERVICE_KEY"))
+    build_cover_index(supabase_client)
+
+    print(f"Cover index holds {len(load_cover_index())} books.")
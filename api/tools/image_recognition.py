@@ -1,47 +1,436 @@
 # write a function to handle image upload and recognition
 # should extract ISBN from the image and return book details
 
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
 import cv2
-from pyzbar.pyzbar import decode
-import matplotlib.pyplot as plt
+import numpy as np
+import pytesseract
+from isbnlib import is_isbn13, is_isbn10, to_isbn13
+from pyzbar.pyzbar import decode, ZBarSymbol
+
+try:
+    from tools.ocr_functions import ocr_image
+except (ImportError, ModuleNotFoundError):
+    from api.tools.ocr_functions import ocr_image
+
+try:
+    from tools.process_pool import map_in_process_pool, is_worker_process
+    from tools.upload_functions import read_image_source
+except (ImportError, ModuleNotFoundError):
+    from api.tools.process_pool import map_in_process_pool, is_worker_process
+    from api.tools.upload_functions import read_image_source
+
+# ISBNs are printed as EAN-13 barcodes - skipping other symbologies speeds up scanning
+ISBN_SYMBOLS = [ZBarSymbol.EAN13]
+
+# reduced-resolution decodes tried, cheapest first, before the full-resolution image
+REDUCED_READ_MODES = [(cv2.IMREAD_REDUCED_GRAYSCALE_4, 4), (cv2.IMREAD_REDUCED_GRAYSCALE_2, 2)]
+
+# reduced images with a shorter side than this are too small to hold a readable barcode
+MIN_DECODE_SIDE = 320
+
+# preprocessing variants run on the largest decoded level no longer than this
+VARIANT_MAX_SIDE = 2000
+
+# printed ISBN crops are scaled to at least this width before OCR
+ISBN_OCR_MIN_WIDTH = 1000
+
+# uniform block of text, restricted to the characters printed around an ISBN barcode
+ISBN_OCR_PSM = 6
+ISBN_OCR_CONFIG = "-c tessedit_char_whitelist=0123456789X-ISBN"
+
+# an ISBN in OCR'd text - digits (and a final X) with hyphens or spaces between groups, after an ISBN label or alone on its line
+ISBN_TOKEN = r"([0-9X][0-9X -]*[0-9X])"
+LABELLED_ISBN = re.compile(r"ISBN(?:-?1[03])?[:\s]*" + ISBN_TOKEN + r"(?![0-9X])")
+UNLABELLED_ISBN = re.compile(r"\s*" + ISBN_TOKEN + r"\s*")
+
+# OpenCV and zbar release the GIL, so variants run in parallel across cores on plain threads.
+# Created per process - a forked pool worker inherits the parent's executor but none of its threads.
+# Pool workers run variants serially instead, as the pool already uses every core.
+_variant_executor = None
+_variant_executor_pid = None
+_variant_executor_lock = threading.Lock()
+
+
+def get_variant_executor():
+
+    """Get this process's preprocessing variant thread pool, creating it on first use (or first use after a fork)."""
+
+    global _variant_executor, _variant_executor_pid
+
+    if _variant_executor_pid != os.getpid():
+        with _variant_executor_lock:
+            if _variant_executor_pid != os.getpid():
+                _variant_executor = ThreadPoolExecutor(max_workers=os.cpu_count() or 1, thread_name_prefix="barcode_variant")
+                _variant_executor_pid = os.getpid()
+
+    return _variant_executor
+
+
+def iter_grayscale_levels(image):
+
+    """Yield (grayscale image, scale factor) pairs for an image, from reduced to full resolution.
+
+    image can be the encoded upload bytes (decoded at reduced size directly, which is much
+    cheaper than decoding the full photo) or an already decoded BGR/grayscale array.
+    """
+
+    if isinstance(image, np.ndarray):
+        gray = image if image.ndim == 2 else cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+
+        for _, scale in REDUCED_READ_MODES:
+            if min(gray.shape[:2]) // scale >= MIN_DECODE_SIDE:
+                yield cv2.resize(gray, None, fx=1 / scale, fy=1 / scale, interpolation=cv2.INTER_AREA), scale
+
+        yield gray, 1
+        return
+
+    image_buffer = np.frombuffer(image, np.uint8)
+    if not image_buffer.size:
+        return
+
+    for read_mode, scale in REDUCED_READ_MODES:
+        gray = cv2.imdecode(image_buffer, read_mode)
+
+        # not a decodable image
+        if gray is None:
+            return
+
+        if min(gray.shape[:2]) >= MIN_DECODE_SIDE:
+            yield gray, scale
+
+    gray = cv2.imdecode(image_buffer, cv2.IMREAD_GRAYSCALE)
+    if gray is not None:
+        yield gray, 1
+
+
+def decode_isbn_barcodes(gray):
+
+    """Decode the EAN-13 barcodes in a grayscale image, keeping only checksum-valid ISBNs."""
+
+    return [barcode for barcode in decode(gray, symbols=ISBN_SYMBOLS)
+            if is_isbn13(barcode.data.decode("utf-8"))]
+
+
+def rotate_image(gray, angle: float):
+
+    """Rotate an image about its centre, expanding the canvas so no corners are cut off."""
+
+    (h, w) = gray.shape[:2]
+    rotation = cv2.getRotationMatrix2D((w / 2, h / 2), angle, 1.0)
+
+    cos, sin = abs(rotation[0, 0]), abs(rotation[0, 1])
+    new_w, new_h = int(h * sin + w * cos), int(h * cos + w * sin)
+    rotation[0, 2] += new_w / 2 - w / 2
+    rotation[1, 2] += new_h / 2 - h / 2
+
+    return cv2.warpAffine(gray, rotation, (new_w, new_h), borderValue=255)
+
+
+def adaptive_threshold(gray):
+
+    """Binarise with a local threshold - helps with uneven lighting and glare."""
+
+    return cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, 31, 10)
+
+
+def sharpen(gray):
+
+    """Unsharp mask - helps with slightly blurry photos."""
+
+    return cv2.addWeighted(gray, 1.8, cv2.GaussianBlur(gray, (0, 0), 3), -0.8, 0)
+
+
+def equalise_contrast(gray):
+
+    """CLAHE local contrast equalisation - helps with washed out or dark photos."""
+
+    return cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8)).apply(gray)
+
+
+def otsu_threshold(gray):
+
+    """Blur then binarise with a global Otsu threshold - helps with noisy photos."""
+
+    return cv2.threshold(cv2.GaussianBlur(gray, (5, 5), 0), 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)[1]
+
+
+# zbar scans both horizontally and vertically, so only diagonal rotations are worth trying
+BARCODE_PREPROCESSING_VARIANTS = [
+    adaptive_threshold,
+    sharpen,
+    equalise_contrast,
+    otsu_threshold,
+    lambda gray: rotate_image(gray, 45),
+    lambda gray: rotate_image(gray, -45),
+    lambda gray: rotate_image(gray, 20),
+    lambda gray: rotate_image(gray, -20),
+]
+
+
+def decode_preprocessing_variant(gray, variant, found_event):
+
+    """Decode ISBNs from one preprocessing variant of an image, unless another variant already succeeded."""
+
+    if found_event.is_set():
+        return []
+
+    return decode_isbn_barcodes(variant(gray))
+
+
+def decode_preprocessing_variants(gray):
+
+    """Decode ISBN barcodes from preprocessing variants of an image concurrently, stopping at the first success.
+
+    In a process pool worker (e.g. a batch upload) the variants are tried one at a time instead,
+    so a batch runs one decoding thread per core rather than a thread pool per core.
+    """
+
+    if is_worker_process():
+        for variant in BARCODE_PREPROCESSING_VARIANTS:
+            barcodes = decode_isbn_barcodes(variant(gray))
+            if barcodes:
+                return barcodes
+        return []
+
+    found_event = threading.Event()
+    futures = [get_variant_executor().submit(decode_preprocessing_variant, gray, variant, found_event)
+               for variant in BARCODE_PREPROCESSING_VARIANTS]
+
+    try:
+        for future in as_completed(futures):
+            barcodes = future.result()
+            if barcodes:
+                return barcodes
+    finally:
+        # variants not yet started are dropped, running ones skip decoding once they see the event
+        found_event.set()
+        for future in futures:
+            future.cancel()
+
+    return []
+
+
+def get_variant_base_level(levels: list):
+
+    """Pick the decoded level preprocessing variants should run on - the largest no longer than VARIANT_MAX_SIDE."""
+
+    base_level = levels[0]
+
+    for gray, scale in levels:
+        if max(gray.shape[:2]) <= VARIANT_MAX_SIDE:
+            base_level = (gray, scale)
+
+    return base_level
+
+
+def find_barcode_regions_by_gradient(gray):
+
+    """Find the bounding box of the most barcode-like region - strong horizontal gradients packed into a block."""
+
+    grad_x = cv2.Sobel(gray, cv2.CV_32F, 1, 0, ksize=-1)
+    grad_y = cv2.Sobel(gray, cv2.CV_32F, 0, 1, ksize=-1)
+    gradient = cv2.convertScaleAbs(cv2.subtract(np.abs(grad_x), np.abs(grad_y)))
+
+    blurred = cv2.blur(gradient, (9, 9))
+    _, thresh = cv2.threshold(blurred, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+
+    # close the gaps between bars, then drop small specks
+    kernel_size = max(gray.shape[1] // 50, 3)
+    closed = cv2.morphologyEx(thresh, cv2.MORPH_CLOSE, cv2.getStructuringElement(cv2.MORPH_RECT, (kernel_size, max(kernel_size // 3, 1))))
+    closed = cv2.dilate(cv2.erode(closed, None, iterations=4), None, iterations=4)
+
+    contours, _ = cv2.findContours(closed, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    if not contours:
+        return []
+
+    return [cv2.boundingRect(max(contours, key=cv2.contourArea))]
+
+
+def find_barcode_regions(gray):
+
+    """Find bounding boxes (x, y, w, h) of likely barcodes, even ones too damaged to decode."""
+
+    found, points = cv2.barcode.BarcodeDetector().detect(gray)
+
+    if found and points is not None:
+        return [cv2.boundingRect(quad.astype(np.int32)) for quad in points]
+
+    return find_barcode_regions_by_gradient(gray)
+
+
+def get_isbn_text_crop(gray, region):
+
+    """Crop a barcode region widened to take in the ISBN printed above it and the digits below it."""
+
+    (x, y, w, h) = region
+    image_h, image_w = gray.shape[:2]
+
+    left, right = max(x - int(w * 0.15), 0), min(x + w + int(w * 0.15), image_w)
+    top, bottom = max(y - int(h * 0.6), 0), min(y + h + int(h * 0.35), image_h)
+    crop = gray[top:bottom, left:right]
+
+    # tesseract reads digits best at around 30px high
+    if 0 < crop.shape[1] < ISBN_OCR_MIN_WIDTH:
+        scale = ISBN_OCR_MIN_WIDTH / crop.shape[1]
+        crop = cv2.resize(crop, None, fx=scale, fy=scale, interpolation=cv2.INTER_CUBIC)
+
+    return crop
+
+
+def find_isbns_in_text(text: str):
+
+    """Find ISBNs in OCR'd text, as ISBN-13s. ISBN-10s are only used if no ISBN-13 is found.
+
+    Only whole tokens of exactly 10 or 13 characters are considered - a random run of digits passes the
+    ISBN-10 checksum about 1 time in 11, so windows are never slid across longer runs. A token that fails
+    its checksum means a misread digit, and then nothing is returned rather than a guess.
+    """
+
+    isbn13s = []
+    isbn10s = []
+
+    for line in text.upper().splitlines():
+        match = LABELLED_ISBN.search(line) or UNLABELLED_ISBN.fullmatch(line)
+        if match is None:
+            continue
+
+        characters = re.sub(r"[ -]", "", match.group(1))
+
+        if len(characters) == 13:
+            if not is_isbn13(characters):
+                return []
+            isbn13s.append(characters)
+        elif len(characters) == 10:
+            if not is_isbn10(characters):
+                return []
+            isbn10s.append(to_isbn13(characters))
+
+    return list(dict.fromkeys(isbn13s or isbn10s))
+
+
+def read_printed_isbn(gray):
+
+    """OCR the printed ISBN around a barcode that could not be decoded, returning any checksum-valid ISBNs.
+
+    Only a small crop around the barcode is OCR'd, so this costs milliseconds rather than a full-frame pass.
+    Returns no ISBNs if tesseract is not installed or fails, leaving the caller's no-barcode handling to respond.
+    """
+
+    for region in find_barcode_regions(gray):
+        crop = get_isbn_text_crop(gray, region)
+        if not crop.size:
+            continue
+
+        try:
+            text = ocr_image(crop, psm=ISBN_OCR_PSM, config=ISBN_OCR_CONFIG)
+        except (pytesseract.TesseractNotFoundError, pytesseract.TesseractError):
+            return []
+
+        isbns = find_isbns_in_text(text)
+        if isbns:
+            return isbns
+
+    return []
 
 
 def detect_and_decode_barcode(image):
 
-    """Detect and decode barcodes in the given image."""
+    """Detect and decode ISBN barcodes in the given image.
+
+    Reduced resolutions are tried first, escalating to full resolution only if needed.
+    If no level decodes, preprocessing variants (thresholding, sharpening, contrast
+    equalisation, rotations) are tried concurrently until one yields a valid ISBN.
+    As a last resort the ISBN printed around the barcode is OCR'd.
+    """
+
+    levels = []
+
+    for gray, scale in iter_grayscale_levels(image):
+
+        # Detect barcodes in the grayscale image
+        barcodes = decode_isbn_barcodes(gray)
+
+        if barcodes:
+            # keep the order barcodes were found in, dropping repeats
+            return list(dict.fromkeys(barcode.data.decode("utf-8") for barcode in barcodes))
+
+        levels.append((gray, scale))
+
+    # hard photos only - easy ones never pay for the variants
+    if levels:
+        variant_base, _ = get_variant_base_level(levels)
+        barcodes = decode_preprocessing_variants(variant_base)
+
+        if barcodes:
+            return list(dict.fromkeys(barcode.data.decode("utf-8") for barcode in barcodes))
+
+        # damaged barcodes usually still have a legible printed ISBN
+        return read_printed_isbn(variant_base)
+
+    return []
+
+
+def decode_frame_isbns(image):
+
+    """Decode ISBN barcodes in one frame of a scanning sequence.
+
+    Only the plain resolution levels are tried - in a burst of frames the next frame
+    is a cheaper retry than preprocessing variants or OCR on this one.
+    """
+
+    for gray, _ in iter_grayscale_levels(image):
+        barcodes = decode_isbn_barcodes(gray)
+
+        if barcodes:
+            return list(dict.fromkeys(barcode.data.decode("utf-8") for barcode in barcodes))
+
+    return []
+
+
+def detect_all_isbn_barcodes(image):
+
+    """Detect every distinct ISBN barcode in an image (e.g. a shelf of books), with bounding boxes.
+
+    All resolutions are searched, since small barcodes on a shelf photo may only be readable
+    at full resolution. Bounding boxes are in full-resolution pixel coordinates.
+    """
+
+    detected_barcodes = {}
+
+    for gray, scale in iter_grayscale_levels(image):
+        for barcode in decode_isbn_barcodes(gray):
+            isbn = barcode.data.decode("utf-8")
 
-    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+            if isbn not in detected_barcodes:
+                (x, y, w, h) = barcode.rect
+                detected_barcodes[isbn] = {
+                    "isbn": isbn,
+                    "rect": {"left": x * scale, "top": y * scale, "width": w * scale, "height": h * scale}
+                }
 
-    # Detect barcodes in the grayscale image
-    barcodes = decode(gray)
+    return list(detected_barcodes.values())
 
-    # Loop over detected barcodes
-    detected_barcodes = []
-    for barcode in barcodes:
 
-        # Extract barcode data and type
-        barcode_data = barcode.data.decode("utf-8")
-        # barcode_type = barcode.type
+def decode_batch_image(source):
 
-        # Print barcode data and type
-        # print("Barcode Data:", barcode_data)
-        # print("Barcode Type:", barcode_type)
+    """Decode the ISBNs in one image of a batch upload, returning (isbns, error message).
 
-        detected_barcodes.append(barcode_data)
+    Errors are returned rather than raised so one bad image cannot fail the rest of the batch.
+    """
 
-        # Draw a rectangle around the barcode
-        # (x, y, w, h) = barcode.rect
-        # cv2.rectangle(image, (x, y), (x + w, y + h), (255, 0, 0), 2)
+    try:
+        return detect_and_decode_barcode(read_image_source(source)), None
+    except Exception as e:
+        return [], str(e)
 
-        # Put barcode data and type on the image
-        # cv2.putText(image, f"{barcode_data} ({barcode_type})",
-        #             (x, y - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 0, 0), 2)
 
-    # Convert image from BGR to RGB (Matplotlib uses RGB)
-    # image_rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+def decode_image_batch(sources: list):
 
-    # plt.imshow(image_rgb)
-    # plt.axis('off')
-    # plt.show()
+    """Decode the ISBNs in a batch of images across the shared process pool, returning (isbns, error) per image in order."""
 
-    return detected_barcodes
+    return list(map_in_process_pool(decode_batch_image, sources))
@@ -0,0 +1,78 @@
+import os
+import shutil
+import tempfile
+
+import pytesseract
+
+# resolve the tesseract binary from the environment rather than a hardcoded install location
+TESSERACT_CMD = os.environ.get("TESSERACT_CMD") or shutil.which("tesseract") or "tesseract"
+
+pytesseract.pytesseract.tesseract_cmd = TESSERACT_CMD
+
+# resolution pages are rendered at for OCR
+OCR_DPI = int(os.environ.get("BOOKWORM_OCR_DPI", 300))
+
+# tesseract page segmentation mode - 3 is fully automatic page layout analysis
+OCR_PSM = int(os.environ.get("BOOKWORM_OCR_PSM", 3))
+
+# number of page images passed to each tesseract process
+OCR_BATCH_SIZE = int(os.environ.get("BOOKWORM_OCR_BATCH_SIZE", 8))
+
+
+def get_ocr_settings_key(dpi: int = OCR_DPI, psm: int = OCR_PSM):
+
+    """Get a key describing the settings that affect OCR output."""
+
+    return f"d{dpi}-p{psm}"
+
+
+def ocr_images(images: list, dpi: int = OCR_DPI, psm: int = OCR_PSM):
+
+    """OCR a batch of PIL images with a single tesseract process, returning one string per image.
+
+    The images are written as one multi-page TIFF, so the batch costs one process
+    start and one temp file instead of one of each per image.
+    """
+
+    if not images:
+        return []
+
+    with tempfile.TemporaryDirectory(prefix="bookworm_ocr_") as temp_dir:
+        batch_filename = os.path.join(temp_dir, "batch.tiff")
+        images[0].save(batch_filename, format="TIFF", save_all=True, append_images=images[1:], dpi=(dpi, dpi))
+
+        batch_text = pytesseract.image_to_string(batch_filename, config=f"--psm {psm} --dpi {dpi}")
+
+    # tesseract ends the text of every page with a form feed
+    page_texts = batch_text.split("\f")[:len(images)]
+    page_texts += [""] * (len(images) - len(page_texts))
+
+    return page_texts
+
+
+def ocr_rendered_pages(render_page, page_numbers: list, dpi: int = OCR_DPI, psm: int = OCR_PSM,
+                       batch_size: int = OCR_BATCH_SIZE):
+
+    """Render and OCR pages in batches, returning a dict of page number to text.
+
+    render_page(page_number, dpi) should return a PIL image of the page.
+    """
+
+    page_texts = {}
+
+    for i in range(0, len(page_numbers), batch_size):
+        batch_page_numbers = page_numbers[i:i + batch_size]
+
+        # greyscale is all tesseract needs and keeps a batch of 300 DPI pages small
+        images = [render_page(page_number, dpi).convert("L") for page_number in batch_page_numbers]
+
+        page_texts.update(zip(batch_page_numbers, ocr_images(images, dpi, psm)))
+
+    return page_texts
+
+
+def ocr_image(image, psm: int = OCR_PSM, config: str = ""):
+
+    """OCR a single image (PIL image or numpy array) with optional extra tesseract config."""
+
+    return pytesseract.image_to_string(image, config=f"--psm {psm} {config}".strip())
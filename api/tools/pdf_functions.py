@@ -0,0 +1,420 @@
+import io
+import os
+import re
+import json
+import tempfile
+
+import pdfplumber
+
+try:
+    from tools.process_pool import map_in_process_pool
+except (ImportError, ModuleNotFoundError):
+    from api.tools.process_pool import map_in_process_pool
+
+try:
+    from tools.cache_functions import DiskLRUCache, get_content_hash
+except (ImportError, ModuleNotFoundError):
+    from api.tools.cache_functions import DiskLRUCache, get_content_hash
+
+try:
+    from tools.ocr_functions import OCR_DPI, ocr_rendered_pages, get_ocr_settings_key
+except (ImportError, ModuleNotFoundError):
+    from api.tools.ocr_functions import OCR_DPI, ocr_rendered_pages, get_ocr_settings_key
+
+try:
+    from tools.supabase_functions import upload_file_by_content_hash, add_book_file_record, upload_extracted_pages, download_extracted_pages
+except (ImportError, ModuleNotFoundError):
+    from api.tools.supabase_functions import upload_file_by_content_hash, add_book_file_record, upload_extracted_pages, download_extracted_pages
+
+# number of pages handed to each worker process
+PAGES_PER_TASK = 16
+
+# resolution used when rendering a page for OCR
+OCR_RESOLUTION = OCR_DPI
+
+# pages with less extracted text than this are checked for scanned images
+MIN_PAGE_TEXT_CHARS = 20
+
+# share of the page area covered by images before a short page is treated as scanned
+MIN_SCANNED_IMAGE_COVERAGE = 0.5
+
+# share of letters, digits and whitespace expected in usable extracted text
+MIN_TEXT_QUALITY_RATIO = 0.6
+
+# bump when extraction logic changes so stale cached text is not served
+EXTRACTION_VERSION = 2
+
+# text built up beyond this size is spilled to a temp file
+TEXT_BUILDER_MAX_SIZE = int(os.environ.get("BOOKWORM_TEXT_BUILDER_MAX_SIZE", 4 * 1024 * 1024))
+
+PDF_TEXT_CACHE_MAX_BYTES = int(os.environ.get("BOOKWORM_PDF_TEXT_CACHE_MAX_BYTES", 512 * 1024 * 1024))
+
+_pdf_text_cache = None
+
+
+def get_pdf_text_cache():
+
+    """Get the on-disk cache of extracted page text, creating it on first use."""
+
+    global _pdf_text_cache
+
+    if _pdf_text_cache is None:
+        _pdf_text_cache = DiskLRUCache("pdf_text", PDF_TEXT_CACHE_MAX_BYTES)
+
+    return _pdf_text_cache
+
+
+def get_extraction_settings_key(ocr_resolution: int):
+
+    """Get a key describing the settings that affect extracted text."""
+
+    return f"v{EXTRACTION_VERSION}-{get_ocr_settings_key(ocr_resolution)}-c{MIN_PAGE_TEXT_CHARS}-i{MIN_SCANNED_IMAGE_COVERAGE}-q{MIN_TEXT_QUALITY_RATIO}"
+
+
+def open_pdf(pdf_source):
+
+    """Open a PDF from a file path or its bytes."""
+
+    if isinstance(pdf_source, (bytes, bytearray)):
+        pdf_source = io.BytesIO(pdf_source)
+
+    return pdfplumber.open(pdf_source)
+
+
+def is_low_quality_text(page_text: str):
+
+    """Check whether text extracted from a PDF page is garbled or unreadable."""
+
+    if not page_text or not page_text.strip():
+        return True
+
+    # glyphs without a unicode mapping are extracted as (cid:NN)
+    if "(cid:" in page_text:
+        return True
+
+    readable_chars = sum(1 for char in page_text if char.isalnum() or char.isspace())
+
+    return readable_chars / len(page_text) < MIN_TEXT_QUALITY_RATIO
+
+
+def clean_page_text(page_text: str):
+
+    """Collapse runs of spaces left by text extraction."""
+
+    return re.sub(r" {2,}", " ", page_text)
+
+
+def get_image_coverage(page):
+
+    """Get the share of the page area covered by embedded images."""
+
+    page_area = float(page.width * page.height)
+    if not page_area:
+        return 0.0
+
+    image_area = sum(abs((image['x1'] - image['x0']) * (image['bottom'] - image['top'])) for image in page.images)
+
+    return min(image_area / page_area, 1.0)
+
+
+def page_needs_ocr(page, page_text: str):
+
+    """Decide whether a page should be OCR'd rather than use its extracted text."""
+
+    if is_low_quality_text(page_text):
+        return True
+
+    # short text on an image-heavy page is usually a caption on a scanned plate
+    if len(page_text.strip()) < MIN_PAGE_TEXT_CHARS:
+        return get_image_coverage(page) >= MIN_SCANNED_IMAGE_COVERAGE
+
+    return False
+
+
+def extract_page_range(pdf_source, first_page: int, last_page: int, ocr_resolution: int = OCR_RESOLUTION):
+
+    """Extract text from pages [first_page, last_page) of a PDF, OCR'ing only the pages that need it.
+
+    Pages needing OCR are rendered and OCR'd in batches once the range's text has been extracted.
+    """
+
+    page_results = []
+    ocr_page_numbers = []
+
+    with open_pdf(pdf_source) as pdf:
+        for page_number in range(first_page, last_page):
+            page = pdf.pages[page_number]
+            page_text = page.extract_text() or ""
+
+            if page_needs_ocr(page, page_text):
+                ocr_page_numbers.append(page_number)
+                page_results.append({"page": page_number + 1, "text": "", "ocr": True})
+            else:
+                page_results.append({"page": page_number + 1, "text": clean_page_text(page_text), "ocr": False})
+
+            # release cached layout objects - long books otherwise hold every page in memory
+            page.close()
+
+        def render_page(page_number, dpi):
+            page = pdf.pages[page_number]
+            page_image = page.to_image(resolution=dpi).original
+            page.close()
+            return page_image
+
+        for page_number, page_text in ocr_rendered_pages(render_page, ocr_page_numbers, ocr_resolution).items():
+            page_results[page_number - first_page]['text'] = clean_page_text(page_text)
+
+    return page_results
+
+
+def get_page_ranges(page_numbers: list, pages_per_task: int = PAGES_PER_TASK):
+
+    """Group sorted page numbers into consecutive [first_page, last_page) ranges of at most pages_per_task pages."""
+
+    page_ranges = []
+
+    for page_number in page_numbers:
+        if page_ranges and page_ranges[-1][1] == page_number and page_number - page_ranges[-1][0] < pages_per_task:
+            page_ranges[-1][1] = page_number + 1
+        else:
+            page_ranges.append([page_number, page_number + 1])
+
+    return [tuple(page_range) for page_range in page_ranges]
+
+
+def iter_page_ranges(pdf_source, page_ranges: list, ocr_resolution: int):
+
+    """Extract the given page ranges across the process pool, yielding pages in order as each range completes."""
+
+    # a single range is not worth the cost of shipping to a worker process
+    if len(page_ranges) == 1:
+        yield from extract_page_range(pdf_source, page_ranges[0][0], page_ranges[0][1], ocr_resolution)
+        return
+
+    first_pages, last_pages = zip(*page_ranges)
+
+    # an in-memory upload is written to a temp file once, so each range task is sent its path rather than a copy of the PDF
+    spooled_path = None
+    if isinstance(pdf_source, (bytes, bytearray)):
+        with tempfile.NamedTemporaryFile("wb", suffix=".pdf", delete=False) as spooled_file:
+            spooled_file.write(pdf_source)
+        spooled_path = pdf_source = spooled_file.name
+
+    try:
+        for range_results in map_in_process_pool(extract_page_range,
+                                                 [pdf_source] * len(page_ranges),
+                                                 first_pages,
+                                                 last_pages,
+                                                 [ocr_resolution] * len(page_ranges)):
+            yield from range_results
+    finally:
+        if spooled_path is not None:
+            try:
+                os.remove(spooled_path)
+            except OSError:
+                pass
+
+
+def iter_pdf_pages(pdf_source, ocr_resolution: int = OCR_RESOLUTION, content_hash: str = None):
+
+    """Yield {"page", "text", "ocr"} dicts for every page of a PDF in order, as soon as each is available.
+
+    Pages are cached on disk by file hash and extraction settings, so only pages
+    not seen before are extracted, spread across the process pool by page range.
+    Cached pages are read PAGES_PER_TASK at a time, so memory does not grow with the book's length.
+    """
+
+    if content_hash is None:
+        content_hash = get_content_hash(pdf_source)
+
+    pdf_text_cache = get_pdf_text_cache()
+    cache_prefix = f"{content_hash}:{get_extraction_settings_key(ocr_resolution)}"
+
+    page_count = pdf_text_cache.get(f"{cache_prefix}:page_count")
+
+    if page_count is None:
+        with open_pdf(pdf_source) as pdf:
+            page_count = len(pdf.pages)
+
+    page_count = int(page_count)
+    page_keys = [f"{cache_prefix}:page:{page_number}" for page_number in range(page_count)]
+    cached_keys = pdf_text_cache.get_cached_keys(page_keys)
+
+    missing_pages = [page_number for page_number, page_key in enumerate(page_keys) if page_key not in cached_keys]
+    extracted_pages = iter_page_ranges(pdf_source, get_page_ranges(missing_pages), ocr_resolution) if missing_pages else iter(())
+
+    new_entries = {}
+    cached_pages = {}
+
+    for page_number, page_key in enumerate(page_keys):
+        if page_key in cached_keys:
+            if page_key not in cached_pages:
+                cached_pages = pdf_text_cache.get_many([key for key in page_keys[page_number:page_number + PAGES_PER_TASK]
+                                                        if key in cached_keys])
+
+            if page_key in cached_pages:
+                yield json.loads(cached_pages.pop(page_key))
+                continue
+
+            # evicted since the cache was checked - extract it again here
+            page_result = extract_page_range(pdf_source, page_number, page_number + 1, ocr_resolution)[0]
+        else:
+            page_result = next(extracted_pages)
+
+        new_entries[page_key] = json.dumps(page_result)
+
+        # write newly extracted pages back in batches rather than one transaction per page
+        if len(new_entries) >= PAGES_PER_TASK:
+            pdf_text_cache.set_many(new_entries)
+            new_entries = {}
+
+        yield page_result
+
+    new_entries[f"{cache_prefix}:page_count"] = str(page_count)
+    pdf_text_cache.set_many(new_entries)
+
+
+def extract_pdf_text(pdf_source, ocr_resolution: int = OCR_RESOLUTION, content_hash: str = None):
+
+    """Extract text from every page of a PDF as a list of {"page", "text", "ocr"} dicts in page order."""
+
+    return list(iter_pdf_pages(pdf_source, ocr_resolution, content_hash))
+
+
+class SpooledTextBuilder:
+
+    """Builds up text in memory, spilling to a temp file once it grows past max_size."""
+
+    def __init__(self, max_size: int = TEXT_BUILDER_MAX_SIZE):
+
+        self.max_size = max_size
+        self.size = 0
+        self._buffer = io.BytesIO()
+
+    def write(self, text: str):
+
+        """Append text to the builder."""
+
+        data = text.encode("utf-8")
+
+        if isinstance(self._buffer, io.BytesIO) and self.size + len(data) > self.max_size:
+            # not deleted on close, so storage uploads can reopen it by path on Windows - close() removes it
+            spill_file = tempfile.NamedTemporaryFile("w+b", delete=False)
+            spill_file.write(self._buffer.getbuffer())
+            self._buffer = spill_file
+
+        self._buffer.write(data)
+        self.size += len(data)
+
+    def getvalue(self):
+
+        """Get all the text written so far."""
+
+        if isinstance(self._buffer, io.BytesIO):
+            return self._buffer.getvalue().decode("utf-8")
+
+        self._buffer.flush()
+        self._buffer.seek(0)
+        text = self._buffer.read().decode("utf-8")
+        self._buffer.seek(0, io.SEEK_END)
+
+        return text
+
+    def get_upload_source(self):
+
+        """Get the built text for a storage upload - its temp file path if spilled, otherwise its bytes."""
+
+        if isinstance(self._buffer, io.BytesIO):
+            return self._buffer.getvalue()
+
+        self._buffer.flush()
+
+        return self._buffer.name
+
+    def close(self):
+
+        """Release the buffer, deleting any temp file."""
+
+        self._buffer.close()
+
+        if not isinstance(self._buffer, io.BytesIO):
+            try:
+                os.remove(self._buffer.name)
+            except OSError:
+                pass
+
+
+def iter_book_pdf_pages(authenticated_supabase_client, book_id: int, pdf_source):
+
+    """Store a book's PDF (a file path or its bytes) by content hash, yield its extracted pages and link it to the book.
+
+    If an identical PDF is already in storage, both the upload and the extraction are skipped - unless
+    it was extracted with different settings. The book is only linked to the PDF once every page has
+    been extracted and stored, so an interrupted upload leaves no link to a file without text.
+    """
+
+    content_hash = get_content_hash(pdf_source)
+    settings_key = get_extraction_settings_key(OCR_RESOLUTION)
+    storage_path, file_exists = upload_file_by_content_hash(authenticated_supabase_client, pdf_source, ".pdf",
+                                                            content_hash=content_hash, content_type="application/pdf")
+
+    file_url = authenticated_supabase_client.storage.from_("uploads").get_public_url(storage_path)
+
+    if file_exists:
+        stored_pages = download_extracted_pages(authenticated_supabase_client, content_hash, settings_key)
+        if stored_pages is not None:
+            yield from stored_pages
+            add_book_file_record(authenticated_supabase_client, book_id, file_url)
+            return
+
+    # pages are kept as NDJSON so the stored copy can be written without holding the whole book in memory
+    pages_builder = SpooledTextBuilder()
+
+    try:
+        for page_result in iter_pdf_pages(pdf_source, content_hash=content_hash):
+            pages_builder.write(json.dumps(page_result) + "\n")
+            yield page_result
+
+        upload_extracted_pages(authenticated_supabase_client, content_hash, settings_key, pages_builder.get_upload_source())
+        add_book_file_record(authenticated_supabase_client, book_id, file_url)
+    finally:
+        pages_builder.close()
+
+
+def get_book_pdf_text(authenticated_supabase_client, book_id: int, pdf_source):
+
+    """Store a book's PDF and return all of its extracted text."""
+
+    text_builder = SpooledTextBuilder()
+
+    try:
+        for page_result in iter_book_pdf_pages(authenticated_supabase_client, book_id, pdf_source):
+            text_builder.write(page_result['text'] + "\n")
+
+        return text_builder.getvalue()
+    finally:
+        text_builder.close()
+
+
+def iter_page_events(page_results, stream_format: str):
+
+    """Format extracted pages as NDJSON lines or server-sent events, ending with a summary of the document."""
+
+    page_count = 0
+    ocr_page_count = 0
+
+    for page_result in page_results:
+        page_count += 1
+        ocr_page_count += page_result['ocr']
+
+        if stream_format == "sse":
+            yield f"event: page\ndata: {json.dumps(page_result)}\n\n"
+        else:
+            yield json.dumps(page_result) + "\n"
+
+    summary = {"done": True, "page_count": page_count, "ocr_page_count": ocr_page_count}
+
+    if stream_format == "sse":
+        yield f"event: done\ndata: {json.dumps(summary)}\n\n"
+    else:
+        yield json.dumps(summary) + "\n"
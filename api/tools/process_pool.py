@@ -0,0 +1,68 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+MAX_WORKERS = int(os.environ.get("BOOKWORM_MAX_WORKERS", os.cpu_count() or 1))
+
+_process_pool = None
+
+# set in the pool's worker processes, so work running there can avoid starting threads of its own
+_in_worker_process = False
+
+
+def init_worker_process():
+
+    """Limit each worker to a single OpenMP thread - the pool already spreads work across cores."""
+
+    global _in_worker_process
+
+    # stops every concurrent tesseract process from starting a thread per core
+    os.environ.setdefault("OMP_THREAD_LIMIT", "1")
+
+    _in_worker_process = True
+
+
+def is_worker_process():
+
+    """Check whether this is one of the shared pool's worker processes."""
+
+    return _in_worker_process
+
+
+def get_process_pool():
+
+    """Return the shared process pool, creating it on first use.
+
+    Returns None if worker processes cannot be started on this platform
+    (e.g. serverless runtimes without shared memory), so callers can run inline.
+    """
+
+    global _process_pool
+
+    if _process_pool is None and MAX_WORKERS > 1:
+        try:
+            _process_pool = ProcessPoolExecutor(max_workers=MAX_WORKERS, initializer=init_worker_process)
+        except (OSError, NotImplementedError, ImportError):
+            return None
+
+    return _process_pool
+
+
+def map_in_process_pool(func, *iterables):
+
+    """Map a function over the given iterables in the shared process pool, yielding results in order."""
+
+    global _process_pool
+
+    process_pool = get_process_pool()
+
+    if process_pool is None:
+        yield from map(func, *iterables)
+        return
+
+    try:
+        yield from process_pool.map(func, *iterables)
+    except BrokenProcessPool:
+        # a worker died - drop the pool so the next call starts a fresh one
+        _process_pool = None
+        raise
@@ -0,0 +1,174 @@
+import os
+import threading
+import time
+import uuid
+
+import cv2
+import numpy as np
+
+# an ISBN is confirmed once it has been decoded in this many consecutive frames
+SCAN_CONFIRM_FRAMES = int(os.environ.get("BOOKWORM_SCAN_CONFIRM_FRAMES", 3))
+
+# frames whose thumbnail differs from the last processed frame by less than this
+# mean grey level (out of 255) are treated as the same view and not decoded again
+SCAN_FRAME_DIFF_THRESHOLD = float(os.environ.get("BOOKWORM_SCAN_FRAME_DIFF_THRESHOLD", 4.0))
+
+# idle scanning sessions are dropped after this many seconds
+SCAN_SESSION_TTL = int(os.environ.get("BOOKWORM_SCAN_SESSION_TTL", 600))
+
+# frames are compared on a thumbnail this size - enough to notice the camera moving to another book
+FRAME_FINGERPRINT_SIZE = (32, 32)
+
+# sessions live in this process's memory, so every request for a session must reach the process that
+# started it - a single worker, or sticky routing. On serverless or multi-worker deployments, frames
+# sent to another instance get a 404 and the client has to start a new session.
+_sessions_lock = threading.Lock()
+_sessions = {}
+
+
+def get_frame_fingerprint(image):
+
+    """Get a small blurred grayscale thumbnail of a frame (encoded bytes or an array) for near-duplicate checks."""
+
+    if isinstance(image, np.ndarray):
+        gray = image if image.ndim == 2 else cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    else:
+        image_buffer = np.frombuffer(image, np.uint8)
+        gray = cv2.imdecode(image_buffer, cv2.IMREAD_REDUCED_GRAYSCALE_8) if image_buffer.size else None
+        if gray is None:
+            return None
+
+    # blurring stops sensor noise and compression artefacts registering as changes
+    thumbnail = cv2.resize(gray, FRAME_FINGERPRINT_SIZE, interpolation=cv2.INTER_AREA)
+
+    return cv2.GaussianBlur(thumbnail, (3, 3), 0)
+
+
+class ScanSession:
+
+    """Decoding state for one frame-sequence scanning session.
+
+    Tracks how many consecutive frames each ISBN has been decoded in, and which ISBNs
+    have already been confirmed, so every book is reported once per session. Only the
+    user who started a session (owner_id) can use it.
+    """
+
+    def __init__(self, owner_id: str, confirm_frames: int = SCAN_CONFIRM_FRAMES):
+
+        self.session_id = uuid.uuid4().hex
+        self.owner_id = owner_id
+        self.confirm_frames = confirm_frames
+        self.last_fingerprint = None
+        self.last_isbns = []
+        self.streaks = {}
+        self.confirmed = []
+        self.frame_count = 0
+        self.decoded_frame_count = 0
+        self.last_active = time.monotonic()
+        self.lock = threading.Lock()
+
+    def is_repeat_frame(self, fingerprint):
+
+        """Check whether a frame is near-identical to the last decoded one."""
+
+        if fingerprint is None or self.last_fingerprint is None:
+            return False
+
+        return float(cv2.absdiff(fingerprint, self.last_fingerprint).mean()) < SCAN_FRAME_DIFF_THRESHOLD
+
+    def add_frame(self, image, decode_frame):
+
+        """Process the next frame, returning (frame result, ISBNs newly confirmed by it).
+
+        decode_frame(image) should return the ISBNs decoded from the frame. Skipped frames
+        count as repeats of the last decoded frame, so a steady camera still confirms.
+        """
+
+        self.frame_count += 1
+        self.last_active = time.monotonic()
+
+        fingerprint = get_frame_fingerprint(image)
+
+        if self.is_repeat_frame(fingerprint):
+            isbns = self.last_isbns
+            frame_result = {"status": "skipped", "isbns": isbns}
+        else:
+            isbns = decode_frame(image) if fingerprint is not None else []
+            self.decoded_frame_count += 1
+            self.last_fingerprint = fingerprint
+            self.last_isbns = isbns
+            frame_result = {"status": "decoded" if fingerprint is not None else "unreadable", "isbns": isbns}
+
+        # a frame without an ISBN breaks its streak
+        self.streaks = {isbn: self.streaks.get(isbn, 0) + 1 for isbn in isbns}
+
+        newly_confirmed = [isbn for isbn, streak in self.streaks.items()
+                           if streak >= self.confirm_frames and isbn not in self.confirmed]
+        self.confirmed += newly_confirmed
+
+        return frame_result, newly_confirmed
+
+    def get_summary(self):
+
+        """Summarise the session for API responses."""
+
+        return {
+            "scan_session_id": self.session_id,
+            "frame_count": self.frame_count,
+            "decoded_frame_count": self.decoded_frame_count,
+            "confirmed_isbns": list(self.confirmed),
+            "confirm_frames": self.confirm_frames,
+        }
+
+
+def purge_expired_scan_sessions():
+
+    """Drop scanning sessions idle for longer than SCAN_SESSION_TTL."""
+
+    expiry = time.monotonic() - SCAN_SESSION_TTL
+
+    with _sessions_lock:
+        for session_id in [session_id for session_id, scan_session in _sessions.items() if scan_session.last_active < expiry]:
+            del _sessions[session_id]
+
+
+def create_scan_session(owner_id: str, confirm_frames: int = SCAN_CONFIRM_FRAMES):
+
+    """Start a new scanning session for a user."""
+
+    purge_expired_scan_sessions()
+
+    scan_session = ScanSession(owner_id, confirm_frames)
+
+    with _sessions_lock:
+        _sessions[scan_session.session_id] = scan_session
+
+    return scan_session
+
+
+def get_scan_session(session_id: str, owner_id: str):
+
+    """Get a user's active scanning session by ID, or None if it does not exist, has expired or is someone else's."""
+
+    purge_expired_scan_sessions()
+
+    with _sessions_lock:
+        scan_session = _sessions.get(session_id)
+
+    if scan_session is None or scan_session.owner_id != owner_id:
+        return None
+
+    return scan_session
+
+
+def end_scan_session(session_id: str, owner_id: str):
+
+    """End a user's scanning session, returning it, or None if it does not exist or is someone else's."""
+
+    with _sessions_lock:
+        scan_session = _sessions.get(session_id)
+
+        if scan_session is None or scan_session.owner_id != owner_id:
+            return None
+
+        return _sessions.pop(session_id)
@@ -1,18 +1,43 @@
 import os
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
 from flask import session
 from dotenv import load_dotenv
 from supabase import create_client, Client
+from storage3.utils import StorageException
+
+try:
+    from tools.book_functions import clean_isbn, get_enriched_book_record, get_cached_book_record, start_book_enrichment
+except (ImportError, ModuleNotFoundError):
+    from api.tools.book_functions import clean_isbn, get_enriched_book_record, get_cached_book_record, start_book_enrichment
+
+try:
+    from tools.cache_functions import get_content_hash
+except (ImportError, ModuleNotFoundError):
+    from api.tools.cache_functions import get_content_hash
 
 try:
-    from tools.book_functions import create_book_record_using_isbn, clean_isbn
+    from tools.cover_index import add_book_covers_to_index_in_background
 except (ImportError, ModuleNotFoundError):
-    from api.tools.book_functions import create_book_record_using_isbn, clean_isbn
+    from api.tools.cover_index import add_book_covers_to_index_in_background
 
 load_dotenv()
 
 SUPABASE_URL = os.environ.get("SUPABASE_URL")
 SUPABASE_KEY = os.environ.get("SUPABASE_KEY")
 
+# concurrent book metadata lookups when adding several books at once
+METADATA_LOOKUP_WORKERS = 8
+
+# text extracted from uploaded books is stored in this bucket - it must be a private bucket readable
+# and writable by signed-in users, as the uploads bucket is public and would expose every book's text
+EXTRACTED_PAGES_BUCKET = os.environ.get("BOOKWORM_EXTRACTED_PAGES_BUCKET", "extracted_pages")
+
+# seconds the signed URL used to stream stored extracted pages stays valid
+EXTRACTED_PAGES_URL_EXPIRY = 300
+
 
 def get_authenticated_client() -> Client:
 
@@ -59,48 +84,47 @@ def check_book_exists(authenticated_supabase_client: Client, isbn: str):
 def add_book_record_using_isbn(authenticated_supabase_client: Client,
                                isbn: str):
 
-    """Add a new record to the Supabase database."""
+    """Add a new record to the Supabase database.
+
+    Metadata already looked up by a scan preview is reused rather than fetched again.
+    """
 
     isbn = clean_isbn(isbn)
 
-    # Ensure the record is a dictionary with the required fields
+    books = authenticated_supabase_client.table("books").select("*").eq("isbn", isbn).execute().data
 
-    if not check_book_exists(authenticated_supabase_client, isbn):
+    if not books:
 
-        book_record = create_book_record_using_isbn(isbn)
+        book_record = get_enriched_book_record(isbn)
         if book_record['title'] is None:
             return {"message": "Failed to create book record.", "data": None}
 
-        authenticated_supabase_client.table("books").insert(book_record).execute()
+        books = authenticated_supabase_client.table("books").insert(book_record).execute().data
 
-    # use the ISBN to find the corresponding book_id - 1:1 relationship
-    book_id = authenticated_supabase_client.table("books").select("book_id").eq("isbn", isbn).execute().data[0]
-    book_details = authenticated_supabase_client.table("books").select("*").eq("isbn", isbn).execute().data[0]
+        # keep the cover index in step with newly enriched books
+        add_book_covers_to_index_in_background({isbn: book_record['cover_url_thumbnail']})
 
-    # get user's active library
-    user_id = str(authenticated_supabase_client.auth.get_user().user.id)
-    user_libraries = authenticated_supabase_client.table("library_users").select("*").eq("user_id", user_id).execute()
+    # 1:1 relationship between ISBN and book_id
+    book_details = books[0]
 
-    # could be multiple libraries, but for now we assume one
-    if user_libraries.data:
-        library_id = user_libraries.data[0]['library_id']
-    else:
+    # get user's active library
+    library_id = get_user_library_id(authenticated_supabase_client)
+    if library_id is None:
         return {"message": "User does not have an active library. Re-direct to library creation.", "data": None}
 
     # check if book already exists in user's library
-    existing_book = authenticated_supabase_client.table("user_library_books").select("*").eq("book_id", book_id['book_id']).eq("library_id", library_id).execute()
+    existing_book = authenticated_supabase_client.table("user_library_books").select("*").eq("book_id", book_details['book_id']).eq("library_id", library_id).execute()
     if existing_book.data:
         # if it exists, increment the number of copies owned
         num_copies = existing_book.data[0]['num_copies_owned'] + 1
-        authenticated_supabase_client.table("user_library_books").update({"num_copies_owned": num_copies}).eq("book_id", book_id['book_id']).eq("library_id", library_id).execute()
-        book_details = authenticated_supabase_client.table("books").select("*").eq("isbn", isbn).execute().data[0]
+        authenticated_supabase_client.table("user_library_books").update({"num_copies_owned": num_copies}).eq("book_id", book_details['book_id']).eq("library_id", library_id).execute()
 
         return {"message": "Book already exists in user's library. Incremented number of copies.", "data": book_details}
 
     else:
         # add book to user's library
         authenticated_supabase_client.table("user_library_books").insert({
-            "book_id": book_id['book_id'],
+            "book_id": book_details['book_id'],
             "num_copies_owned": 1,
             "location_info": "Unknown",
             "library_id": library_id
@@ -109,6 +133,108 @@ def add_book_record_using_isbn(authenticated_supabase_client: Client,
         return {"message": f"Added new book to user's library.", "data": book_details}
 
 
+def preview_book_using_isbn(authenticated_supabase_client: Client, isbn: str):
+
+    """Return whatever is already known about an ISBN without blocking on metadata lookups.
+
+    Unknown books have their metadata looked up in the background, so committing
+    the scan with add_book_record_using_isbn reuses the result.
+    """
+
+    isbn = clean_isbn(isbn)
+
+    books = authenticated_supabase_client.table("books").select("*").eq("isbn", isbn).execute().data
+    if books:
+        return {"message": "Book found.", "status": "known", "data": books[0]}
+
+    cached_record = get_cached_book_record(isbn)
+    if cached_record is not None:
+        return {"message": "Book details found in cache.", "status": "cached", "data": cached_record}
+
+    start_book_enrichment(isbn)
+
+    return {"message": "Looking up book details.", "status": "enriching", "data": {"isbn": isbn}}
+
+
+def get_user_library_id(authenticated_supabase_client: Client):
+
+    """Get the current user's active library ID, or None if they do not have one."""
+
+    user_id = str(authenticated_supabase_client.auth.get_user().user.id)
+    user_libraries = authenticated_supabase_client.table("library_users").select("library_id").eq("user_id", user_id).execute()
+
+    # could be multiple libraries, but for now we assume one
+    if user_libraries.data:
+        return user_libraries.data[0]['library_id']
+
+    return None
+
+
+def add_book_records_using_isbns(authenticated_supabase_client: Client, isbns: list):
+
+    """Add several books to the user's library at once, using set-based reads and writes.
+
+    Each ISBN counts as one copy, however many times it appears in the list. ISBNs whose metadata
+    lookup fails are not added, and are returned in "failures".
+    """
+
+    isbns = list(dict.fromkeys(clean_isbn(isbn) for isbn in isbns))
+    if not isbns:
+        return {"message": "No ISBNs provided.", "data": [], "failures": []}
+
+    library_id = get_user_library_id(authenticated_supabase_client)
+    if library_id is None:
+        return {"message": "User does not have an active library. Re-direct to library creation.", "data": None, "failures": []}
+
+    existing_isbns = {book['isbn'] for book in authenticated_supabase_client.table("books").select("isbn").in_("isbn", isbns).execute().data}
+    missing_isbns = [isbn for isbn in isbns if isbn not in existing_isbns]
+
+    if missing_isbns:
+        # metadata lookups are network-bound, so run them side by side
+        with ThreadPoolExecutor(max_workers=min(len(missing_isbns), METADATA_LOOKUP_WORKERS)) as executor:
+            new_book_records = list(executor.map(get_enriched_book_record, missing_isbns))
+
+        # failed lookups come back as placeholders, which must not become books in anyone's library
+        failed_isbns = [book_record['isbn'] for book_record in new_book_records if book_record['title'] == "Unknown Title"]
+        new_book_records = [book_record for book_record in new_book_records if book_record['title'] != "Unknown Title"]
+
+        if new_book_records:
+            authenticated_supabase_client.table("books").insert(new_book_records).execute()
+
+            add_book_covers_to_index_in_background({book_record['isbn']: book_record['cover_url_thumbnail']
+                                                    for book_record in new_book_records})
+    else:
+        failed_isbns = []
+
+    found_isbns = [isbn for isbn in isbns if isbn not in failed_isbns]
+    if not found_isbns:
+        return {"message": f"Could not find book details for {len(failed_isbns)} ISBNs.", "data": [], "failures": failed_isbns}
+
+    book_details = authenticated_supabase_client.table("books").select("*").in_("isbn", found_isbns).execute().data
+    book_ids = [book['book_id'] for book in book_details]
+
+    existing_library_books = authenticated_supabase_client.table("user_library_books").select("*").eq("library_id", library_id).in_("book_id", book_ids).execute().data
+    existing_book_ids = {library_book['book_id'] for library_book in existing_library_books}
+
+    # existing rows carry their primary key, so upserting them increments the copies in one statement
+    if existing_library_books:
+        for library_book in existing_library_books:
+            library_book['num_copies_owned'] += 1
+        authenticated_supabase_client.table("user_library_books").upsert(existing_library_books).execute()
+
+    new_library_books = [{"book_id": book_id, "num_copies_owned": 1, "location_info": "Unknown", "library_id": library_id}
+                         for book_id in book_ids if book_id not in existing_book_ids]
+
+    if new_library_books:
+        authenticated_supabase_client.table("user_library_books").insert(new_library_books).execute()
+
+    message = f"Added {len(new_library_books)} new books and incremented copies of {len(existing_library_books)} books in user's library."
+    if failed_isbns:
+        message += f" Could not find book details for {len(failed_isbns)} ISBNs."
+
+    return {"message": message, "data": book_details, "failures": failed_isbns}
+
+
 def add_record(authenticated_supabase_client: Client,
                table_name: str, record: dict):
 
@@ -142,6 +268,89 @@ def delete_record_by_id(authenticated_supabase_client: Client,
     authenticated_supabase_client.table(table_name).delete().eq(f"{id_field}", id).execute()
 
 
+def upload_file_by_content_hash(authenticated_supabase_client: Client, source, extension: str,
+                                content_hash: str = None, content_type: str = "application/octet-stream",
+                                bucket_name: str = "uploads"):
+
+    """Upload a file to storage under its content hash, skipping the upload if the same file is already stored.
+
+    Returns the storage path and whether the file already existed.
+    """
+
+    if content_hash is None:
+        content_hash = get_content_hash(source)
+
+    storage_path = f"public/{content_hash}{extension}"
+    bucket = authenticated_supabase_client.storage.from_(bucket_name)
+
+    if bucket.exists(storage_path):
+        return storage_path, True
+
+    try:
+        bucket.upload(file=source, path=storage_path, file_options={"cache-control": "3600", "content-type": content_type, "upsert": "false"})
+    except StorageException:
+        # a concurrent upload of the same content got there first
+        if not bucket.exists(storage_path):
+            raise
+        return storage_path, True
+
+    return storage_path, False
+
+
+def add_book_file_record(authenticated_supabase_client: Client, book_id: int, file_url: str):
+
+    """Link a stored file to a book, unless the book already points at it."""
+
+    existing_record = authenticated_supabase_client.table("book_files").select("book_id").eq("book_id", book_id).eq("book_file", file_url).execute()
+
+    if not existing_record.data:
+        add_record(authenticated_supabase_client, "book_files", {"book_file": file_url, "book_id": book_id})
+
+
+def upload_extracted_pages(authenticated_supabase_client: Client, content_hash: str, settings_key: str, pages_source,
+                           bucket_name: str = EXTRACTED_PAGES_BUCKET):
+
+    """Store the pages extracted from a file (as NDJSON bytes or a path to them) privately, so identical uploads can skip extraction.
+
+    The stored copy is keyed by the extraction settings too, so changing them re-extracts rather than serving stale text.
+    """
+
+    authenticated_supabase_client.storage.from_(bucket_name).upload(
+        file=pages_source,
+        path=f"private/{content_hash}.{settings_key}.pages.ndjson",
+        file_options={"content-type": "application/x-ndjson", "upsert": "true"}
+    )
+
+
+def download_extracted_pages(authenticated_supabase_client: Client, content_hash: str, settings_key: str,
+                             bucket_name: str = EXTRACTED_PAGES_BUCKET):
+
+    """Get an iterator over the pages previously extracted from a stored file with the given settings, or None if they were never stored.
+
+    Pages are streamed from storage a line at a time, so memory does not grow with the book's length.
+    """
+
+    try:
+        signed_url = authenticated_supabase_client.storage.from_(bucket_name).create_signed_url(
+            f"private/{content_hash}.{settings_key}.pages.ndjson", EXTRACTED_PAGES_URL_EXPIRY)["signedURL"]
+    except StorageException:
+        return None
+
+    return iter_ndjson_url(signed_url)
+
+
+def iter_ndjson_url(url: str):
+
+    """Yield the records of an NDJSON file at a URL as it downloads."""
+
+    with requests.get(url, stream=True, timeout=30) as response:
+        response.raise_for_status()
+
+        for line in response.iter_lines():
+            if line:
+                yield json.loads(line)
+
+
 def create_new_supabase_user(email: str, password: str):
 
     """Create a new user in the Supabase database."""
@@ -184,6 +393,16 @@ def check_session():
         return False
 
 
+def get_session_user_id():
+
+    """Get the signed-in user's ID, remembered in the session so it is only looked up once per login."""
+
+    if session.get('user_id') is None:
+        session['user_id'] = str(get_authenticated_client().auth.get_user().user.id)
+
+    return session['user_id']
+
+
 def check_if_user_is_admin(authenticated_supabase_client: Client):
 
     """Check if the current user is an admin."""
@@ -0,0 +1,121 @@
+import io
+import os
+import tempfile
+import zipfile
+
+from flask import Request
+
+# uploads up to this size are buffered in memory, larger ones spill to temp space
+UPLOAD_SPOOL_MAX_SIZE = int(os.environ.get("BOOKWORM_UPLOAD_SPOOL_MAX_SIZE", 16 * 1024 * 1024))
+
+# images accepted from a batch upload - anything else in a zip is ignored
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".bmp", ".webp", ".tif", ".tiff"}
+
+# most images accepted in one batch upload
+MAX_BATCH_IMAGES = int(os.environ.get("BOOKWORM_MAX_BATCH_IMAGES", 500))
+
+
+class SpooledUploadRequest(Request):
+
+    """Request that buffers uploaded files in memory, spilling to a named temp file past UPLOAD_SPOOL_MAX_SIZE.
+
+    Spilled files are created without delete-on-close, so pdfplumber, worker processes and storage uploads
+    can reopen them by path on Windows too. They are deleted when Flask closes the request at its end,
+    including when a route raises.
+    """
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+
+        if total_content_length is None or total_content_length > UPLOAD_SPOOL_MAX_SIZE:
+            spooled_file = tempfile.NamedTemporaryFile("wb+", suffix=os.path.splitext(filename or "")[1], delete=False)
+            self.__dict__.setdefault("_spooled_file_paths", []).append(spooled_file.name)
+            return spooled_file
+
+        return io.BytesIO()
+
+    def close(self):
+
+        try:
+            super().close()
+        finally:
+            for spooled_file_path in self.__dict__.pop("_spooled_file_paths", []):
+                try:
+                    os.remove(spooled_file_path)
+                except OSError:
+                    pass
+
+
+def get_upload_buffer(file):
+
+    """Get the contents of an uploaded file as a buffer, without copying in-memory uploads."""
+
+    if isinstance(file.stream, io.BytesIO):
+        return file.stream.getbuffer()
+
+    file.stream.seek(0)
+
+    return file.stream.read()
+
+
+def get_upload_source(file):
+
+    """Get an uploaded file as something worker processes can open - its temp file path if spilled, otherwise its bytes."""
+
+    if isinstance(file.stream, io.BytesIO):
+        return file.stream.getvalue()
+
+    stream_path = getattr(file.stream, 'name', None)
+
+    if isinstance(stream_path, str) and os.path.isfile(stream_path):
+        # make sure everything werkzeug wrote is visible to readers opening the path
+        file.stream.flush()
+        return stream_path
+
+    file.stream.seek(0)
+
+    return file.stream.read()
+
+
+def is_image_filename(filename: str):
+
+    """Check whether a filename has an image extension."""
+
+    return os.path.splitext(filename or "")[1].lower() in IMAGE_EXTENSIONS
+
+
+def get_zip_image_sources(source):
+
+    """List (filename, image source) pairs for the images in a zip upload, given as bytes or a file path.
+
+    Members of a spilled zip are returned as (zip path, member name) pairs so worker processes
+    read them straight from disk; members of an in-memory zip are returned as bytes.
+    """
+
+    zip_file = zipfile.ZipFile(io.BytesIO(source) if isinstance(source, bytes) else source)
+
+    with zip_file:
+        # skip folders and the resource forks macOS adds to zips
+        member_names = [info.filename for info in zip_file.infolist()
+                        if not info.is_dir() and not info.filename.startswith("__MACOSX/")
+                        and is_image_filename(info.filename)][:MAX_BATCH_IMAGES]
+
+        if isinstance(source, bytes):
+            return [(name, zip_file.read(name)) for name in member_names]
+
+    return [(name, (source, name)) for name in member_names]
+
+
+def read_image_source(source):
+
+    """Read an image source from a batch upload - bytes, a file path, or a (zip path, member name) pair."""
+
+    if isinstance(source, tuple):
+        zip_path, member_name = source
+        with zipfile.ZipFile(zip_path) as zip_file:
+            return zip_file.read(member_name)
+
+    if isinstance(source, str):
+        with open(source, "rb") as f:
+            return f.read()
+
+    return source